@@ -0,0 +1,296 @@
+"""
+Classify a whole mailbox's history through the OpenAI Batch API, at half the
+price of live calls and without their rate limits.
+
+Every step saves its progress in SQLite, so the command can be stopped and
+rerun at any point and picks up where it left off:
+
+1. fetch: page through the mailbox, newest first, storing each email's
+   classifier text (the same text the watcher classifies).
+2. prepare: write emails not yet in a batch to JSONL request files, up to
+   max_requests per file. Each line is the same chat completion request
+   OpenAIProvider makes, with the email id as its custom_id.
+3. submit: upload each file and create a batch job for it, unless an
+   earlier run already did and stopped before saving the job's id.
+4. poll: check the jobs, and merge the answers of finished ones into the
+   backfill_results table. Requests that errored or answered with something
+   that isn't a label are kept with their error, and emails from failed or
+   expired jobs go back to be batched again, up to max_attempts jobs each;
+   after that they're kept as errors too.
+
+    python backfill_openai.py run       # all of the above, until every job is merged
+    python backfill_openai.py stats
+
+Set OPENAI_BASE_URL to point at openai_standin.py for a dry run.
+"""
+import json
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from openai import OpenAI
+
+from classify_email import PROMPT
+from providers import LABELS, OpenAIProvider
+
+# The Batch API takes at most 50,000 requests per file
+MAX_REQUESTS_PER_BATCH = 50_000
+FINISHED_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+class Backfill:
+    def __init__(self, watcher, provider: OpenAIProvider, db_path: str = 'backfill.sqlite',
+                 batch_dir: str = 'backfill_batches', max_requests: int = MAX_REQUESTS_PER_BATCH,
+                 client: Optional[OpenAI] = None, max_attempts: int = 3):
+        self.watcher = watcher
+        self.provider = provider
+        self.client = client or provider.client
+        self.batch_dir = Path(batch_dir)
+        self.max_requests = max_requests
+        self.max_attempts = max_attempts
+
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS backfill_emails (
+            email_id TEXT PRIMARY KEY,
+            content TEXT,
+            batch_id TEXT,
+            attempts INTEGER DEFAULT 0
+        )
+        ''')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS backfill_batches (
+            batch_id TEXT PRIMARY KEY,
+            file_path TEXT,
+            request_count INTEGER,
+            openai_file_id TEXT,
+            openai_batch_id TEXT,
+            status TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS backfill_results (
+            email_id TEXT PRIMARY KEY,
+            label TEXT,
+            error TEXT,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER
+        )
+        ''')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS backfill_progress (
+            account_id TEXT PRIMARY KEY,
+            position INTEGER,
+            done INTEGER
+        )
+        ''')
+        self.conn.commit()
+
+    def fetch(self, page_size: int = 500, limit: Optional[int] = None) -> int:
+        """Store the next pages of the mailbox, from where the last fetch stopped. Returns how many were new."""
+        account_id = self.watcher.account_id
+        row = self.conn.execute('SELECT position, done FROM backfill_progress WHERE account_id = ?',
+                                (account_id,)).fetchone()
+        position, done = row if row else (0, 0)
+        added = 0
+        while not done and (limit is None or added < limit):
+            emails = self.watcher.get_recent_emails(limit=page_size, offset=position)
+            before = self.conn.total_changes
+            self.conn.executemany('INSERT OR IGNORE INTO backfill_emails (email_id, content) VALUES (?, ?)',
+                                  [(email['id'], self.watcher.email_content(email)) for email in emails])
+            added += self.conn.total_changes - before
+            position += len(emails)
+            done = int(len(emails) < page_size)
+            # Saved with the page, so a restart continues from the next one
+            self.conn.execute('INSERT OR REPLACE INTO backfill_progress (account_id, position, done) VALUES (?, ?, ?)',
+                              (account_id, position, done))
+            self.conn.commit()
+            print(f"Fetched {position} emails")
+        return added
+
+    def prepare(self) -> int:
+        """Write request files for emails without a batch. Returns how many files were written."""
+        self.batch_dir.mkdir(parents=True, exist_ok=True)
+        written = 0
+        while True:
+            rows = self.conn.execute('''
+            SELECT email_id, content FROM backfill_emails
+            WHERE batch_id IS NULL AND email_id NOT IN (SELECT email_id FROM backfill_results WHERE label IS NOT NULL)
+            LIMIT ?
+            ''', (self.max_requests,)).fetchall()
+            if not rows:
+                return written
+
+            count = self.conn.execute('SELECT COUNT(*) FROM backfill_batches').fetchone()[0]
+            batch_id = f"backfill-{count + 1:05d}"
+            file_path = self.batch_dir / f"{batch_id}.jsonl"
+            with open(file_path, 'w', encoding='utf-8') as f:
+                for email_id, content in rows:
+                    f.write(json.dumps({
+                        "custom_id": email_id,
+                        "method": "POST",
+                        "url": "/v1/chat/completions",
+                        "body": self.provider.request_args(content, PROMPT)
+                    }) + '\n')
+
+            self.conn.execute('INSERT INTO backfill_batches (batch_id, file_path, request_count, status) VALUES (?, ?, ?, ?)',
+                              (batch_id, str(file_path), len(rows), 'prepared'))
+            self.conn.executemany('UPDATE backfill_emails SET batch_id = ? WHERE email_id = ?',
+                                  [(batch_id, email_id) for email_id, _ in rows])
+            self.conn.commit()
+            written += 1
+
+    def submit(self) -> int:
+        """Upload and start every prepared batch. Returns how many were started."""
+        batches = self.conn.execute('''
+        SELECT batch_id, file_path, openai_file_id FROM backfill_batches WHERE status = 'prepared'
+        ''').fetchall()
+        for batch_id, file_path, file_id in batches:
+            job = None
+            if file_id is None:
+                # Saved before creating the job, so a crash in between doesn't upload twice
+                with open(file_path, 'rb') as f:
+                    file_id = self.client.files.create(file=f, purpose='batch').id
+                self.conn.execute('UPDATE backfill_batches SET openai_file_id = ? WHERE batch_id = ?', (file_id, batch_id))
+                self.conn.commit()
+            else:
+                # A crash after creating the job but before saving it would otherwise pay for the batch twice
+                job = self._find_job(batch_id, file_id)
+
+            if job is None:
+                job = self.client.batches.create(input_file_id=file_id, endpoint='/v1/chat/completions',
+                                                 completion_window='24h', metadata={'backfill_batch': batch_id})
+            self.conn.execute('UPDATE backfill_batches SET openai_batch_id = ?, status = ? WHERE batch_id = ?',
+                              (job.id, job.status, batch_id))
+            self.conn.commit()
+            print(f"Submitted {batch_id} as {job.id}")
+        return len(batches)
+
+    def _find_job(self, batch_id: str, file_id: str):
+        """The job an earlier run created for this batch, or None."""
+        for job in self.client.batches.list(limit=100):
+            if (job.metadata or {}).get('backfill_batch') == batch_id and job.input_file_id == file_id:
+                return job
+        return None
+
+    def poll(self) -> int:
+        """Check running jobs and merge finished ones. Returns how many are still running."""
+        running = self.conn.execute('''
+        SELECT batch_id, openai_batch_id FROM backfill_batches
+        WHERE openai_batch_id IS NOT NULL AND status NOT IN ('merged', 'failed', 'expired', 'cancelled')
+        ''').fetchall()
+
+        still_running = 0
+        for batch_id, openai_batch_id in running:
+            job = self.client.batches.retrieve(openai_batch_id)
+            if job.status not in FINISHED_STATUSES:
+                self.conn.execute('UPDATE backfill_batches SET status = ? WHERE batch_id = ?', (job.status, batch_id))
+                self.conn.commit()
+                still_running += 1
+                continue
+
+            # Expired and cancelled jobs still return whatever finished in time
+            for file_id in (job.output_file_id, job.error_file_id):
+                if file_id:
+                    self._merge(self.client.files.content(file_id).text)
+
+            # Anything without an answer goes back to be batched again, unless it's been in
+            # max_attempts jobs already: then it's an error, so a job that keeps failing
+            # isn't resubmitted forever
+            unanswered = 'batch_id = ? AND email_id NOT IN (SELECT email_id FROM backfill_results)'
+            self.conn.execute(f'UPDATE backfill_emails SET attempts = attempts + 1 WHERE {unanswered}', (batch_id,))
+            self.conn.execute(f'''
+            INSERT INTO backfill_results (email_id, error)
+            SELECT email_id, ? FROM backfill_emails WHERE {unanswered} AND attempts >= ?
+            ''', (json.dumps({'batch_status': job.status, 'attempts': self.max_attempts}), batch_id, self.max_attempts))
+            self.conn.execute(f'UPDATE backfill_emails SET batch_id = NULL WHERE {unanswered}', (batch_id,))
+            status = 'merged' if job.status == 'completed' else job.status
+            self.conn.execute('UPDATE backfill_batches SET status = ? WHERE batch_id = ?', (status, batch_id))
+            self.conn.commit()
+            counts = job.request_counts
+            print(f"{batch_id} {job.status}: {counts.completed if counts else '?'} completed, "
+                  f"{counts.failed if counts else '?'} failed")
+        return still_running
+
+    def _merge(self, output: str) -> None:
+        rows = []
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get('response') or {}
+            body = response.get('body') or {}
+            usage = body.get('usage') or {}
+            if response.get('status_code') == 200 and body.get('choices'):
+                content = body['choices'][0]['message']['content']
+                label, error = self.provider.label(content), None
+                if label not in LABELS:
+                    # Kept as an error, so retry-errors sends it again
+                    label, error = None, json.dumps({'invalid_label': content})
+            else:
+                label, error = None, json.dumps(result.get('error') or body.get('error') or response)
+            rows.append((result['custom_id'], label, error, usage.get('prompt_tokens'), usage.get('completion_tokens')))
+        # Replacing makes merging the same output twice harmless
+        self.conn.executemany('''
+        INSERT OR REPLACE INTO backfill_results (email_id, label, error, prompt_tokens, completion_tokens)
+        VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+
+    def retry_errors(self) -> int:
+        """Send emails whose request errored out in the next batch, with max_attempts jobs to go."""
+        cursor = self.conn.execute('''
+        UPDATE backfill_emails SET batch_id = NULL, attempts = 0
+        WHERE email_id IN (SELECT email_id FROM backfill_results WHERE label IS NULL)
+        ''')
+        self.conn.execute('DELETE FROM backfill_results WHERE label IS NULL')
+        self.conn.commit()
+        return cursor.rowcount
+
+    def run(self, poll_interval: float = 60) -> None:
+        self.fetch()
+        while True:
+            self.prepare()
+            self.submit()
+            if not self.poll() and not self.conn.execute(
+                    'SELECT 1 FROM backfill_emails WHERE batch_id IS NULL AND email_id NOT IN '
+                    '(SELECT email_id FROM backfill_results)').fetchone():
+                break
+            time.sleep(poll_interval)
+        print(self.stats())
+
+    def stats(self) -> Dict[str, int]:
+        one = lambda sql: self.conn.execute(sql).fetchone()[0] or 0
+        return {
+            'emails': one('SELECT COUNT(*) FROM backfill_emails'),
+            'labeled': one('SELECT COUNT(*) FROM backfill_results WHERE label IS NOT NULL'),
+            'errors': one('SELECT COUNT(*) FROM backfill_results WHERE label IS NULL'),
+            'batches_running': one("SELECT COUNT(*) FROM backfill_batches WHERE status NOT IN "
+                                   "('merged', 'failed', 'expired', 'cancelled')"),
+            'prompt_tokens': one('SELECT SUM(prompt_tokens) FROM backfill_results'),
+            'completion_tokens': one('SELECT SUM(completion_tokens) FROM backfill_results')
+        }
+
+if __name__ == "__main__":
+    from fastmail_watcher import FastmailWatcher, FASTMAIL_SESSION_URL
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'run'
+    api_token = os.getenv("FASTMAIL_API_TOKEN")
+    if not api_token:
+        raise ValueError("Please set FASTMAIL_API_TOKEN environment variable")
+
+    watcher = FastmailWatcher(api_token, session_url=os.getenv("FASTMAIL_SESSION_URL", FASTMAIL_SESSION_URL))
+    backfill = Backfill(watcher, OpenAIProvider(model=os.getenv("LLM_MODEL", "gpt-4o-mini"),
+                                                 decoding=os.getenv("LLM_DECODING", "free")),
+                        db_path=os.getenv("BACKFILL_PATH", "backfill.sqlite"))
+
+    if command == 'run':
+        backfill.run(poll_interval=float(os.getenv("BACKFILL_POLL_INTERVAL", "60")))
+    elif command == 'retry-errors':
+        print(f"Requeued {backfill.retry_errors()} emails")
+    elif command == 'stats':
+        print(backfill.stats())
+    else:
+        raise ValueError(f"Unknown command: {command}")
@@ -0,0 +1,111 @@
+"""
+Check the streaming HTML-to-markdown cleaner against the golden outputs in
+html_corpus/, then time it against the original BeautifulSoup cleaner.
+
+Run with --update to regenerate the golden .md files from the BeautifulSoup
+cleaner after adding new .html samples to the corpus.
+"""
+from pathlib import Path
+import re
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+from html_to_markdown import html_to_markdown
+
+CORPUS_DIR = Path(__file__).parent / 'html_corpus'
+
+def clean_html_email_with_soup(html_content):
+    """The original cleaner from fastmail_watcher.py, kept as the reference."""
+    if not html_content or not isinstance(html_content, str):
+        return ""
+
+    # Initialize BeautifulSoup
+    try:
+        soup = BeautifulSoup(html_content, 'html.parser')
+    except Exception:
+        soup = BeautifulSoup(html_content, 'html5lib')
+
+    # Remove unwanted elements
+    for element in soup(['script', 'style', 'head']):
+        element.decompose()
+
+    # Convert common HTML elements to markdown
+    for tag in soup.find_all(['strong', 'b']):
+        tag.replace_with(f'**{tag.get_text()}**')
+
+    for tag in soup.find_all(['em', 'i']):
+        tag.replace_with(f'*{tag.get_text()}*')
+
+    for tag in soup.find_all('a'):
+        url = tag.get('href', '')
+        text = tag.get_text()
+        tag.replace_with(f'[{text}]({url})')
+
+    for tag in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
+        level = int(tag.name[1])
+        text = tag.get_text()
+        tag.replace_with(f'\n{"#" * level} {text}\n')
+
+    # Convert lists
+    for tag in soup.find_all(['ul', 'ol']):
+        items = tag.find_all('li')
+        for i, item in enumerate(items):
+            prefix = '* ' if tag.name == 'ul' else f'{i+1}. '
+            item.replace_with(f'\n{prefix}{item.get_text()}')
+
+    # Get final text
+    text = soup.get_text(separator=' ')
+
+    # Clean up whitespace and special characters
+    text = re.sub(r'\n\s*\n', '\n\n', text)
+    text = re.sub(r' +', ' ', text)
+    text = text.strip()
+
+    return text
+
+def time_per_call(function, html, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(html)
+    return (time.perf_counter() - start) / repeat
+
+def main():
+    samples = sorted(CORPUS_DIR.glob('*.html'))
+    update = '--update' in sys.argv
+    failures = 0
+
+    for sample in samples:
+        failed = False
+        html = sample.read_text(encoding='utf-8')
+        golden_path = sample.with_suffix('.md')
+        if update:
+            golden_path.write_text(clean_html_email_with_soup(html), encoding='utf-8')
+
+        golden = golden_path.read_text(encoding='utf-8')
+        output = html_to_markdown(html)
+        if output != golden:
+            failed = True
+            print(f"MISMATCH {sample.name}")
+        if output[:1000] != html_to_markdown(html, max_chars=1000):
+            failed = True
+            print(f"MISMATCH {sample.name} with max_chars=1000")
+        # A sample counts once, however many of its checks failed
+        failures += failed
+
+    print(f"{len(samples) - failures}/{len(samples)} corpus samples match\n")
+
+    print(f"{'sample':<28}{'soup ms':>10}{'stream ms':>12}{'1000 chars ms':>16}")
+    for sample in samples:
+        html = sample.read_text(encoding='utf-8')
+        repeat = max(1, 200_000 // max(len(html), 1))
+        soup_time = time_per_call(clean_html_email_with_soup, html, repeat)
+        stream_time = time_per_call(html_to_markdown, html, repeat)
+        budget_time = time_per_call(lambda h: html_to_markdown(h, max_chars=1000), html, repeat)
+        print(f"{sample.name:<28}{soup_time * 1000:>10.2f}{stream_time * 1000:>12.2f}{budget_time * 1000:>16.2f}")
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
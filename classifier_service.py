@@ -0,0 +1,133 @@
+"""
+Keep a classifier loaded between CLI runs. The service builds the same
+provider stack as the watcher (from LLM_PROVIDER, LLM_MODEL and the cache and
+sender history paths) once, then answers classification requests over
+localhost HTTP, so one-shot commands skip loading models and clients:
+
+    LLM_PROVIDER=distilbert LLM_MODEL=fine_tuned_model python classifier_service.py
+    LLM_PROVIDER=service LLM_MODEL=http://localhost:8767 python fastmail_watcher.py
+    python evals.py --service http://localhost:8767
+
+POST /classify takes {"contents": [...]} and answers {"labels": [...]}; with
+a "prompt" each email is sent to the provider with it instead of going
+through the batching pipeline. GET /health reports what's loaded.
+"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from pipeline import classify_emails, _status_code
+
+class ClassifierService(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, provider, host: str = "localhost", port: int = 8767, concurrency: int = 8,
+                 description: Optional[str] = None):
+        super().__init__((host, port), _Handler)
+        self.provider = provider
+        self.concurrency = concurrency
+        self.description = description or type(provider).__name__
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.emails = 0
+        self.errors = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        """Serve from a background thread and return the URL for ServiceProvider."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.url
+
+    def classify(self, contents: List[str], prompt: Optional[str] = None) -> List[str]:
+        if prompt is not None:
+            return [self.provider.get_completion(content, prompt) for content in contents]
+        return classify_emails(self.provider, contents, concurrency=self.concurrency)
+
+    def health(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'provider': self.description,
+                'uptime_seconds': round(time.time() - self.started_at, 1),
+                'requests': self.requests,
+                'emails': self.emails,
+                'errors': self.errors
+            }
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: Dict[str, Any]) -> None:
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.split('?')[0] == '/health':
+            self._send(200, self.server.health())
+        else:
+            self._send(404, {'error': f"No such resource: {self.path}"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.split('?')[0] != '/classify':
+            self._send(404, {'error': f"No such resource: {self.path}"})
+            return
+
+        server = self.server
+        try:
+            request = json.loads(body)
+            contents = request['contents']
+        except (ValueError, KeyError) as e:
+            self._send(400, {'error': f"Expected {{\"contents\": [...]}}: {e}"})
+            return
+
+        try:
+            labels = server.classify(contents, request.get('prompt'))
+        except Exception as e:
+            with server.lock:
+                server.errors += 1
+            # Pass rate limits and outages through, so the client retries them
+            self._send(_status_code(e) or 500, {'error': f"{type(e).__name__}: {e}"})
+            return
+
+        with server.lock:
+            server.requests += 1
+            server.emails += len(contents)
+        self._send(200, {'labels': labels})
+
+if __name__ == "__main__":
+    from fastmail_watcher import build_provider
+
+    provider_type = os.getenv("LLM_PROVIDER", "openai")
+    model = os.getenv("LLM_MODEL", "gpt-4o")
+    provider = build_provider(
+        provider_type,
+        model,
+        cache_path=os.getenv("CLASSIFICATION_CACHE_PATH", "classification_cache.sqlite"),
+        sender_history_path=os.getenv("SENDER_HISTORY_PATH", "sender_history.sqlite"),
+        decoding=os.getenv("LLM_DECODING")
+    )
+
+    service = ClassifierService(
+        provider,
+        host=os.getenv("CLASSIFIER_SERVICE_HOST", "localhost"),
+        port=int(os.getenv("CLASSIFIER_SERVICE_PORT", "8767")),
+        concurrency=int(os.getenv("PROVIDER_CONCURRENCY", "8")),
+        description=f"{provider_type}:{model}"
+    )
+    print(f"Classifier service ({provider_type}:{model}) listening on {service.url}")
+    service.serve_forever()
@@ -3,20 +3,94 @@ Classify an email (already converted to text or markdown) into one of three
 categories using a language model.
 """
 
-from providers import LLMProvider
+import asyncio
+import json
+from typing import List, Optional
+
+from prompts import SYSTEM_PROMPT, BATCH_SYSTEM_PROMPT
+from providers import LLMProvider, LABELS
+
+# The prompts sent as each request's static system message, see prompts.py
+PROMPT = SYSTEM_PROMPT
+BATCH_PROMPT = BATCH_SYSTEM_PROMPT
+
+# Structured output for BATCH_PROMPT: one {id, label} entry per email
+BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "labels": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "label": {"type": "string", "enum": LABELS}
+                },
+                "required": ["id", "label"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["labels"],
+    "additionalProperties": False
+}
 
 def classify_email(provider: LLMProvider, content: str) -> str:
-    prompt = f"""You are my executive assistant, and you are excellent at sorting through my emails and labeling them as Inbox, FYI, or Junk.
+    return provider.get_completion(content, PROMPT)
 
-Inbox includes personal and professional correspondance with real humans that I know. It also may include automated emails from services I use when they require my action, for example login links. Also in inbox: investor updates, calendar invites. If they reference one of my projects such as The Browser Company, Muse, Ink & Switch, Heroku, or Local-First Conf then they usually go to the inbox.
+async def aclassify_email(provider: LLMProvider, content: str) -> str:
+    """
+    Async classify_email. Providers without aget_completion (like DistilBERT)
+    run their blocking get_completion in a worker thread.
+    """
+    if hasattr(provider, 'aget_completion'):
+        return await provider.aget_completion(content, PROMPT)
+    return await asyncio.to_thread(provider.get_completion, content, PROMPT)
 
-FYI includes order receipts (for example, from Amazon) and newsletters I've subscribed to such as Money Stuff, Tangle, Benedict Evans, Hacker Newsletter, Elicit, Butter Docs, and Kevin Lynagh. Also included in FYI: security alerts, Patreon project updates, and Readwise highlights. All newsletters from buttondown.email are in FYI.
+def format_email_batch(contents: List[str]) -> str:
+    return "\n\n".join(f"=== Email {i} ===\n{content}" for i, content in enumerate(contents, 1))
 
-Junk is any sale or promotion (even from a service I've purchased from) and newsletters that I never subscribed to. All Substack newsletters go to junk (I read them in the app instead).
+def batch_max_tokens(count: int) -> int:
+    # Each {"id": "12", "label": "inbox"} entry is about a dozen tokens
+    return 15 * count + 20
 
-Response to the email below the line with just the label, nothing else.
+def parse_batch_labels(completion: str, count: int) -> List[Optional[str]]:
+    """
+    Labels in the order of the batch's emails, from the JSON answer to
+    BATCH_PROMPT. None for any email the answer left out or labeled with
+    something that isn't a label.
+    """
+    labels = [None] * count
+    try:
+        entries = json.loads(completion).get("labels", [])
+    except (ValueError, AttributeError):
+        return labels
 
-The email to label is below.
----
-"""
-    return provider.get_completion(content, prompt)
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            index = int(str(entry.get("id", "")).strip()) - 1
+        except ValueError:
+            continue
+        label = str(entry.get("label", "")).strip().lower()
+        if 0 <= index < count and label in LABELS:
+            labels[index] = label
+    return labels
+
+def classify_email_batch(provider: LLMProvider, contents: List[str]) -> List[Optional[str]]:
+    """
+    Classify several emails in one request, for providers with
+    get_json_completion. Emails without a valid label in the answer come back
+    as None, for the caller to retry on their own.
+    """
+    completion = provider.get_json_completion(format_email_batch(contents), BATCH_PROMPT, BATCH_SCHEMA,
+                                              batch_max_tokens(len(contents)))
+    return parse_batch_labels(completion, len(contents))
+
+async def aclassify_email_batch(provider: LLMProvider, contents: List[str]) -> List[Optional[str]]:
+    if not hasattr(provider, 'aget_json_completion'):
+        return await asyncio.to_thread(classify_email_batch, provider, contents)
+    completion = await provider.aget_json_completion(format_email_batch(contents), BATCH_PROMPT, BATCH_SCHEMA,
+                                                     batch_max_tokens(len(contents)))
+    return parse_batch_labels(completion, len(contents))
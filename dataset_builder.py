@@ -7,7 +7,9 @@ import sqlite3
 from typing import Dict, Any
 import os, random
 
-from fastmail_watcher import FastmailWatcher
+from fastmail_watcher import FastmailWatcher, FASTMAIL_SESSION_URL
+from email_content import format_email_content
+from providers import SenderHistoryIndex
 
 def setup_database() -> sqlite3.Connection:
     """Create SQLite database and table if they don't exist."""
@@ -40,7 +42,8 @@ def get_user_label() -> str:
             return label
         print(f"Invalid label. Please choose from: {', '.join(valid_labels)}")
 
-def process_email(email: Dict[str, Any], conn: sqlite3.Connection) -> None:
+def process_email(email: Dict[str, Any], conn: sqlite3.Connection,
+                  sender_index: SenderHistoryIndex = None, knn=None) -> None:
     """Save labeled email to database."""
     cursor = conn.cursor()
     
@@ -80,6 +83,15 @@ def process_email(email: Dict[str, Any], conn: sqlite3.Connection) -> None:
     ))
     conn.commit()
 
+    # Human-confirmed, so the watcher can trust it for this sender's next email
+    if sender_index:
+        sender_index.record(email['from'][0]['email'], label)
+
+    # And the nearest-neighbour index uses it from the next email on
+    if knn:
+        knn.record(email['id'], format_email_content(email['from'][0]['name'], email['from'][0]['email'],
+                                                     email['subject'], email['body']), label)
+
 def build_dataset():
     # Storing the resulting dataset in SQLite
     conn = setup_database()
@@ -89,7 +101,17 @@ def build_dataset():
     if not api_token:
         raise ValueError("Please set FASTMAIL_API_TOKEN environment variable")
     
-    watcher = FastmailWatcher(api_token)
+    watcher = FastmailWatcher(api_token, session_url=os.getenv("FASTMAIL_SESSION_URL", FASTMAIL_SESSION_URL))
+    # Set to have the watcher's sender history learn each new label right away.
+    # Leave it unset while building the eval set, whose labels mustn't leak into it.
+    sender_index = None
+    if os.getenv("SENDER_HISTORY_PATH"):
+        sender_index = SenderHistoryIndex(os.getenv("SENDER_HISTORY_PATH"))
+    # Set to add each new label to a kNN index built by providers/knn_provider.py
+    knn = None
+    if os.getenv("KNN_INDEX_PATH"):
+        from providers import KnnProvider
+        knn = KnnProvider(os.getenv("KNN_INDEX_PATH"))
     
     while True:
         print("... Fetching some emails from Fastmail ...")
@@ -98,7 +120,7 @@ def build_dataset():
         # Process each email
         for email in emails:
             try:
-                process_email(email, conn)
+                process_email(email, conn, sender_index, knn)
             except KeyboardInterrupt:
                 print("\nStopping dataset collection...")
                 break
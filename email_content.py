@@ -0,0 +1,35 @@
+"""
+The text classifiers see for an email: a couple of header lines followed by
+the start of the body. Evals, fine-tuning and the watcher all build it here so
+they agree on the format, and wrappers like the rules stage can read the
+headers back out of it.
+"""
+import re
+from typing import Dict, Optional
+
+HEADER_LINE = re.compile(r'^(From|Subject): ?(.*)$')
+SENDER_ADDRESS = re.compile(r'<([^<>]*)>\s*$')
+
+def format_email_content(sender_name: str, sender_email: str, subject: str, body: str,
+                         max_body_chars: Optional[int] = 1000) -> str:
+    headers = f"From: {sender_name} <{sender_email}>\nSubject: {subject}\n"
+    body = body[:max_body_chars] if max_body_chars is not None else body
+    return f"{headers}\n{body}"
+
+def parse_email_content(content: str) -> Dict[str, str]:
+    """
+    Read the header lines back out of formatted content, as a dict with
+    sender_email and subject (empty strings when missing).
+    """
+    headers = {'sender_email': '', 'subject': ''}
+    for line in content.split('\n', 2)[:2]:
+        match = HEADER_LINE.match(line)
+        if not match:
+            break
+        name, value = match.groups()
+        if name == 'From':
+            address = SENDER_ADDRESS.search(value)
+            headers['sender_email'] = (address.group(1) if address else value).strip().lower()
+        else:
+            headers['subject'] = value
+    return headers
@@ -1,11 +1,48 @@
 import sqlite3
 import json
+import argparse
+import asyncio
+import csv
+import math
+import re
+import statistics
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 import time
 
 from classify_email import classify_email
-from providers import OpenAIProvider, OllamaProvider, DistilBertProvider
+from pipeline import classify_emails
+from email_content import format_email_content
+from providers import CachedProvider, RulesProvider, SenderHistoryProvider, SenderHistoryIndex
+from providers import RecordingProvider, ReplayProvider, create_provider
+
+# USD per million (input, cached input, output) tokens, matched by longest model name prefix
+PRICES = {
+    'gpt-4o': (2.50, 1.25, 10.00),
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+    'ft:gpt-4o-mini': (0.30, 0.15, 1.20),
+}
+
+# Providers compared by --benchmark, created (and their backends imported) only when selected
+BENCHMARK_PROVIDERS: Dict[str, Callable] = {
+    'gpt-4o': lambda: create_provider("openai", "gpt-4o"),
+    'gpt-4o-mini': lambda: create_provider("openai", "gpt-4o-mini"),
+    # Constrained decoding, for comparing invalid answers and output tokens with free text
+    'gpt-4o-mini:schema': lambda: create_provider("openai", "gpt-4o-mini", decoding="schema"),
+    'gpt-4o-mini:logit_bias': lambda: create_provider("openai", "gpt-4o-mini", decoding="logit_bias"),
+    'ft:gpt-4o-mini-2024-07-18:personal:emailtriage:Ajlgwmgb':
+        lambda: create_provider("openai", "ft:gpt-4o-mini-2024-07-18:personal:emailtriage:Ajlgwmgb"),
+    'llama3.2': lambda: create_provider("ollama", "llama3.2"),
+    'llama3.2:schema': lambda: create_provider("ollama", "llama3.2", decoding="schema"),
+    'distilbert': lambda: create_provider("distilbert", "fine_tuned_model", quantize=False,
+                                          feature_store_path="features.sqlite"),
+    # The same model with int8 Linear layers, to weigh its speed against any accuracy lost
+    'distilbert:int8': lambda: create_provider("distilbert", "fine_tuned_model", quantize=True,
+                                               feature_store_path="features.sqlite"),
+    'linear': lambda: create_provider("linear", "linear_model.npz"),
+    'knn': lambda: create_provider("knn", "knn_index"),
+    'cascade': lambda: create_provider("cascade", "linear:linear_model.npz@0.9,openai:gpt-4o-mini@0.8,openai:gpt-4o"),
+}
 
 def load_test_data(db_path) -> List[Tuple[str, str]]:
     """
@@ -21,9 +58,15 @@ def load_test_data(db_path) -> List[Tuple[str, str]]:
     conn.close()
     return examples
 
-def evaluate_classifier(db_path, provider) -> Dict:
+def evaluate_classifier(db_path, provider, concurrency: int = 1, progress: bool = True,
+                        batch_size: Optional[int] = None) -> Dict:
     """
-    Run evals using examples from the SQLite database.
+    Run evals using examples from the SQLite database. Local models classify
+    the whole set in batches; with concurrency > 1 other providers' calls run
+    in parallel through the async pipeline. With progress=False they go
+    through the pipeline (and its retries) at concurrency 1 too, instead of
+    printing progress as each example is classified. batch_size packs that
+    many emails into each request for providers that support it.
     """
     
     examples = load_test_data(db_path)
@@ -35,11 +78,16 @@ def evaluate_classifier(db_path, provider) -> Dict:
     
     print(f"Evaluating {total} examples...")
 
-    # Run evaluation
-    for body, sender_name, sender_email, subject, expected in examples:
-        content = f"From: {sender_name} <{sender_email}>\nSubject: {subject}\n\n{body[:1000]}"
+    contents = [format_email_content(sender_name, sender_email, subject, body)
+                for body, sender_name, sender_email, subject, _ in examples]
+    if concurrency > 1 or not progress or batch_size or hasattr(provider, 'classify_batch'):
+        predictions = classify_emails(provider, contents, concurrency=concurrency, batch_size=batch_size)
+    else:
+        # Lazily, so progress prints as each example is classified
+        predictions = (classify_email(provider, content) for content in contents)
 
-        predicted = classify_email(provider, content)
+    # Run evaluation
+    for (body, sender_name, sender_email, subject, expected), content, predicted in zip(examples, contents, predictions):
         is_correct = predicted == expected
         
         if is_correct:
@@ -65,27 +113,352 @@ def evaluate_classifier(db_path, provider) -> Dict:
         'detailed_results': results
     }
 
+class TimedProvider:
+    """
+    Wraps a provider for benchmarking and records each call's latency and the
+    token usage the provider reported for it (OpenAI and Ollama do).
+    """
+    def __init__(self, provider):
+        self.provider = provider
+        self.calls = []
+        if hasattr(provider, 'classify_batch'):
+            self.classify_batch = self._classify_batch
+        if hasattr(provider, 'get_json_completion'):
+            self.get_json_completion = self._get_json_completion
+            self.aget_json_completion = self._aget_json_completion
+
+    def _record(self, start: float, emails: int = 1) -> None:
+        latency = time.perf_counter() - start
+        usage = getattr(self.provider, 'last_usage', None) or {}
+        self.calls.append({
+            'latency': latency,
+            'emails': emails,
+            'prompt_tokens': usage.get('prompt_tokens', 0),
+            'cached_tokens': usage.get('cached_tokens', 0),
+            'completion_tokens': usage.get('completion_tokens', 0)
+        })
+
+    def get_completion(self, content: str, prompt: str) -> str:
+        start = time.perf_counter()
+        completion = self.provider.get_completion(content, prompt)
+        self._record(start)
+        return completion
+
+    async def aget_completion(self, content: str, prompt: str) -> str:
+        start = time.perf_counter()
+        if hasattr(self.provider, 'aget_completion'):
+            completion = await self.provider.aget_completion(content, prompt)
+        else:
+            completion = await asyncio.to_thread(self.provider.get_completion, content, prompt)
+        self._record(start)
+        return completion
+
+    def _classify_batch(self, contents: List[str]) -> List[str]:
+        start = time.perf_counter()
+        labels = self.provider.classify_batch(contents)
+        self._record(start, emails=len(contents))
+        return labels
+
+    def _get_json_completion(self, content: str, prompt: str, schema: Dict, max_tokens: int) -> str:
+        start = time.perf_counter()
+        completion = self.provider.get_json_completion(content, prompt, schema, max_tokens)
+        self._record(start, emails=content.count('=== Email '))
+        return completion
+
+    async def _aget_json_completion(self, content: str, prompt: str, schema: Dict, max_tokens: int) -> str:
+        start = time.perf_counter()
+        if hasattr(self.provider, 'aget_json_completion'):
+            completion = await self.provider.aget_json_completion(content, prompt, schema, max_tokens)
+        else:
+            completion = await asyncio.to_thread(self.provider.get_json_completion, content, prompt, schema, max_tokens)
+        self._record(start, emails=content.count('=== Email '))
+        return completion
+
+def percentile(values: Sequence[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile, None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def model_price(model: str) -> Optional[Tuple[float, float]]:
+    matches = [prefix for prefix in PRICES if model.startswith(prefix)]
+    return PRICES[max(matches, key=len)] if matches else None
+
+def confusion_matrix(results: List[Dict]) -> Dict[str, Dict[str, int]]:
+    """Counts keyed by expected label, then predicted label."""
+    matrix = {}
+    for result in results:
+        row = matrix.setdefault(result['expected'], {})
+        row[result['predicted']] = row.get(result['predicted'], 0) + 1
+    return matrix
+
+def tokens_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> Optional[float]:
+    """Cached tokens are the part of prompt_tokens read from the prompt cache."""
+    price = model_price(model)
+    if price:
+        return ((prompt_tokens - cached_tokens) * price[0] + cached_tokens * price[1]
+                + completion_tokens * price[2]) / 1_000_000
+    # Local models use no tokens and cost nothing per call
+    return 0.0 if not prompt_tokens and not completion_tokens else None
+
+def price_tiers(tiers: List[Dict]) -> List[Dict]:
+    """Adds each cascade tier's cost, priced by its model name."""
+    for tier in tiers:
+        tier['cost_usd'] = tokens_cost(tier['name'], tier['prompt_tokens'], tier['completion_tokens'], tier['cached_tokens'])
+    return tiers
+
+def summarize_run(name: str, run: int, concurrency: int, results: Dict, calls: List[Dict],
+                  elapsed: float, batch_size: Optional[int] = None,
+                  tiers: Optional[List[Dict]] = None, label_stats: Optional[Dict] = None) -> Dict:
+    """
+    One benchmark run's numbers. For a cascade, tiers are its tier_stats(),
+    priced per tier by model name, and the run's tokens and cost are theirs.
+    label_stats counts the provider's answers that weren't just a label.
+    """
+    latencies = [call['latency'] * 1000 for call in calls]
+    prompt_tokens = sum(call['prompt_tokens'] for call in calls)
+    cached_tokens = sum(call['cached_tokens'] for call in calls)
+    completion_tokens = sum(call['completion_tokens'] for call in calls)
+    cost = None
+    if tiers:
+        price_tiers(tiers)
+        prompt_tokens = sum(tier['prompt_tokens'] for tier in tiers)
+        cached_tokens = sum(tier['cached_tokens'] for tier in tiers)
+        completion_tokens = sum(tier['completion_tokens'] for tier in tiers)
+        costs = [tier['cost_usd'] for tier in tiers]
+        cost = sum(costs) if None not in costs else None
+    elif model_price(name):
+        cost = tokens_cost(name, prompt_tokens, completion_tokens, cached_tokens)
+
+    summary = {
+        'provider': name,
+        'run': run,
+        'concurrency': concurrency,
+        'batch_size': batch_size,
+        'examples': results['total_examples'],
+        'accuracy': results['accuracy'],
+        'calls': len(calls),
+        'latency_ms_p50': percentile(latencies, 50),
+        'latency_ms_p95': percentile(latencies, 95),
+        'latency_ms_p99': percentile(latencies, 99),
+        'latency_ms_mean': statistics.mean(latencies) if latencies else None,
+        'prompt_tokens': prompt_tokens,
+        'cached_tokens': cached_tokens,
+        'cached_share': cached_tokens / prompt_tokens if prompt_tokens else None,
+        'completion_tokens': completion_tokens,
+        'cost_usd': cost,
+        'cost_per_1000_emails': cost * 1000 / results['total_examples'] if cost is not None and results['total_examples'] else None,
+        'elapsed_seconds': elapsed,
+        'emails_per_second': results['total_examples'] / elapsed if elapsed else None,
+        'confusion_matrix': confusion_matrix(results['detailed_results'])
+    }
+    if label_stats:
+        summary['normalized_answers'] = label_stats['normalized']
+        summary['invalid_answers'] = label_stats['invalid']
+        summary['invalid_rate'] = label_stats['invalid_rate']
+    if tiers:
+        first = tiers[0]
+        summary['escalation_rate'] = first['escalated'] / first['emails'] if first['emails'] else None
+        summary['tiers'] = tiers
+    return summary
+
+def fixture_path(fixtures_dir: str, name: str) -> str:
+    return str(Path(fixtures_dir) / (re.sub(r'[^\w.-]', '_', name) + '.json'))
+
+def benchmark_providers(db_path, providers: Dict[str, Callable], runs: int = 1,
+                        concurrency_levels: Sequence[int] = (1,), report_path: str = 'benchmark_report.json',
+                        record_dir: Optional[str] = None, replay_dir: Optional[str] = None,
+                        latency: Optional[float] = None, error_rate: float = 0.0,
+                        batch_sizes: Sequence[Optional[int]] = (None,)) -> List[Dict]:
+    """
+    Evaluate each provider over the same dataset `runs` times at each
+    concurrency level, with per-call latency, token usage, cost and throughput.
+    Each batch size in batch_sizes is a separate mode (None for one email per
+    request), run for the providers that support batches, so the accuracy
+    and cost of batching can be compared with single emails.
+    Providers are given as factories keyed by model name, which is also used to
+    look up prices. Results are written to report_path as JSON and next to it
+    as CSV (without the confusion matrices).
+
+    With record_dir, API providers' responses are saved there as fixtures;
+    with replay_dir they're answered from those fixtures, recorded latency
+    included, so benchmarks can run offline. Local batch models aren't recorded
+    and always run live. latency and error_rate are injected into replayed
+    calls (see ReplayProvider) for load testing; injected errors are retried
+    by the pipeline like real 503s.
+    """
+    summaries = []
+    for name, make_provider in providers.items():
+        recorder = None
+        if replay_dir and Path(fixture_path(replay_dir, name)).exists():
+            provider = ReplayProvider(fixture_path(replay_dir, name), replay_latency=True,
+                                      latency=latency, error_rate=error_rate)
+        else:
+            provider = make_provider()
+            if record_dir and not hasattr(provider, 'classify_batch'):
+                Path(record_dir).mkdir(parents=True, exist_ok=True)
+                provider = recorder = RecordingProvider(provider, fixture_path(record_dir, name))
+
+        for batch_size in batch_sizes:
+            if batch_size and not hasattr(provider, 'get_json_completion'):
+                continue
+            for concurrency in concurrency_levels:
+                for run in range(1, runs + 1):
+                    mode = f"batches of {batch_size}" if batch_size else "single emails"
+                    print(f"\n{name}, {mode}, concurrency {concurrency}, run {run}/{runs}")
+                    timed = TimedProvider(provider)
+                    if hasattr(provider, 'reset_stats'):
+                        provider.reset_stats()
+                    if hasattr(provider, 'label_stats'):
+                        provider.label_stats.reset()
+                    start = time.perf_counter()
+                    results = evaluate_classifier(db_path, timed, concurrency=concurrency, progress=False,
+                                                  batch_size=batch_size)
+                    tiers = provider.tier_stats() if hasattr(provider, 'tier_stats') else None
+                    label_stats = provider.label_stats.as_dict() if hasattr(provider, 'label_stats') else None
+                    summaries.append(summarize_run(name, run, concurrency, results, timed.calls,
+                                                   time.perf_counter() - start, batch_size, tiers, label_stats))
+        if recorder:
+            recorder.save()
+
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump({'dataset': db_path, 'runs': summaries}, f, indent=2)
+    columns = []
+    for summary in summaries:
+        columns += [column for column in summary if column not in columns and column not in ('confusion_matrix', 'tiers')]
+    with open(Path(report_path).with_suffix('.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(summaries)
+    return summaries
+
+def fmt(value, spec: str) -> str:
+    return format(value, spec) if value is not None else '-'
+
+def print_benchmark(summaries: List[Dict]) -> None:
+    """One line per provider, batch size and concurrency level, averaged over runs."""
+
+    print(f"\n{'provider':<32}{'batch':>6}{'conc':>5}{'acc':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'tok in':>9}{'cached':>8}{'tok out':>8}{'cost $':>9}{'emails/s':>10}{'invalid':>9}")
+    groups = {}
+    for summary in summaries:
+        groups.setdefault((summary['provider'], summary['batch_size'], summary['concurrency']), []).append(summary)
+    for (name, batch_size, concurrency), group in groups.items():
+        def mean(key):
+            values = [summary[key] for summary in group if summary.get(key) is not None]
+            return statistics.mean(values) if values else None
+        print(f"{name[:31]:<32}{batch_size or 1:>6}{concurrency:>5}{fmt(mean('accuracy'), '.1%'):>8}"
+              f"{fmt(mean('latency_ms_p50'), '.0f'):>9}{fmt(mean('latency_ms_p95'), '.0f'):>9}"
+              f"{fmt(mean('latency_ms_p99'), '.0f'):>9}{fmt(mean('prompt_tokens'), '.0f'):>9}"
+              f"{fmt(mean('cached_share'), '.0%'):>8}"
+              f"{fmt(mean('completion_tokens'), '.0f'):>8}{fmt(mean('cost_usd'), '.4f'):>9}"
+              f"{fmt(mean('emails_per_second'), '.1f'):>10}{fmt(mean('invalid_rate'), '.1%'):>9}")
+        if 'tiers' in group[0]:
+            print_tiers([summary['tiers'] for summary in group])
+
+def print_tiers(runs: List[List[Dict]]) -> None:
+    """A cascade's tiers under its benchmark line, averaged over runs."""
+    for i, tier in enumerate(runs[0]):
+        tier_name = tier['name']
+        def mean(key):
+            values = [run[i][key] for run in runs if run[i][key] is not None]
+            return statistics.mean(values) if values else None
+        emails, kept, share = mean('emails'), mean('kept'), mean('share_of_emails')
+        print(f"  tier {tier_name[:40]:<41} saw {fmt(share, '.0%'):>5} of emails, kept "
+              f"{fmt(kept / emails if emails else None, '.0%'):>5}, {fmt(mean('mean_latency_ms'), '.0f'):>6} ms/call, "
+              f"${fmt(mean('cost_usd'), '.4f')}")
+
 if __name__ == "__main__":
     db_path = 'datasets/for-evals.sqlite'
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmark', action='store_true', help='compare providers instead of a single eval')
+    parser.add_argument('--providers', nargs='+', choices=list(BENCHMARK_PROVIDERS), default=list(BENCHMARK_PROVIDERS))
+    parser.add_argument('--runs', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--report', default='benchmark_report.json')
+    parser.add_argument('--record', metavar='DIR', help='save API responses as fixtures in DIR')
+    parser.add_argument('--replay', metavar='DIR', help='answer from fixtures in DIR instead of the APIs')
+    parser.add_argument('--latency', type=float, help='with --replay, seconds every call takes instead of the recorded time')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='with --replay, share of calls that fail with a 503')
+    parser.add_argument('--batch-size', type=int, nargs='*', default=[],
+                        help='also run with this many emails per request, to compare with single emails')
+    parser.add_argument('--service', metavar='URL', help='classify through a running classifier_service.py')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        summaries = benchmark_providers(
+            db_path, {name: BENCHMARK_PROVIDERS[name] for name in args.providers},
+            runs=args.runs, concurrency_levels=args.concurrency, report_path=args.report,
+            record_dir=args.record, replay_dir=args.replay, latency=args.latency, error_rate=args.error_rate,
+            batch_sizes=[None] + args.batch_size
+        )
+        print_benchmark(summaries)
+        print(f"\nReport written to {args.report}")
+        raise SystemExit
     
-    # provider = OpenAIProvider(model="gpt-4o")
-    # provider = OpenAIProvider(model="gpt-4o-mini")
-    # provider = OllamaProvider(model="llama3.2")
-    # provider = DistilBertProvider()
-    provider = OpenAIProvider(model="ft:gpt-4o-mini-2024-07-18:personal:emailtriage:Ajlgwmgb")
+    # provider = create_provider("openai", "gpt-4o")
+    # provider = create_provider("openai", "gpt-4o-mini")
+    # provider = create_provider("openai", "gpt-4o-mini", decoding="logit_bias")
+    # provider = create_provider("ollama", "llama3.2")
+    # provider = create_provider("distilbert", "fine_tuned_model", feature_store_path="features.sqlite")
+    # provider = create_provider("linear", "linear_model.npz")
+    # provider = create_provider("knn", "knn_index")
+    # provider = create_provider("cascade", "linear:linear_model.npz@0.9,openai:gpt-4o-mini@0.8,openai:gpt-4o")
+    provider = create_provider("openai", "ft:gpt-4o-mini-2024-07-18:personal:emailtriage:Ajlgwmgb")
+    if args.service:
+        # A model already loaded by classifier_service.py
+        provider = create_provider("service", args.service)
+
+    cascade = provider if hasattr(provider, 'tier_stats') else None
+    label_stats = provider.label_stats if hasattr(provider, 'label_stats') else None
+
+    # Re-runs with an unchanged prompt and model are answered from the cache.
+    # Local models are cheaper to re-run in batches than to cache.
+    cache = None
+    if not hasattr(provider, 'classify_batch'):
+        provider = cache = CachedProvider(provider)
+
+    # Repeat senders are answered from the fine-tuning set's labels (never the
+    # eval set's, which would be grading the answers against themselves), in
+    # an index of their own rather than the watcher's, which has more labels
+    history = None
+    if Path('datasets/for-finetuning.sqlite').exists():
+        index = SenderHistoryIndex('eval_sender_history.sqlite')
+        index.update_from_dataset('datasets/for-finetuning.sqlite')
+        provider = history = SenderHistoryProvider(provider, index)
+
+    # Emails matching the deterministic rules never reach the model
+    provider = rules = RulesProvider(provider)
 
-    start_time = time.time()
+    start_time = time.perf_counter()
     
     try:
-        results = evaluate_classifier(db_path, provider=provider)
+        results = evaluate_classifier(db_path, provider=provider, concurrency=8)
         
-        elapsed_time = time.time() - start_time
+        elapsed_time = time.perf_counter() - start_time
         
         print(f"\nEvaluation Results:")
         print(f"Total examples: {results['total_examples']}")
         print(f"Correct predictions: {results['correct_predictions']}")
         print(f"Accuracy: {results['accuracy']:.2%}")
         print(f"Total time: {elapsed_time:.2f} seconds")
+        print(f"Rule hits: {rules.stats()}")
+        if history:
+            history_stats = history.stats()
+            print(f"Sender history: answered {history_stats['answered_from_history']}, "
+                  f"{history_stats['calls_avoided']:.0%} of provider calls avoided")
+        if label_stats:
+            answers = label_stats.as_dict()
+            print(f"Model answers: {answers['normalized']} normalized to a label, {answers['invalid']} invalid "
+                  f"({fmt(answers['invalid_rate'], '.1%')})")
+        if cascade:
+            print(f"Cascade: {fmt(cascade.escalation_rate(), '.0%')} escalated past the first tier")
+            print_tiers([price_tiers(cascade.tier_stats())])
+        if cache:
+            cache_stats = cache.stats()
+            print(f"Cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%})")
     
     except Exception as e:
         print(f"Error during evaluation: {str(e)}")
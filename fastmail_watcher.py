@@ -1,228 +1,471 @@
 import requests
 import json
 
-from bs4 import BeautifulSoup
-import re
+from html_to_markdown import html_to_markdown, clean_whitespace
 
 import time
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import os
 
-from openai import OpenAI
+from pipeline import classify_emails
+from email_content import format_email_content
+from providers import CachedProvider, RulesProvider, SenderHistoryProvider, SenderHistoryIndex, create_provider
+from sync_state import SyncStateStore
+from label_applier import LabelApplier
 
-from classify_email import classify_email
-from providers import OpenAIProvider, OllamaProvider
-
-def clean_html_email_with_markdown(html_content):
+def clean_html_email_with_markdown(html_content, max_chars: Optional[int] = None):
     """
     Convert HTML email content to markdown while preserving basic formatting.
     
     Args:
         html_content (str): HTML content from email
+        max_chars (int): Stop once this much text has been produced
         
     Returns:
         str: Markdown version of the content
     """
-    if not html_content or not isinstance(html_content, str):
-        return ""
-    
-    # Initialize BeautifulSoup
-    try:
-        soup = BeautifulSoup(html_content, 'html.parser')
-    except Exception:
-        soup = BeautifulSoup(html_content, 'html5lib')
-    
-    # Remove unwanted elements
-    for element in soup(['script', 'style', 'head']):
-        element.decompose()
-    
-    # Convert common HTML elements to markdown
-    for tag in soup.find_all(['strong', 'b']):
-        tag.replace_with(f'**{tag.get_text()}**')
-    
-    for tag in soup.find_all(['em', 'i']):
-        tag.replace_with(f'*{tag.get_text()}*')
-    
-    for tag in soup.find_all('a'):
-        url = tag.get('href', '')
-        text = tag.get_text()
-        tag.replace_with(f'[{text}]({url})')
-    
-    for tag in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
-        level = int(tag.name[1])
-        text = tag.get_text()
-        tag.replace_with(f'\n{"#" * level} {text}\n')
-    
-    # Convert lists
-    for tag in soup.find_all(['ul', 'ol']):
-        items = tag.find_all('li')
-        for i, item in enumerate(items):
-            prefix = '* ' if tag.name == 'ul' else f'{i+1}. '
-            item.replace_with(f'\n{prefix}{item.get_text()}')
-    
-    # Get final text
-    text = soup.get_text(separator=' ')
-    
-    # Clean up whitespace and special characters
-    text = re.sub(r'\n\s*\n', '\n\n', text)
-    text = re.sub(r' +', ' ', text)
-    text = text.strip()
-    
-    return text
+    return html_to_markdown(html_content, max_chars=max_chars)
+
+def clean_text_email(text_content, max_chars: Optional[int] = None):
+    """Tidy the whitespace of a plain text email body, without treating it as HTML."""
+    text = clean_whitespace(text_content or "")
+    return text[:max_chars] if max_chars is not None else text
+
+FASTMAIL_SESSION_URL = "https://api.fastmail.com/jmap/session"
+JMAP_USING = ["urn:ietf:params:jmap:core", "urn:ietf:params:jmap:mail"]
+EMAIL_PROPERTIES = ["subject", "from", "to", "mailboxIds", "bodyValues", "textBody"]
+
+class JMAPError(Exception):
+    """A JMAP method call came back as an error response."""
+    def __init__(self, method: str, error: Dict[str, Any]):
+        self.method = method
+        self.type = error.get("type")
+        super().__init__(f"{method} failed: {error}")
+
+def build_provider(provider_type: str, model: str, cache_path: Optional[str] = None,
+                   sender_history_path: Optional[str] = None, decoding: Optional[str] = None):
+    """The watcher's provider stack: rules, then sender history, then the cached model."""
+    # Initialize the appropriate provider, importing only its backend
+    provider = create_provider(provider_type, model, decoding)
+
+    if cache_path and not hasattr(provider, 'classify_batch'):
+        provider = CachedProvider(provider, db_path=cache_path)
+
+    # Senders with a consistent labeling history are answered from it
+    if sender_history_path:
+        provider = SenderHistoryProvider(provider, SenderHistoryIndex(sender_history_path))
+
+    # Obvious senders are labeled by rules without calling the model
+    return RulesProvider(provider)
 
 class FastmailWatcher:
-    def __init__(self, api_token: str, provider_type: str = "openai", model: str = "gpt-4"):
+    def __init__(self, api_token: str, provider_type: str = "openai", model: str = "gpt-4",
+                 session_url: str = FASTMAIL_SESSION_URL,
+                 http: Optional[requests.Session] = None, state_path: Optional[str] = None,
+                 concurrency: int = 4, cache_path: Optional[str] = None,
+                 max_body_chars: Optional[int] = 4000, max_body_bytes: int = 256 * 1024,
+                 sender_history_path: Optional[str] = None, provider=None,
+                 state_store: Optional[SyncStateStore] = None, timeout: float = 30,
+                 apply_labels: bool = False, decoding: Optional[str] = None):
         self.api_token = api_token
+        self.provider_type = provider_type
+        self.model = model
+        self.decoding = decoding
+        # A provider passed in (e.g. shared by the daemon's accounts) is used as is
+        self.provider = provider
+        self.concurrency = concurrency
+        self.cache_path = cache_path
+        self.sender_history_path = sender_history_path
+        # Only this much of each body is downloaded and cleaned, however big the email
+        self.max_body_chars = max_body_chars
+        self.max_body_bytes = max_body_bytes
+        self.session_url = session_url
         self.base_url = "https://api.fastmail.com/jmap/api/"
         self.headers = {
             "Authorization": f"Bearer {api_token}",
             "Content-Type": "application/json"
         }
-        self.account_id = self._get_account_id()
+        # One pooled HTTP session so batched calls reuse the same connection
+        self.http = http or requests.Session()
+        # Seconds to wait on any one request, so a stuck server can't hang the watcher
+        self.timeout = timeout
+        # With a state store, check_new_emails only sees mail that arrived since the last run
+        self.state_store = state_store or (SyncStateStore(state_path) if state_path else None)
+        # Otherwise labels are only reported, and the mailbox is left as it is.
+        # Applied labels go into the sender history the provider answers from.
+        self.label_applier = LabelApplier(
+            self, sender_history=SenderHistoryIndex(sender_history_path) if sender_history_path else None
+        ) if apply_labels else None
+        self._inbox_id = None
+        self._load_session()
 
-    def _get_account_id(self) -> str:
-        session_response = requests.get(
-            "https://api.fastmail.com/jmap/session",
-            headers=self.headers
-        )
+    def _load_session(self) -> None:
+        session_response = self.http.get(self.session_url, headers=self.headers, timeout=self.timeout)
         session_response.raise_for_status()
-        return session_response.json()["primaryAccounts"]["urn:ietf:params:jmap:mail"]
+        session = session_response.json()
 
-    def _get_email_details(self, email_id: str) -> Dict[str, Any]:
-        request_data = {
-            "using": ["urn:ietf:params:jmap:core", "urn:ietf:params:jmap:mail"],
-            "methodCalls": [[
-                "Email/get",
-                {
-                    "accountId": self.account_id,
-                    "ids": [email_id],
-                    "properties": ["subject", "from", "to", "bodyValues", "textBody", "htmlBody"],
-                    "fetchTextBodyValues": True,
-                    "fetchHTMLBodyValues": True
-                },
-                "a"
-            ]]
-        }
-        
-        response = requests.post(
+        self.account_id = session["primaryAccounts"]["urn:ietf:params:jmap:mail"]
+        self.base_url = session.get("apiUrl", self.base_url)
+        self.event_source_url = session.get("eventSourceUrl")
+
+        # Server limits, used to size batched Email/get calls
+        core = session.get("capabilities", {}).get("urn:ietf:params:jmap:core", {})
+        self.max_objects_in_get = core.get("maxObjectsInGet", 500)
+        self.max_calls_in_request = core.get("maxCallsInRequest", 16)
+        self.max_objects_in_set = core.get("maxObjectsInSet", 500)
+
+    def _jmap_call(self, method_calls: list) -> list:
+        """POST a list of method calls in one request and return the method responses."""
+        response = self.http.post(
             self.base_url,
             headers=self.headers,
-            json=request_data
+            json={"using": JMAP_USING, "methodCalls": method_calls},
+            timeout=self.timeout
         )
         response.raise_for_status()
-      
-        result = response.json()["methodResponses"][0][1]
-        email = result["list"][0]
-        
-        # Try different possible body part IDs
-        body_part_ids = ['1', '1.1']  # Add more if needed
-        body = None
-        
-        for part_id in body_part_ids:
-            if part_id in email["bodyValues"]:
-                body = email["bodyValues"][part_id]['value']
-                break
+
+        methods_by_call_id = {call_id: method for method, _, call_id in method_calls}
+        method_responses = response.json()["methodResponses"]
+        for name, args, call_id in method_responses:
+            if name == "error":
+                raise JMAPError(methods_by_call_id.get(call_id, name), args)
+        return method_responses
+
+    def _email_get_args(self) -> Dict[str, Any]:
+        return {
+            "accountId": self.account_id,
+            "properties": EMAIL_PROPERTIES,
+            # textBody prefers text/plain parts and only falls back to text/html
+            # when an email has no plain text version
+            "fetchTextBodyValues": True,
+            "maxBodyValueBytes": self.max_body_bytes
+        }
+
+    def _prepare_email(self, email: Dict[str, Any]) -> Dict[str, Any]:
+        body_parts = [part for part in email.get("textBody", []) if part.get("partId") in email["bodyValues"]]
         
-        if body is None:
-            # If no recognized part is found, log available parts and use the first one
+        if body_parts:
+            part = body_parts[0]
+            body = email["bodyValues"][part["partId"]]['value']
+            is_html = part.get("type") == "text/html"
+        else:
+            # If no text body part is found, log available parts and use the first one
             available_parts = list(email["bodyValues"].keys())
             print(f"Warning: Expected body parts not found. Available parts: {available_parts}")
             if available_parts:
                 body = email["bodyValues"][available_parts[0]]['value']
             else:
                 body = ""
+            is_html = True
         
-        email['body'] = clean_html_email_with_markdown(body)
+        if is_html:
+            email['body'] = clean_html_email_with_markdown(body, max_chars=self.max_body_chars)
+        else:
+            email['body'] = clean_text_email(body, max_chars=self.max_body_chars)
         return email
 
-    def check_new_emails(self) -> None:
-        request_data = {
-            "using": ["urn:ietf:params:jmap:core", "urn:ietf:params:jmap:mail"],
-            "methodCalls": [[
-                "Email/query",
-                {
+    def _get_emails(self, email_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Fetch many emails with as few round trips as possible: ids are chunked at
+        the server's maxObjectsInGet, and up to maxCallsInRequest Email/get calls
+        are packed into each request. Results come back in the order of email_ids.
+        """
+        chunks = [email_ids[i:i + self.max_objects_in_get]
+                  for i in range(0, len(email_ids), self.max_objects_in_get)]
+
+        emails_by_id = {}
+        for i in range(0, len(chunks), self.max_calls_in_request):
+            method_calls = [
+                ["Email/get", {**self._email_get_args(), "ids": chunk}, f"g{n}"]
+                for n, chunk in enumerate(chunks[i:i + self.max_calls_in_request])
+            ]
+            for _, result, _ in self._jmap_call(method_calls):
+                for email in result["list"]:
+                    emails_by_id[email["id"]] = email
+
+        return [self._prepare_email(emails_by_id[email_id])
+                for email_id in email_ids if email_id in emails_by_id]
+
+    def _get_email_details(self, email_id: str) -> Dict[str, Any]:
+        return self._get_emails([email_id])[0]
+
+    def _query_emails(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Run an Email/query and fetch the matching emails. When the page fits in a
+        single Email/get, both calls go in one request, with the get reading the
+        query's ids through a back-reference.
+        """
+        query = {"accountId": self.account_id, **query}
+
+        if query.get("limit", 0) <= self.max_objects_in_get:
+            query_response, get_response = self._jmap_call([
+                ["Email/query", query, "q"],
+                ["Email/get", {
+                    **self._email_get_args(),
+                    "#ids": {"resultOf": "q", "name": "Email/query", "path": "/ids"}
+                }, "g"]
+            ])
+            emails_by_id = {email["id"]: email for email in get_response[1]["list"]}
+            return [self._prepare_email(emails_by_id[email_id])
+                    for email_id in query_response[1]["ids"] if email_id in emails_by_id]
+
+        email_ids = self._jmap_call([["Email/query", query, "q"]])[0][1]["ids"]
+        return self._get_emails(email_ids)
+
+    def inbox_id(self) -> str:
+        """The Inbox mailbox's id, looked up once with Mailbox/get."""
+        if self._inbox_id is None:
+            mailboxes = self._jmap_call([["Mailbox/get", {
+                "accountId": self.account_id,
+                "properties": ["role"]
+            }, "m"]])[0][1]["list"]
+            self._inbox_id = next((mailbox["id"] for mailbox in mailboxes if mailbox.get("role") == "inbox"), None)
+            if self._inbox_id is None:
+                raise ValueError("The account has no mailbox with the inbox role")
+        return self._inbox_id
+
+    def _in_inbox(self, emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Sent mail, drafts and mail already filed elsewhere aren't the classifier's to move
+        inbox_id = self.inbox_id()
+        return [email for email in emails if (email.get("mailboxIds") or {}).get(inbox_id)]
+
+    def get_email_state(self) -> str:
+        """Current Email state string for the account, without fetching any emails."""
+        return self._jmap_call([
+            ["Email/get", {"accountId": self.account_id, "ids": []}, "s"]
+        ])[0][1]["state"]
+
+    def get_new_emails(self, initial_limit: int = 10, include_updated: bool = False,
+                       max_emails: Optional[int] = None) -> tuple:
+        """
+        Fetch emails created since the state saved in the state store, using
+        Email/changes with the matching Email/get chained in the same request.
+        Returns (emails, new_state); the caller saves new_state once the emails
+        have been handled, so a crash mid-way replays them instead of losing them.
+
+        With max_emails, at most that many changes are fetched and new_state is
+        the intermediate state after them; the next call picks up the rest.
+
+        On the first run (or when the server can no longer calculate changes from
+        the saved state) this falls back to the newest initial_limit emails.
+        Either way only emails that are in the Inbox are returned.
+        """
+        if max_emails is not None:
+            initial_limit = min(initial_limit, max_emails)
+        since_state = self.state_store.get_state(self.account_id)
+        if since_state is None:
+            return self._resync(initial_limit)
+
+        emails = []
+        while True:
+            # Never ask for more changes than are left to return, so new_state
+            # covers exactly the emails returned
+            max_changes = self.max_objects_in_get
+            if max_emails is not None:
+                max_changes = min(max_changes, max_emails - len(emails))
+
+            method_calls = [
+                ["Email/changes", {
                     "accountId": self.account_id,
-                    "sort": [{"property": "receivedAt", "isAscending": False}],
-                    "limit": 10
-                },
-                "a"
-            ]]
-        }
-        
-        response = requests.post(
-            self.base_url,
-            headers=self.headers,
-            json=request_data
+                    "sinceState": since_state,
+                    "maxChanges": max_changes
+                }, "c"],
+                ["Email/get", {
+                    **self._email_get_args(),
+                    "#ids": {"resultOf": "c", "name": "Email/changes", "path": "/created"}
+                }, "g"]
+            ]
+            if include_updated:
+                method_calls.append(["Email/get", {
+                    **self._email_get_args(),
+                    "#ids": {"resultOf": "c", "name": "Email/changes", "path": "/updated"}
+                }, "u"])
+
+            try:
+                method_responses = self._jmap_call(method_calls)
+            except JMAPError as e:
+                if e.type != "cannotCalculateChanges":
+                    raise
+                print("Saved sync state is too old, resyncing from recent emails")
+                return self._resync(initial_limit)
+
+            changes = method_responses[0][1]
+            for _, result, _ in method_responses[1:]:
+                emails.extend(self._prepare_email(email) for email in result["list"])
+
+            since_state = changes["newState"]
+            if not changes["hasMoreChanges"] or (max_emails is not None and len(emails) >= max_emails):
+                return self._in_inbox(emails), since_state
+
+    def _resync(self, limit: int) -> tuple:
+        # Read the state before querying, so mail arriving in between is seen
+        # again on the next sync rather than skipped
+        state = self.get_email_state()
+        return self._in_inbox(self.get_recent_emails(limit=limit)), state
+
+    def email_content(self, email: Dict[str, Any]) -> str:
+        """The same headers-plus-body text the evals classify."""
+        sender = email['from'][0] if email.get('from') else {}
+        return format_email_content(
+            sender.get('name') or '',
+            sender.get('email') or '',
+            email.get('subject') or '',
+            email['body']
         )
-        response.raise_for_status()
-        
-        email_ids = response.json()["methodResponses"][0][1]["ids"]
-        
-        for email_id in reversed(email_ids):
-            email = self._get_email_details(email_id)
+
+    def sync_new_emails(self, max_emails: Optional[int] = None) -> List[tuple]:
+        """
+        Fetch and classify new emails in the Inbox, apply the labels (and
+        record them in the sender history) if apply_labels is on, then save
+        the sync state. Returns (email, label) pairs; nothing is
+        printed unless labels couldn't be applied.
+        """
+        self._init_provider()
+        if self.state_store:
+            emails, new_state = self.get_new_emails(max_emails=max_emails)
+        else:
+            emails, new_state = self._in_inbox(self.get_recent_emails(limit=10)), None
+
+        labels = classify_emails(self.provider, [self.email_content(email) for email in emails],
+                                 concurrency=self.concurrency)
+
+        if self.label_applier:
+            failed = self.label_applier.apply([(email['id'], label) for email, label in zip(emails, labels)],
+                                              senders={email['id']: email['from'][0].get('email')
+                                                       for email in emails if email.get('from')})
+            if failed:
+                print(f"Warning: couldn't apply labels to {len(failed)} emails: {failed}")
+
+        if new_state:
+            self.state_store.set_state(self.account_id, new_state)
+        return list(zip(emails, labels))
+
+    def check_new_emails(self) -> None:
+        for email, label in self.sync_new_emails():
             print(f"From: {email['from'][0]['name']} {email['from'][0]['email']}")
             print(f"Subject: {email['subject']}")
             print()
             print(email['body'][:1000])
             print('-' * 80)
 
-            label = classify_email(self.provider, email['body'])
             print(f"Classifer tags this as: {label}")
             print('-' * 80)
 
+    def _init_provider(self) -> None:
+        if self.provider is None:
+            self.provider = build_provider(self.provider_type, self.model, cache_path=self.cache_path,
+                                           sender_history_path=self.sender_history_path, decoding=self.decoding)
+
     def watch(self, interval: int = 60) -> None:
-        # Initialize the appropriate provider
-        if provider_type == "openai":
-            self.provider = OpenAIProvider(model=model)
-        elif provider_type == "ollama":
-            self.provider = OllamaProvider(model=model)
-        else:
-            raise ValueError(f"Unknown provider type: {provider_type}")
+        """Poll Fastmail for new emails every interval seconds."""
+        self._init_provider()
+
+        while True:
+            print("Checking fastmail for recent emails")
+            self.check_new_emails()
+            time.sleep(interval)
+
+    def watch_push(self, ping: int = 30, max_backoff: int = 300) -> None:
+        """
+        Wait on the session's JMAP EventSource and only fetch when the server
+        reports that the account's Email state changed, so there is no traffic
+        while the mailbox is idle. Dropped connections, JMAP errors and provider
+        failures are retried with exponential backoff, catching up on anything
+        missed after reconnecting.
+        """
+        if not self.event_source_url:
+            raise ValueError("JMAP session has no eventSourceUrl, use watch() to poll instead")
+        if not self.state_store:
+            print("Warning: push mode without a state store re-checks the newest 10 emails on every change")
+        self._init_provider()
+
+        backoff = 1
+        while True:
+            try:
+                self.check_new_emails()
+                for event, data in self._event_source_events(ping):
+                    backoff = 1
+                    if event != "state":
+                        continue
+
+                    changed = json.loads(data).get("changed", {}).get(self.account_id, {})
+                    if "Email" not in changed:
+                        continue
+                    if self.state_store and changed["Email"] == self.state_store.get_state(self.account_id):
+                        continue
+                    self.check_new_emails()
+            except (requests.RequestException, ValueError) as e:
+                print(f"Event stream dropped ({e}), reconnecting in {backoff}s")
+            except Exception as e:
+                # A JMAP method error or the provider's API failing (OpenAI, Ollama, the
+                # classifier service). The sync state isn't saved past emails that weren't
+                # labeled, so they're picked up again after backing off.
+                print(f"Checking for new emails failed ({type(e).__name__}: {e}), retrying in {backoff}s")
+            else:
+                print(f"Event stream closed by server, reconnecting in {backoff}s")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
+
+    def _event_source_events(self, ping: int):
+        """Yield (event, data) pairs from the JMAP EventSource server-sent event stream."""
+        url = (self.event_source_url
+               .replace("{types}", "Email")
+               .replace("{closeafter}", "no")
+               .replace("{ping}", str(ping)))
+
+        # The server pings every `ping` seconds, so a much longer silence means the connection is dead
+        with self.http.get(url, headers={**self.headers, "Accept": "text/event-stream"},
+                           stream=True, timeout=(10, ping * 3)) as response:
+            response.raise_for_status()
 
-        print("Checking fastmail for recent emails")
-        self.check_new_emails()
+            event, data = None, []
+            for line in response.iter_lines(decode_unicode=True):
+                if line == "":
+                    if data:
+                        yield event or "message", "\n".join(data)
+                    event, data = None, []
+                elif line.startswith(":"):
+                    continue
+                else:
+                    field, _, value = line.partition(":")
+                    value = value[1:] if value.startswith(" ") else value
+                    if field == "event":
+                        event = value
+                    elif field == "data":
+                        data.append(value)
 
     def get_recent_emails(self, limit: int = 10, offset: int = 0) -> list:
-        """Fetch recent emails and return their details."""
-        request_data = {
-            "using": ["urn:ietf:params:jmap:core", "urn:ietf:params:jmap:mail"],
-            "methodCalls": [[
-                "Email/query",
-                {
-                    "accountId": self.account_id,
-                    "sort": [{"property": "receivedAt", "isAscending": False}],
-                    "limit": limit,
-                    "position": offset
-                },
-                "a"
-            ]]
-        }
-        
-        response = requests.post(
-            self.base_url,
-            headers=self.headers,
-            json=request_data
-        )
-        response.raise_for_status()
-        
-        email_ids = response.json()["methodResponses"][0][1]["ids"]
-        emails = []
-        
-        for email_id in reversed(email_ids):
-            email = self._get_email_details(email_id)
-            email['id'] = email_id  # Add the ID to the email dict
-            emails.append(email)
-            
-        return emails
+        """Fetch recent emails and return their details, oldest first."""
+        emails = self._query_emails({
+            "sort": [{"property": "receivedAt", "isAscending": False}],
+            "limit": limit,
+            "position": offset
+        })
+        return list(reversed(emails))
 
 if __name__ == "__main__":
     api_token = os.getenv("FASTMAIL_API_TOKEN")
     if not api_token:
         raise ValueError("Please set FASTMAIL_API_TOKEN environment variable")
     
-    watcher = FastmailWatcher(api_token)
-
     provider_type = os.getenv("LLM_PROVIDER", "openai")
     model = os.getenv("LLM_MODEL", "gpt-4o")
-    
-    watcher.watch(provider_type=provider_type, model=model)
+
+    watcher = FastmailWatcher(
+        api_token,
+        provider_type=provider_type,
+        model=model,
+        # Point at jmap_standin.py to run without Fastmail
+        session_url=os.getenv("FASTMAIL_SESSION_URL", FASTMAIL_SESSION_URL),
+        state_path=os.getenv("SYNC_STATE_PATH", "sync_state.sqlite"),
+        cache_path=os.getenv("CLASSIFICATION_CACHE_PATH", "classification_cache.sqlite"),
+        sender_history_path=os.getenv("SENDER_HISTORY_PATH", "sender_history.sqlite"),
+        apply_labels=os.getenv("APPLY_LABELS", "") == "1",
+        # schema or logit_bias: answers constrained to a label
+        decoding=os.getenv("LLM_DECODING")
+    )
+
+    if os.getenv("WATCH_MODE", "push") == "push":
+        watcher.watch_push()
+    else:
+        watcher.watch(interval=int(os.getenv("WATCH_INTERVAL", "60")))
@@ -0,0 +1,113 @@
+"""
+Keep each email's preprocessed text and token ids in a SQLite sidecar, so
+repeated evals and fine-tuning runs skip preprocessing and tokenizing.
+
+Entries are keyed by email id (or content hash, where there's no id) and
+the version they were built with, and remember a hash of the source text.
+An entry is rebuilt when its source changes; stores with different versions
+(e.g. after a preprocessing change, or another tokenizer) keep their own
+entries side by side in one file.
+"""
+import hashlib
+import sqlite3
+import threading
+from array import array
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Ids per IN (...) list, well under SQLite's limit on bound variables
+SQLITE_MAX_VARIABLES = 500
+
+# Builds (text, token ids) for each source text
+Builder = Callable[[List[str]], Tuple[List[str], List[List[int]]]]
+
+def source_hash(source: str) -> str:
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+def pack_ids(ids: Sequence[int]) -> Tuple[str, bytes]:
+    # Two bytes per id when the vocabulary allows, four otherwise
+    typecode = 'H' if max(ids, default=0) < 2 ** 16 else 'I'
+    return typecode, array(typecode, ids).tobytes()
+
+def unpack_ids(typecode: str, blob: bytes) -> List[int]:
+    ids = array(typecode)
+    ids.frombytes(blob)
+    return ids.tolist()
+
+class FeatureStore:
+    def __init__(self, db_path: str = 'features.sqlite', version: str = '1'):
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        # Shared by the watcher's worker threads
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS features (
+            key TEXT,
+            version TEXT,
+            source_hash TEXT,
+            text TEXT,
+            typecode TEXT,
+            input_ids BLOB,
+            PRIMARY KEY (key, version)
+        )
+        ''')
+        self.conn.commit()
+
+    def _load(self, keys: List[str]) -> Dict[str, Tuple[str, str, List[int]]]:
+        found = {}
+        for i in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            part = keys[i:i + SQLITE_MAX_VARIABLES]
+            for key, hash, text, typecode, blob in self.conn.execute(f'''
+            SELECT key, source_hash, text, typecode, input_ids FROM features
+            WHERE version = ? AND key IN ({','.join('?' * len(part))})
+            ''', [self.version] + part):
+                found[key] = (hash, text, unpack_ids(typecode, blob))
+        return found
+
+    def features(self, items: Sequence[Tuple[str, str]], build: Builder) -> List[Tuple[str, List[int]]]:
+        """
+        (text, token ids) for each (key, source text) pair. Entries that are
+        missing or stale are built in one call to build and saved.
+        """
+        hashes = [source_hash(source) for _, source in items]
+        with self.lock:
+            found = self._load(list({key for key, _ in items}))
+
+        results = [None] * len(items)
+        missing = []
+        for i, ((key, _), hash) in enumerate(zip(items, hashes)):
+            entry = found.get(key)
+            if entry and entry[0] == hash:
+                results[i] = (entry[1], entry[2])
+            else:
+                missing.append(i)
+        self.hits += len(items) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            texts, input_ids = build([items[i][1] for i in missing])
+            rows = []
+            for i, text, ids in zip(missing, texts, input_ids):
+                results[i] = (text, list(ids))
+                rows.append((items[i][0], self.version, hashes[i], text) + pack_ids(ids))
+            with self.lock:
+                self.conn.executemany('''
+                INSERT OR REPLACE INTO features (key, version, source_hash, text, typecode, input_ids)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ''', rows)
+                self.conn.commit()
+        return results
+
+    def purge_stale(self) -> int:
+        """Delete entries built with another version."""
+        with self.lock:
+            cursor = self.conn.execute('DELETE FROM features WHERE version != ?', (self.version,))
+            self.conn.commit()
+        return cursor.rowcount
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self) -> None:
+        self.conn.close()
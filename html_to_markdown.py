@@ -0,0 +1,268 @@
+"""
+Convert HTML email content to markdown in a single streaming pass.
+
+This produces the same output as the original BeautifulSoup cleaner (kept in
+bench_html_cleaner.py for comparison) without building a tree: the soup
+version converted bold, then italics, then links, headings and list items in
+separate passes, each flattening whatever it replaced to plain text. Here an
+element is converted only when it would have survived those earlier passes,
+which is when no enclosing element belongs to an earlier pass.
+"""
+from html.entities import html5
+from html.parser import HTMLParser
+import re
+from typing import Optional
+
+# Order of the soup cleaner's passes. An element is converted if its pass
+# comes before those of all its ancestors, otherwise it is flattened to text.
+PASS_ORDER = {'strong': 0, 'b': 0, 'em': 1, 'i': 1, 'a': 2,
+              'h1': 3, 'h2': 3, 'h3': 3, 'h4': 3, 'h5': 3, 'h6': 3}
+LIST_ITEM_PASS = 4
+NO_PASS = 5
+
+SKIPPED_TAGS = {'script', 'style', 'head'}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+             'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame',
+             'image', 'isindex', 'nextid', 'spacer'}
+WHITESPACE_PRESERVING_TAGS = {'pre', 'textarea'}
+ASCII_SPACES = ' \n\t\x0c\r'
+
+# Named entities without their trailing semicolons, resolved the way soup does
+ENTITIES = {}
+for _name, _character in sorted(html5.items()):
+    ENTITIES.setdefault(_name.rstrip(';'), _character)
+
+class _Element:
+    __slots__ = ('name', 'skip', 'min_pass', 'list_root', 'preserve_whitespace',
+                 'converting', 'parts', 'markup', 'list_items')
+
+    def __init__(self, name, parent):
+        self.name = name
+        self.skip = parent.skip or name in SKIPPED_TAGS
+        self.list_root = parent.list_root
+        self.preserve_whitespace = parent.preserve_whitespace or name in WHITESPACE_PRESERVING_TAGS
+        self.converting = False
+        self.parts = None
+        self.markup = None
+        self.list_items = 0
+
+        own_pass = PASS_ORDER.get(name, NO_PASS)
+        if name == 'li' and self.list_root is not None:
+            own_pass = LIST_ITEM_PASS
+        self.min_pass = min(parent.min_pass, own_pass)
+
+        if not self.skip:
+            self.converting = own_pass < parent.min_pass
+        if name in ('ul', 'ol') and self.list_root is None:
+            self.list_root = self
+
+class _Root:
+    name = None
+    skip = False
+    min_pass = NO_PASS
+    list_root = None
+    preserve_whitespace = False
+    converting = False
+
+class _EnoughText(Exception):
+    pass
+
+class _MarkdownParser(HTMLParser):
+    def __init__(self, max_chars=None):
+        # Character references are resolved by hand to match soup's quirks
+        super().__init__(convert_charrefs=False)
+        self.stack = [_Root()]
+        self.open_counts = {}
+        self.closed_void_tags = []
+        # Top level strings, joined with spaces at the end like soup.get_text(separator=' ')
+        self.strings = []
+        self.strings_length = 0
+        self.max_chars = max_chars
+        self.next_length_check = max_chars
+        self.data = []
+        # Innermost converting elements; text inside them is joined without separators
+        self.collectors = []
+
+    def _flush_data(self):
+        if self.data:
+            text = ''.join(self.data)
+            self.data = []
+            current = self.stack[-1]
+            if current.skip:
+                return
+            # Whitespace-only strings collapse to one character, as soup does when building the tree
+            if not current.preserve_whitespace and text.strip(ASCII_SPACES) == '':
+                text = '\n' if '\n' in text else ' '
+            self._emit(text)
+
+    def _emit(self, text):
+        if self.collectors:
+            self.collectors[-1].parts.append(text)
+        else:
+            self.strings.append(text)
+            self.strings_length += len(text)
+            if self.next_length_check is not None and self.strings_length >= self.next_length_check:
+                self._check_length()
+
+    def _check_length(self):
+        # Text produced so far is final up to its last non-space character, so
+        # once the cleaned text is long enough the rest of the email can't change it
+        missing = self.max_chars - len(self.text())
+        if missing <= 0:
+            raise _EnoughText()
+        # Each raw character adds at most one cleaned character
+        self.next_length_check = self.strings_length + missing
+
+    def _boundary(self):
+        # Any tag, comment or declaration ends the current run of text
+        self._flush_data()
+
+    def handle_starttag(self, tag, attrs, self_closing=False):
+        self._boundary()
+        if tag in VOID_TAGS:
+            if not self_closing:
+                # Soup closes these straight away and then ignores one matching end tag
+                self.closed_void_tags.append(tag)
+            return
+
+        element = _Element(tag, self.stack[-1])
+        if not element.skip:
+            if tag == 'li' and element.list_root is not None and self.stack[-1].min_pass >= LIST_ITEM_PASS:
+                element.list_root.list_items += 1
+                if element.converting:
+                    prefix = '* ' if element.list_root.name == 'ul' else f'{element.list_root.list_items}. '
+                    element.markup = prefix
+            elif tag == 'a':
+                element.markup = dict(attrs).get('href') or ''
+            if element.converting:
+                element.parts = []
+                self.collectors.append(element)
+
+        self.stack.append(element)
+        self.open_counts[tag] = self.open_counts.get(tag, 0) + 1
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, self_closing=True)
+        self._end(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.closed_void_tags:
+            self.closed_void_tags.remove(tag)
+            return
+        self._end(tag)
+
+    def _end(self, tag):
+        self._boundary()
+        # Like soup, an end tag closes everything up to the most recent open tag
+        # of the same name, and is ignored when there's no such tag
+        if not self.open_counts.get(tag):
+            return
+        while True:
+            element = self.stack.pop()
+            self.open_counts[element.name] -= 1
+            self._close(element)
+            if element.name == tag:
+                break
+
+    def _close(self, element):
+        if not element.converting:
+            return
+        self.collectors.pop()
+        text = ''.join(element.parts)
+        name = element.name
+        if name in ('strong', 'b'):
+            markdown = f'**{text}**'
+        elif name in ('em', 'i'):
+            markdown = f'*{text}*'
+        elif name == 'a':
+            markdown = f'[{text}]({element.markup})'
+        elif name == 'li':
+            markdown = f'\n{element.markup}{text}'
+        else:
+            markdown = f'\n{"#" * int(name[1])} {text}\n'
+        self._emit(markdown)
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def handle_entityref(self, name):
+        # Unknown entities are kept as literal text, minus any semicolon
+        self.data.append(ENTITIES.get(name, f'&{name}'))
+
+    def handle_charref(self, name):
+        base, pattern = (16, r'([0-9a-fA-F]+)(.*)') if name[:1] in ('x', 'X') else (10, r'(\d+)(.*)')
+        digits = name[1:] if base == 16 else name
+        match = re.match(pattern, digits, re.DOTALL)
+        if not match:
+            self.data.append(digits)
+            return
+
+        code_point = int(match.group(1), base)
+        character = None
+        if code_point == 0 or 0xd800 <= code_point <= 0xdfff:
+            character = '\ufffd'
+        elif 128 <= code_point < 160:
+            # Numeric references in this range almost always mean windows-1252
+            try:
+                character = bytes([code_point]).decode('windows-1252')
+            except UnicodeDecodeError:
+                pass
+        if character is None:
+            try:
+                character = chr(code_point)
+            except (ValueError, OverflowError):
+                character = '\ufffd'
+        self.data.append(character + match.group(2))
+
+    def handle_comment(self, data):
+        self._boundary()
+
+    def handle_decl(self, decl):
+        self._boundary()
+
+    def handle_pi(self, data):
+        self._boundary()
+
+    def unknown_decl(self, data):
+        self._boundary()
+        if data.startswith('CDATA[') and not self.stack[-1].skip:
+            self._emit(data[len('CDATA['):])
+
+    def finish(self):
+        self.close()
+        self._boundary()
+        # Unclosed elements are closed at the end of the document
+        while len(self.stack) > 1:
+            self._close(self.stack.pop())
+
+    def text(self):
+        return clean_whitespace(' '.join(self.strings))
+
+def clean_whitespace(text):
+    # Clean up whitespace and special characters
+    text = re.sub(r'\n\s*\n', '\n\n', text)
+    text = re.sub(r' +', ' ', text)
+    return text.strip()
+
+def html_to_markdown(html_content: str, max_chars: Optional[int] = None) -> str:
+    """
+    Convert HTML email content to markdown while preserving basic formatting.
+
+    With max_chars, parsing stops as soon as that much text has been produced
+    and the result is cut to max_chars. How much HTML is read at all is
+    bounded when fetching (FastmailWatcher's max_body_bytes).
+    """
+    if not html_content or not isinstance(html_content, str):
+        return ""
+
+    parser = _MarkdownParser(max_chars)
+    try:
+        # One feed, as soup does: html.parser's recovery from malformed
+        # character references depends on how the input is split up
+        parser.feed(html_content)
+        parser.finish()
+    except _EnoughText:
+        pass
+
+    text = parser.text()
+    return text[:max_chars] if max_chars is not None else text
@@ -0,0 +1,424 @@
+"""
+A local stand-in for Fastmail's JMAP API, serving a recorded mailbox so the
+watcher and dataset builder can run (and be load tested) with no network.
+
+Record a mailbox from your real account once:
+
+    FASTMAIL_API_TOKEN=... python jmap_standin.py record mailbox.json --limit 500
+
+then serve it and point the other scripts at it:
+
+    python jmap_standin.py serve mailbox.json --port 8765 --arrival-interval 5
+    FASTMAIL_SESSION_URL=http://localhost:8765/jmap/session FASTMAIL_API_TOKEN=x python fastmail_watcher.py
+
+It implements the session resource, Email/query, Email/get (with
+back-references and maxBodyValueBytes), Email/changes, Mailbox/get, Email/set
+(mailboxIds and keywords patches only) and the EventSource.
+The Email state is the number of emails delivered so far: the mailbox starts
+with some of the fixture's emails and delivers the rest over time, oldest
+first, so incremental sync and push see new mail arrive.
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+ACCOUNT_ID = "standin-account"
+# Fixture emails without mailboxIds are in the Inbox
+MAILBOXES = [
+    {"id": "mb-inbox", "name": "Inbox", "role": "inbox"},
+    {"id": "mb-fyi", "name": "FYI", "role": None},
+    {"id": "mb-junk", "name": "Junk", "role": "junk"},
+    {"id": "mb-sent", "name": "Sent", "role": "sent"},
+]
+
+class StandInMailbox:
+    """The fixture's emails, oldest first, of which the first `delivered` are visible."""
+    def __init__(self, emails: List[Dict[str, Any]], delivered: Optional[int] = None):
+        self.emails = sorted(emails, key=lambda email: email.get("receivedAt", ""))
+        self.emails_by_id = {email["id"]: email for email in self.emails}
+        for email in self.emails:
+            email.setdefault("mailboxIds", {"mb-inbox": True})
+            email.setdefault("keywords", {})
+        self.mailboxes = {mailbox["id"]: mailbox for mailbox in MAILBOXES}
+        self.delivered = len(self.emails) if delivered is None else min(delivered, len(self.emails))
+        self.changed = threading.Condition()
+
+    @classmethod
+    def load(cls, path: str, delivered: Optional[int] = None) -> "StandInMailbox":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f)["emails"], delivered)
+
+    @property
+    def state(self) -> str:
+        return str(self.delivered)
+
+    def deliver(self, count: int = 1) -> int:
+        """Make the next `count` emails visible. Returns how many were delivered."""
+        with self.changed:
+            count = min(count, len(self.emails) - self.delivered)
+            if count > 0:
+                self.delivered += count
+                self.changed.notify_all()
+        return count
+
+    def query(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        # Filters aren't supported; every query sees the whole mailbox
+        visible = self.emails[:self.delivered]
+        sort = (args.get("sort") or [{"property": "receivedAt", "isAscending": True}])[0]
+        if not sort.get("isAscending", True):
+            visible = list(reversed(visible))
+        position = args.get("position", 0)
+        limit = args.get("limit")
+        page = visible[position:position + limit if limit is not None else None]
+        return {
+            "accountId": ACCOUNT_ID,
+            "queryState": self.state,
+            "canCalculateChanges": False,
+            "position": position,
+            "total": len(visible),
+            "ids": [email["id"] for email in page]
+        }
+
+    def get(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        ids = args.get("ids")
+        if ids is None:
+            ids = [email["id"] for email in self.emails[:self.delivered]]
+        visible = {email["id"] for email in self.emails[:self.delivered]}
+        properties = args.get("properties")
+        max_bytes = args.get("maxBodyValueBytes", 0)
+
+        found, not_found = [], []
+        for email_id in ids:
+            if email_id not in visible:
+                not_found.append(email_id)
+                continue
+            email = self.emails_by_id[email_id]
+            result = {"id": email_id}
+            for name in properties or email:
+                if name == "bodyValues":
+                    continue
+                if name in email:
+                    result[name] = email[name]
+            if args.get("fetchTextBodyValues") or args.get("fetchAllBodyValues"):
+                result["bodyValues"] = self._body_values(email, max_bytes, args.get("fetchAllBodyValues"))
+            elif properties is None or "bodyValues" in properties:
+                result["bodyValues"] = {}
+            found.append(result)
+
+        return {"accountId": ACCOUNT_ID, "state": self.state, "list": found, "notFound": not_found}
+
+    @staticmethod
+    def _body_values(email: Dict[str, Any], max_bytes: int, fetch_all: bool) -> Dict[str, Any]:
+        part_ids = set(email.get("bodyValues", {}))
+        if not fetch_all:
+            part_ids &= {part.get("partId") for part in email.get("textBody", [])}
+
+        values = {}
+        for part_id in part_ids:
+            value = email["bodyValues"][part_id]["value"]
+            truncated = False
+            if max_bytes and len(value.encode("utf-8")) > max_bytes:
+                # Cut on a character boundary, as the spec requires
+                value = value.encode("utf-8")[:max_bytes].decode("utf-8", "ignore")
+                truncated = True
+            values[part_id] = {"value": value, "isEncodingProblem": False, "isTruncated": truncated}
+        return values
+
+    def changes(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        since_state = args.get("sinceState", "")
+        if not since_state.isdigit() or int(since_state) > self.delivered:
+            raise MethodError("cannotCalculateChanges")
+
+        since = int(since_state)
+        upto = self.delivered
+        if args.get("maxChanges"):
+            upto = min(upto, since + args["maxChanges"])
+        return {
+            "accountId": ACCOUNT_ID,
+            "oldState": since_state,
+            "newState": str(upto),
+            "hasMoreChanges": upto < self.delivered,
+            "created": [email["id"] for email in self.emails[since:upto]],
+            "updated": [],
+            "destroyed": []
+        }
+
+    def get_mailboxes(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        return {"accountId": ACCOUNT_ID, "state": "0", "list": list(self.mailboxes.values()), "notFound": []}
+
+    def set(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        """Email/set updates, as patches to mailboxIds and keywords. Doesn't change the Email state."""
+        visible = {email["id"] for email in self.emails[:self.delivered]}
+        updated, not_updated = {}, {}
+        for email_id, patch in (args.get("update") or {}).items():
+            if email_id not in visible:
+                not_updated[email_id] = {"type": "notFound"}
+                continue
+            changes = {"mailboxIds": dict(self.emails_by_id[email_id]["mailboxIds"]),
+                       "keywords": dict(self.emails_by_id[email_id]["keywords"])}
+            error = None
+            for path, value in patch.items():
+                field, _, key = path.partition("/")
+                if field not in changes or not key:
+                    error = {"type": "invalidPatch", "description": path}
+                elif field == "mailboxIds" and key not in self.mailboxes:
+                    error = {"type": "invalidProperties", "properties": ["mailboxIds"]}
+                elif value is None:
+                    changes[field].pop(key, None)
+                else:
+                    changes[field][key] = value
+            if error is None and not changes["mailboxIds"]:
+                error = {"type": "invalidProperties", "properties": ["mailboxIds"]}
+            if error:
+                not_updated[email_id] = error
+                continue
+            self.emails_by_id[email_id].update(changes)
+            updated[email_id] = None
+        return {"accountId": ACCOUNT_ID, "oldState": self.state, "newState": self.state,
+                "updated": updated, "notUpdated": not_updated}
+
+class MethodError(Exception):
+    def __init__(self, error_type: str):
+        self.type = error_type
+        super().__init__(error_type)
+
+def _resolve_reference(reference: Dict[str, Any], responses: List[list]) -> Any:
+    for name, result, call_id in responses:
+        if call_id == reference["resultOf"] and name == reference["name"]:
+            value = result
+            for key in reference["path"].strip("/").split("/"):
+                value = value[key]
+            return value
+    raise MethodError("invalidResultReference")
+
+class JMAPStandInServer(ThreadingHTTPServer):
+    """
+    Serves a StandInMailbox. latency (seconds) delays every API request, and
+    error_rate is the share of API requests that fail with a 503, for load
+    testing retries and backoff.
+    """
+    daemon_threads = True
+
+    def __init__(self, mailbox: StandInMailbox, host: str = "localhost", port: int = 8765,
+                 latency: float = 0.0, error_rate: float = 0.0, max_objects_in_get: int = 500,
+                 max_calls_in_request: int = 16, max_objects_in_set: int = 500, seed: Optional[int] = None):
+        super().__init__((host, port), _Handler)
+        self.mailbox = mailbox
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_objects_in_get = max_objects_in_get
+        self.max_calls_in_request = max_calls_in_request
+        self.max_objects_in_set = max_objects_in_set
+        self.random = random.Random(seed)
+        self.requests_served = 0
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def session_url(self) -> str:
+        return f"{self.base_url}/jmap/session"
+
+    def start(self) -> str:
+        """Serve from a background thread and return the session URL."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.session_url
+
+    def session(self) -> Dict[str, Any]:
+        return {
+            "capabilities": {
+                "urn:ietf:params:jmap:core": {
+                    "maxObjectsInGet": self.max_objects_in_get,
+                    "maxCallsInRequest": self.max_calls_in_request,
+                    "maxObjectsInSet": self.max_objects_in_set
+                },
+                "urn:ietf:params:jmap:mail": {}
+            },
+            "accounts": {ACCOUNT_ID: {"name": "stand-in", "isPersonal": True, "isReadOnly": True}},
+            "primaryAccounts": {"urn:ietf:params:jmap:core": ACCOUNT_ID, "urn:ietf:params:jmap:mail": ACCOUNT_ID},
+            "username": "stand-in",
+            "apiUrl": f"{self.base_url}/jmap/api/",
+            "eventSourceUrl": f"{self.base_url}/jmap/eventsource/?types={{types}}&closeafter={{closeafter}}&ping={{ping}}",
+            "state": "0"
+        }
+
+    def call(self, method: str, args: Dict[str, Any]) -> Dict[str, Any]:
+        if method == "Email/get":
+            if len(args.get("ids") or []) > self.max_objects_in_get:
+                raise MethodError("requestTooLarge")
+            return self.mailbox.get(args)
+        if method == "Email/query":
+            return self.mailbox.query(args)
+        if method == "Email/changes":
+            return self.mailbox.changes(args)
+        if method == "Mailbox/get":
+            return self.mailbox.get_mailboxes(args)
+        if method == "Email/set":
+            if len(args.get("update") or {}) > self.max_objects_in_set:
+                raise MethodError("requestTooLarge")
+            return self.mailbox.set(args)
+        raise MethodError("unknownMethod")
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so the event stream can be sent chunked, as Fastmail does
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/jmap/session":
+            self._send_json(200, self.server.session())
+        elif url.path == "/jmap/eventsource/":
+            ping = int(parse_qs(url.query).get("ping", ["30"])[0] or 30)
+            self._event_source(ping)
+        else:
+            self._send_json(404, {"type": "about:blank", "status": 404})
+
+    def do_POST(self):
+        server = self.server
+        # Read the body even when failing the request, so the connection stays usable
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server.requests_served += 1
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and server.random.random() < server.error_rate:
+            self._send_json(503, {"type": "about:blank", "status": 503, "detail": "Injected error"})
+            return
+
+        request = json.loads(body)
+        method_calls = request.get("methodCalls", [])
+        if len(method_calls) > server.max_calls_in_request:
+            self._send_json(400, {"type": "urn:ietf:params:jmap:error:limit", "limit": "maxCallsInRequest",
+                                  "status": 400})
+            return
+
+        responses = []
+        for method, args, call_id in method_calls:
+            try:
+                args = dict(args)
+                for key in [key for key in args if key.startswith("#")]:
+                    args[key[1:]] = _resolve_reference(args.pop(key), responses)
+                responses.append([method, server.call(method, args), call_id])
+            except MethodError as e:
+                responses.append(["error", {"type": e.type}, call_id])
+        self._send_json(200, {"methodResponses": responses, "sessionState": "0"})
+
+    def _event_source(self, ping: int) -> None:
+        mailbox = self.server.mailbox
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(text: str) -> None:
+            payload = text.encode("utf-8")
+            self.wfile.write(f"{len(payload):x}\r\n".encode("ascii") + payload + b"\r\n")
+            self.wfile.flush()
+
+        state = None
+        try:
+            while True:
+                with mailbox.changed:
+                    if state == mailbox.state:
+                        mailbox.changed.wait(timeout=ping)
+                    new_state = mailbox.state
+                if new_state != state:
+                    state = new_state
+                    changed = {"@type": "StateChange", "changed": {ACCOUNT_ID: {"Email": state}}}
+                    send(f"event: state\ndata: {json.dumps(changed)}\n\n")
+                else:
+                    send(": ping\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+def record_mailbox(watcher, path: str, limit: int = 500) -> int:
+    """
+    Save the newest `limit` emails from a real account, unprocessed, as a
+    mailbox fixture. Takes a FastmailWatcher. Returns how many were saved.
+    """
+    from fastmail_watcher import EMAIL_PROPERTIES
+
+    email_ids = watcher._jmap_call([["Email/query", {
+        "accountId": watcher.account_id,
+        "sort": [{"property": "receivedAt", "isAscending": False}],
+        "limit": limit
+    }, "q"]])[0][1]["ids"]
+
+    emails = []
+    for i in range(0, len(email_ids), watcher.max_objects_in_get):
+        emails.extend(watcher._jmap_call([["Email/get", {
+            "accountId": watcher.account_id,
+            "ids": email_ids[i:i + watcher.max_objects_in_get],
+            "properties": EMAIL_PROPERTIES + ["receivedAt"],
+            "fetchTextBodyValues": True
+        }, "g"]])[0][1]["list"])
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"emails": emails}, f, indent=1)
+    return len(emails)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record = commands.add_parser("record", help="save emails from the real account as a fixture")
+    record.add_argument("fixture")
+    record.add_argument("--limit", type=int, default=500)
+
+    serve = commands.add_parser("serve", help="serve a fixture")
+    serve.add_argument("fixture")
+    serve.add_argument("--host", default="localhost")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--delivered", type=int, help="emails visible at start (default all)")
+    serve.add_argument("--arrival-interval", type=float, help="deliver one more email every this many seconds")
+    serve.add_argument("--latency", type=float, default=0.0, help="seconds added to every API request")
+    serve.add_argument("--error-rate", type=float, default=0.0, help="share of API requests answered with 503")
+    serve.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        from fastmail_watcher import FastmailWatcher
+        api_token = os.getenv("FASTMAIL_API_TOKEN")
+        if not api_token:
+            raise ValueError("Please set FASTMAIL_API_TOKEN environment variable")
+        count = record_mailbox(FastmailWatcher(api_token), args.fixture, args.limit)
+        print(f"Saved {count} emails to {args.fixture}")
+        return
+
+    mailbox = StandInMailbox.load(args.fixture, args.delivered)
+    server = JMAPStandInServer(mailbox, args.host, args.port, latency=args.latency,
+                               error_rate=args.error_rate, seed=args.seed)
+    print(f"Serving {len(mailbox.emails)} emails ({mailbox.delivered} delivered) at {server.session_url}")
+    if not args.arrival_interval:
+        server.serve_forever()
+        return
+
+    server.start()
+    while mailbox.delivered < len(mailbox.emails):
+        time.sleep(args.arrival_interval)
+        mailbox.deliver()
+    print("All emails delivered")
+    while True:
+        time.sleep(3600)
+
+if __name__ == "__main__":
+    main()
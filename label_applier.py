@@ -0,0 +1,131 @@
+"""
+Write classifier labels back to Fastmail. Emails labeled fyi or junk are
+moved out of the Inbox into the matching mailbox (junk also gets the $junk
+keyword, which trains Fastmail's spam filter); inbox emails are left where
+they are.
+
+Updates are batched: one Email/set per maxObjectsInSet emails, packed up to
+maxCallsInRequest calls per request, so a backlog of a thousand emails takes
+a request or two. Mailbox ids are looked up once with Mailbox/get and cached.
+
+With a SenderHistoryIndex, every label that was applied is recorded against
+its sender, so repeat senders can be answered without the model next time.
+"""
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Mailbox for each label, found by role first and then by name
+LABEL_MAILBOXES = {
+    'inbox': {'role': 'inbox', 'name': 'Inbox'},
+    'fyi': {'role': None, 'name': 'FYI'},
+    'junk': {'role': 'junk', 'name': 'Junk'},
+}
+
+# Failures that won't go away by retrying
+PERMANENT_SET_ERRORS = {'notFound', 'invalidPatch', 'invalidProperties', 'forbidden'}
+
+class LabelApplier:
+    """
+    Applies labels through a FastmailWatcher's JMAP session. apply() retries
+    emails the server reports in notUpdated (unless the error is permanent)
+    up to max_retries times, and returns the ones that still failed.
+    """
+    def __init__(self, watcher, label_mailboxes: Dict[str, Dict[str, Optional[str]]] = LABEL_MAILBOXES,
+                 max_retries: int = 3, retry_backoff: float = 1.0, sender_history=None):
+        self.watcher = watcher
+        self.sender_history = sender_history
+        self.label_mailboxes = label_mailboxes
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._mailbox_ids = None
+        self.requests = 0
+        self.applied = 0
+
+    def mailbox_ids(self) -> Dict[str, str]:
+        """Mailbox id for each label, fetched on first use."""
+        if self._mailbox_ids is None:
+            mailboxes = self.watcher._jmap_call([["Mailbox/get", {
+                "accountId": self.watcher.account_id,
+                "properties": ["name", "role"]
+            }, "m"]])[0][1]["list"]
+            self.requests += 1
+
+            ids = {}
+            for label, wanted in self.label_mailboxes.items():
+                match = next((mailbox for mailbox in mailboxes
+                              if wanted.get('role') and mailbox.get('role') == wanted['role']), None)
+                match = match or next((mailbox for mailbox in mailboxes
+                                       if (mailbox.get('name') or '').lower() == wanted['name'].lower()), None)
+                if match is None:
+                    raise ValueError(f"No mailbox for label {label}, create one named {wanted['name']}")
+                ids[label] = match["id"]
+            self._mailbox_ids = ids
+        return self._mailbox_ids
+
+    def _patch(self, label: str) -> Optional[Dict[str, Any]]:
+        mailbox_ids = self.mailbox_ids()
+        if label == 'inbox' or label not in mailbox_ids:
+            return None
+        patch = {
+            f"mailboxIds/{mailbox_ids['inbox']}": None,
+            f"mailboxIds/{mailbox_ids[label]}": True
+        }
+        if label == 'junk':
+            patch["keywords/$junk"] = True
+        return patch
+
+    def _set(self, updates: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Send the updates in as few requests as possible. Returns notUpdated."""
+        watcher = self.watcher
+        max_objects = getattr(watcher, 'max_objects_in_set', 500)
+        email_ids = list(updates)
+        chunks = [email_ids[i:i + max_objects] for i in range(0, len(email_ids), max_objects)]
+
+        not_updated = {}
+        for i in range(0, len(chunks), watcher.max_calls_in_request):
+            method_calls = [
+                ["Email/set", {
+                    "accountId": watcher.account_id,
+                    "update": {email_id: updates[email_id] for email_id in chunk}
+                }, f"s{n}"]
+                for n, chunk in enumerate(chunks[i:i + watcher.max_calls_in_request])
+            ]
+            self.requests += 1
+            for _, result, _ in watcher._jmap_call(method_calls):
+                self.applied += len(result.get("updated") or {})
+                not_updated.update(result.get("notUpdated") or {})
+        return not_updated
+
+    def apply(self, labeled: List[Tuple[str, str]],
+              senders: Optional[Dict[str, str]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Apply (email_id, label) pairs. Returns {email_id: SetError} for emails
+        that couldn't be updated. senders maps email ids to sender addresses
+        for the sender history.
+        """
+        patches = {}
+        for email_id, label in labeled:
+            patch = self._patch(label)
+            if patch:
+                patches[email_id] = patch
+
+        pending = patches
+        failed = {}
+        for attempt in range(self.max_retries + 1):
+            if not pending:
+                break
+            if attempt:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            not_updated = self._set(pending)
+            pending = {}
+            for email_id, error in not_updated.items():
+                if error.get("type") in PERMANENT_SET_ERRORS or attempt == self.max_retries:
+                    failed[email_id] = error
+                else:
+                    pending[email_id] = patches[email_id]
+
+        if self.sender_history and senders:
+            for email_id, label in labeled:
+                if email_id not in failed and label in self.label_mailboxes and senders.get(email_id):
+                    self.sender_history.record(senders[email_id], label)
+        return failed
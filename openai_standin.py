@@ -0,0 +1,237 @@
+"""
+A local stand-in for the parts of the OpenAI API this project uses: chat
+completions, and the Files and Batch endpoints behind backfill_openai.py. It
+answers from a fixture recorded by evals.py --record (or with a fixed label),
+so backfills and live classification can be tried without an account:
+
+    python openai_standin.py --port 8766 --fixture fixtures/gpt-4o-mini.json
+    OPENAI_BASE_URL=http://localhost:8766/v1 OPENAI_API_KEY=x python backfill_openai.py run
+
+Batch jobs finish completion_delay seconds after they're created, with
+batch_status ('completed', or e.g. 'failed' to try out resubmission), and
+error_rate is the share of requests (in batches or live) that fail. Requests
+asking for logprobs get the answer as a single token with probability
+confidence, and ones constrained to the label schema get it as JSON.
+"""
+import argparse
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+from prompts import split_messages
+from providers.replay_provider import fixture_key, load_fixture
+
+class OpenAIStandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "localhost", port: int = 8766, fixture_path: Optional[str] = None,
+                 default_label: str = "inbox", completion_delay: float = 1.0, error_rate: float = 0.0,
+                 confidence: float = 0.9, seed: Optional[int] = None, batch_status: str = "completed"):
+        super().__init__((host, port), _Handler)
+        self.responses = load_fixture(fixture_path) if fixture_path else {}
+        self.default_label = default_label
+        self.completion_delay = completion_delay
+        self.batch_status = batch_status
+        self.error_rate = error_rate
+        self.confidence = confidence
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.files = {}
+        self.batches = {}
+        self.prompts = set()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> str:
+        """Serve from a background thread and return the base URL for OPENAI_BASE_URL."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def complete(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """Answer one chat completion request as (status code, response body)."""
+        with self.lock:
+            failed = self.error_rate and self.random.random() < self.error_rate
+        if failed:
+            return 500, {"error": {"message": "Injected error", "type": "server_error"}}
+
+        prompt, content = split_messages(body.get("messages", []))
+        text = prompt + "\n" + content
+        response = self.responses.get(fixture_key(content, prompt))
+        answer = response["completion"] if response else self.default_label
+        # Constrained decoding: JSON for the single label schema, one token with max_tokens=1
+        response_format = body.get("response_format") or {}
+        if response_format.get("json_schema", {}).get("name") == "label":
+            answer = json.dumps({"label": answer})
+        completion_tokens = 1 if body.get("max_tokens") == 1 else max(len(answer) // 4, 1)
+        choice = {"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}
+        if body.get("logprobs"):
+            choice["logprobs"] = {"content": [{"token": answer, "logprob": math.log(self.confidence),
+                                               "bytes": list(answer.encode("utf-8")), "top_logprobs": []}]}
+        return 200, {
+            "id": f"chatcmpl-{next(self.ids)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", ""),
+            "choices": [choice],
+            # Roughly four characters per token
+            "usage": {"prompt_tokens": len(text) // 4, "completion_tokens": completion_tokens,
+                      "total_tokens": len(text) // 4 + completion_tokens,
+                      "prompt_tokens_details": {"cached_tokens": self.cached_tokens(prompt, len(text) // 4)}}
+        }
+
+    def cached_tokens(self, prompt: str, prompt_tokens: int) -> int:
+        """
+        Like OpenAI's prompt caching: a system prompt seen before is read from
+        the cache in 128-token steps, once it's at least 1024 tokens long.
+        """
+        with self.lock:
+            seen = prompt in self.prompts
+            self.prompts.add(prompt)
+        prefix_tokens = min(len(prompt) // 4, prompt_tokens)
+        return prefix_tokens // 128 * 128 if seen and prefix_tokens >= 1024 else 0
+
+    def add_file(self, filename: str, purpose: str, content: bytes) -> Dict[str, Any]:
+        file = {"id": f"file-{next(self.ids)}", "object": "file", "bytes": len(content),
+                "created_at": int(time.time()), "filename": filename, "purpose": purpose, "status": "processed"}
+        self.files[file["id"]] = (file, content)
+        return file
+
+    def create_batch(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        if args.get("input_file_id") not in self.files:
+            raise KeyError(args.get("input_file_id"))
+        batch = {"id": f"batch_{next(self.ids)}", "object": "batch", "endpoint": args.get("endpoint"),
+                 "input_file_id": args["input_file_id"], "completion_window": args.get("completion_window"),
+                 "status": "in_progress", "created_at": int(time.time()), "output_file_id": None,
+                 "error_file_id": None, "metadata": args.get("metadata"),
+                 "request_counts": {"total": 0, "completed": 0, "failed": 0}}
+        self.batches[batch["id"]] = (batch, time.monotonic())
+        return batch
+
+    def get_batch(self, batch_id: str) -> Dict[str, Any]:
+        batch, created = self.batches[batch_id]
+        if batch["status"] == "in_progress" and time.monotonic() - created >= self.completion_delay:
+            self._run_batch(batch)
+        return batch
+
+    def list_batches(self) -> Dict[str, Any]:
+        """Every batch, newest first, as one page."""
+        batches = [self.get_batch(batch_id) for batch_id in reversed(list(self.batches))]
+        return {"object": "list", "data": batches, "has_more": False,
+                "first_id": batches[0]["id"] if batches else None, "last_id": batches[-1]["id"] if batches else None}
+
+    def _run_batch(self, batch: Dict[str, Any]) -> None:
+        if self.batch_status != "completed":
+            # Ends before answering anything, as a job that failed validation does
+            batch["status"] = self.batch_status
+            return
+        outputs, errors = [], []
+        for line in self.files[batch["input_file_id"]][1].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            status, body = self.complete(request["body"])
+            result = {"id": f"batch_req_{next(self.ids)}", "custom_id": request["custom_id"],
+                      "response": {"status_code": status, "body": body}, "error": None}
+            (outputs if status == 200 else errors).append(json.dumps(result))
+
+        if outputs:
+            batch["output_file_id"] = self.add_file("output.jsonl", "batch_output", "\n".join(outputs).encode("utf-8"))["id"]
+        if errors:
+            batch["error_file_id"] = self.add_file("errors.jsonl", "batch_output", "\n".join(errors).encode("utf-8"))["id"]
+        batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)}
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body, content_type: str = "application/json") -> None:
+        payload = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _not_found(self) -> None:
+        self._send(404, {"error": {"message": f"No such resource: {self.path}", "type": "invalid_request_error"}})
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        server = self.server
+        if parts[:2] == ["v1", "files"] and len(parts) >= 3 and parts[2] in server.files:
+            file, content = server.files[parts[2]]
+            if len(parts) == 4 and parts[3] == "content":
+                self._send(200, content, "application/octet-stream")
+            else:
+                self._send(200, file)
+        elif parts[:2] == ["v1", "batches"] and len(parts) == 3 and parts[2] in server.batches:
+            self._send(200, server.get_batch(parts[2]))
+        elif parts == ["v1", "batches"]:
+            self._send(200, server.list_batches())
+        else:
+            self._not_found()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?")[0].rstrip("/")
+        server = self.server
+
+        if path == "/v1/chat/completions":
+            self._send(*server.complete(json.loads(body)))
+        elif path == "/v1/files":
+            # Multipart form: parse it as a MIME message with the request's content type
+            message = BytesParser(policy=default_policy).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + body
+            )
+            fields = {}
+            for part in message.iter_parts():
+                fields[part.get_param("name", header="content-disposition")] = (part.get_filename(),
+                                                                                  part.get_payload(decode=True))
+            filename, content = fields["file"]
+            purpose = fields.get("purpose", (None, b"batch"))[1].decode("utf-8")
+            self._send(200, server.add_file(filename or "upload.jsonl", purpose, content))
+        elif path == "/v1/batches":
+            try:
+                self._send(200, server.create_batch(json.loads(body)))
+            except KeyError:
+                self._send(400, {"error": {"message": "Unknown input_file_id", "type": "invalid_request_error"}})
+        else:
+            self._not_found()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--fixture", help="answers recorded by evals.py --record")
+    parser.add_argument("--label", default="inbox", help="answer for requests not in the fixture")
+    parser.add_argument("--completion-delay", type=float, default=1.0, help="seconds until a batch job finishes")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--confidence", type=float, default=0.9, help="probability reported with logprobs")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--batch-status", default="completed", choices=["completed", "failed", "expired", "cancelled"],
+                        help="how batch jobs end")
+    args = parser.parse_args()
+
+    server = OpenAIStandInServer(args.host, args.port, fixture_path=args.fixture, default_label=args.label,
+                                 completion_delay=args.completion_delay, error_rate=args.error_rate,
+                                 confidence=args.confidence, seed=args.seed, batch_status=args.batch_status)
+    print(f"Serving the OpenAI stand-in at {server.base_url}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Classify many emails concurrently. Requests to the provider are capped at a
+fixed number in flight, optionally rate limited, and retried with backoff when
+the provider answers 429 or a 5xx.
+
+The blocking wrappers all run on one event loop that lives as long as the
+process. Providers keep an async client (and its connection pool) per loop,
+so a fresh loop per call, as asyncio.run makes, would leave a client behind
+every time and never reuse a connection.
+"""
+import asyncio
+import random
+import threading
+from typing import List, Optional
+
+from classify_email import aclassify_email, aclassify_email_batch
+from providers import LLMProvider
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def run_async(coroutine):
+    """Run coroutine on the shared event loop and wait for its result; callable from any thread."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='pipeline-loop', daemon=True).start()
+    future = asyncio.run_coroutine_threadsafe(coroutine, _loop)
+    try:
+        return future.result()
+    except BaseException:
+        # e.g. Ctrl-C while waiting: don't leave the calls running
+        future.cancel()
+        raise
+
+class RateLimiter:
+    """Spaces out request starts so there are at most `rate` per second."""
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.next_time = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            if self.next_time > now:
+                await asyncio.sleep(self.next_time - now)
+            self.next_time = max(now, self.next_time) + self.interval
+
+def _status_code(error: Exception) -> Optional[int]:
+    # openai errors carry status_code, httpx and requests errors carry a response
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status_code
+
+async def _with_retry(call, limiter: Optional[RateLimiter], max_retries: int, backoff: float):
+    for attempt in range(max_retries + 1):
+        if limiter:
+            await limiter.wait()
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == max_retries or _status_code(e) not in RETRY_STATUS_CODES:
+                raise
+            # Exponential backoff with jitter so parallel retries don't land together
+            await asyncio.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.0))
+
+async def _classify_with_retry(provider: LLMProvider, content: str, limiter: Optional[RateLimiter],
+                               max_retries: int, backoff: float) -> str:
+    return await _with_retry(lambda: aclassify_email(provider, content), limiter, max_retries, backoff)
+
+async def classify_many_async(provider: LLMProvider, contents: List[str], concurrency: int = 8,
+                              rate_limit: Optional[float] = None, max_retries: int = 5,
+                              backoff: float = 1.0) -> List[str]:
+    """
+    Classify all contents with at most `concurrency` provider calls in flight
+    and, if rate_limit is set, no more than rate_limit calls started per second.
+    Labels come back in the same order as contents.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate_limit) if rate_limit else None
+
+    async def classify_one(content: str) -> str:
+        async with semaphore:
+            return await _classify_with_retry(provider, content, limiter, max_retries, backoff)
+
+    return await asyncio.gather(*(classify_one(content) for content in contents))
+
+def classify_many(provider: LLMProvider, contents: List[str], **kwargs) -> List[str]:
+    """Blocking wrapper around classify_many_async for the scripts."""
+    return run_async(classify_many_async(provider, contents, **kwargs))
+
+def pack_batches(contents: List[str], batch_size: int, max_batch_tokens: int) -> List[List[int]]:
+    """
+    Group indexes of contents into batches of at most batch_size emails and
+    roughly max_batch_tokens tokens of email text. A single email over the
+    budget gets a batch of its own.
+    """
+    batches, batch, batch_tokens = [], [], 0
+    for i, content in enumerate(contents):
+        # About four characters per token, plus the batch header line
+        tokens = len(content) // 4 + 10
+        if batch and (len(batch) >= batch_size or batch_tokens + tokens > max_batch_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+async def classify_many_batched_async(provider: LLMProvider, contents: List[str], batch_size: int = 20,
+                                      max_batch_tokens: int = 8000, concurrency: int = 8,
+                                      rate_limit: Optional[float] = None, max_retries: int = 5,
+                                      backoff: float = 1.0) -> List[str]:
+    """
+    Like classify_many_async, but sends the instructions once per batch of
+    emails instead of once per email (see classify_email_batch). Emails the
+    batch answer leaves out or garbles, and whole batches that fail, fall back
+    to one call per email.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate_limit) if rate_limit else None
+    labels = [None] * len(contents)
+
+    async def classify_one(i: int) -> None:
+        async with semaphore:
+            labels[i] = await _classify_with_retry(provider, contents[i], limiter, max_retries, backoff)
+
+    async def classify_batch(batch: List[int]) -> None:
+        async with semaphore:
+            try:
+                results = await _with_retry(lambda: aclassify_email_batch(provider, [contents[i] for i in batch]),
+                                            limiter, max_retries, backoff)
+            except Exception:
+                results = [None] * len(batch)
+        for i, label in zip(batch, results):
+            labels[i] = label
+        await asyncio.gather(*(classify_one(i) for i, label in zip(batch, results) if label is None))
+
+    await asyncio.gather(*(classify_batch(batch) for batch in pack_batches(contents, batch_size, max_batch_tokens)))
+    return labels
+
+def classify_emails(provider: LLMProvider, contents: List[str], concurrency: int = 8,
+                    batch_size: Optional[int] = None) -> List[str]:
+    """
+    Classify a batch of emails the fastest way the provider supports: a single
+    batched forward pass for local models, otherwise concurrent calls. With
+    batch_size, providers that support it get that many emails per request.
+    """
+    if hasattr(provider, 'classify_batch'):
+        return provider.classify_batch(contents)
+    if batch_size and hasattr(provider, 'get_json_completion'):
+        return run_async(classify_many_batched_async(provider, contents, batch_size=batch_size,
+                                                     concurrency=concurrency))
+    return classify_many(provider, contents, concurrency=concurrency)
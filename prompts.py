@@ -0,0 +1,45 @@
+"""
+The prompts every model is asked with, and how a request is laid out: the
+prompt goes first as a system message that never changes between calls, and
+the email goes last in its own user message. Prompt-caching APIs and Ollama's
+KV cache can then reuse the shared prefix instead of reading it again for
+every email. The fine-tuning data (finetune_openai.py) uses the same layout,
+so the fine-tuned model is asked exactly the way it was trained.
+
+Keep these strings byte-stable: any change, even whitespace, invalidates
+caches, fixtures, and the match with the fine-tuning data.
+"""
+from typing import Dict, List, Tuple
+
+# The labeling rules, shared by the single and batch prompts
+INSTRUCTIONS = """You are my executive assistant, and you are excellent at sorting through my emails and labeling them as Inbox, FYI, or Junk.
+
+Inbox includes personal and professional correspondance with real humans that I know. It also may include automated emails from services I use when they require my action, for example login links. Also in inbox: investor updates, calendar invites. If they reference one of my projects such as The Browser Company, Muse, Ink & Switch, Heroku, or Local-First Conf then they usually go to the inbox.
+
+FYI includes order receipts (for example, from Amazon) and newsletters I've subscribed to such as Money Stuff, Tangle, Benedict Evans, Hacker Newsletter, Elicit, Butter Docs, and Kevin Lynagh. Also included in FYI: security alerts, Patreon project updates, and Readwise highlights. All newsletters from buttondown.email are in FYI.
+
+Junk is any sale or promotion (even from a service I've purchased from) and newsletters that I never subscribed to. All Substack newsletters go to junk (I read them in the app instead)."""
+
+SYSTEM_PROMPT = INSTRUCTIONS + """
+
+Response to the email below the line with just the label, nothing else."""
+
+BATCH_SYSTEM_PROMPT = INSTRUCTIONS + """
+
+Below the line are several emails, each starting with a header line like "=== Email 3 ===". Label every one of them, answering with the number from its header line as the id and the label (inbox, fyi or junk)."""
+
+# Starts the user message, so the email is "below the line"
+EMAIL_SEPARATOR = "---\n"
+
+def chat_messages(prompt: str, content: str) -> List[Dict[str, str]]:
+    """The system and user messages for one request: the static prompt, then the email."""
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": EMAIL_SEPARATOR + content}
+    ]
+
+def split_messages(messages: List[Dict[str, str]]) -> Tuple[str, str]:
+    """The (prompt, content) chat_messages was given, e.g. to look up a recorded answer."""
+    prompt = "\n".join(message.get("content") or "" for message in messages if message.get("role") == "system")
+    content = "\n".join(message.get("content") or "" for message in messages if message.get("role") == "user")
+    return prompt, content[len(EMAIL_SEPARATOR):] if content.startswith(EMAIL_SEPARATOR) else content
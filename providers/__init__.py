@@ -1,4 +1,84 @@
-from .providers import LLMProvider, OpenAIProvider, OllamaProvider
-from .distilbert_provider import DistilBertProvider
+"""
+Providers are imported on first use, so a CLI that only needs one backend
+(or that talks to classifier_service.py) doesn't pay for loading the others:
+torch and transformers for DistilBERT, the OpenAI SDK, NumPy.
+"""
+import importlib
+import os
+from typing import Optional
 
-__all__ = ['LLMProvider', 'OpenAIProvider', 'OllamaProvider', 'DistilBertProvider']
\ No newline at end of file
+from .base import LLMProvider, AsyncLLMProvider
+from .labels import LABELS, normalize_label
+
+# Where each provider class lives, imported when first looked up
+_MODULES = {
+    'OpenAIProvider': '.providers',
+    'OllamaProvider': '.providers',
+    'DistilBertProvider': '.distilbert_provider',
+    'LinearProvider': '.linear_provider',
+    'CachedProvider': '.cached_provider',
+    'RulesProvider': '.rules_provider',
+    'RulesEngine': '.rules_provider',
+    'Rule': '.rules_provider',
+    'SenderHistoryProvider': '.sender_history_provider',
+    'SenderHistoryIndex': '.sender_history_provider',
+    'RecordingProvider': '.replay_provider',
+    'ReplayProvider': '.replay_provider',
+    'InjectedError': '.replay_provider',
+    'ServiceProvider': '.service_provider',
+    'ServiceError': '.service_provider',
+    'CascadeProvider': '.cascade_provider',
+    'KnnProvider': '.knn_provider',
+    'VectorIndex': '.knn_provider',
+}
+
+# Provider types accepted by create_provider (and LLM_PROVIDER)
+PROVIDER_TYPES = ['openai', 'ollama', 'distilbert', 'linear', 'knn', 'replay', 'service', 'cascade']
+
+def __getattr__(name: str):
+    if name not in _MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_MODULES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODULES))
+
+def create_provider(provider_type: str, model: str, decoding: Optional[str] = None, **kwargs):
+    """
+    The model provider for a type name, importing only its backend. model is
+    the model name, or for local and offline types the file (or service URL)
+    it loads from. decoding constrains OpenAI and Ollama answers (including a
+    cascade's), see OpenAIProvider; other providers always answer a label.
+    """
+    if provider_type in ("openai", "ollama") and decoding:
+        kwargs['decoding'] = decoding
+    if provider_type == "openai":
+        return __getattr__('OpenAIProvider')(model=model, **kwargs)
+    elif provider_type == "ollama":
+        return __getattr__('OllamaProvider')(model=model, **kwargs)
+    elif provider_type == "distilbert":
+        # DISTILBERT_QUANTIZE=1 loads an int8 copy: faster on CPU, possibly less accurate
+        quantize = os.getenv("DISTILBERT_QUANTIZE") == "1"
+        return __getattr__('DistilBertProvider')(model, **{'quantize': quantize, **kwargs})
+    elif provider_type == "linear":
+        # A file trained by providers/linear_provider.py
+        return __getattr__('LinearProvider')(model, **kwargs)
+    elif provider_type == "knn":
+        # The path (without extension) of an index built by providers/knn_provider.py
+        return __getattr__('KnnProvider')(model, **kwargs)
+    elif provider_type == "replay":
+        # Offline runs: the model is a fixture recorded by evals.py --record
+        return __getattr__('ReplayProvider')(model, **{'default': 'inbox', **kwargs})
+    elif provider_type == "service":
+        # The model is the URL of a running classifier_service.py
+        return __getattr__('ServiceProvider')(model, **kwargs)
+    elif provider_type == "cascade":
+        # The model lists the tiers, e.g. "linear:linear_model.npz@0.9,openai:gpt-4o"
+        from .cascade_provider import CascadeProvider, parse_cascade
+        return CascadeProvider([(tier_model, create_provider(tier_type, tier_model, decoding), threshold)
+                                for tier_type, tier_model, threshold in parse_cascade(model)], **kwargs)
+    raise ValueError(f"Unknown provider type: {provider_type}")
+
+__all__ = ['LLMProvider', 'AsyncLLMProvider', 'LABELS', 'normalize_label', 'PROVIDER_TYPES', 'create_provider'] + list(_MODULES)
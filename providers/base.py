@@ -0,0 +1,9 @@
+from typing import Protocol
+
+class LLMProvider(Protocol):
+    def get_completion(self, content: str, prompt: str) -> str:
+        pass
+
+class AsyncLLMProvider(Protocol):
+    async def aget_completion(self, content: str, prompt: str) -> str:
+        pass
@@ -0,0 +1,126 @@
+"""
+Wrap any LLMProvider with a persistent cache of its answers, so an email that
+was already classified with the same prompt and model never costs another call.
+"""
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Any
+
+from .labels import LABELS
+
+def provider_identity(provider) -> str:
+    """
+    Provider class plus model name, e.g. 'OpenAIProvider:gpt-4o', and the
+    decoding mode when answers are constrained ('OpenAIProvider:gpt-4o:schema').
+    Providers without a model name describe what their answers depend on in
+    cache_identity(), e.g. a cascade's tiers or a service's URL.
+    """
+    if hasattr(provider, 'cache_identity'):
+        return f"{type(provider).__name__}:{provider.cache_identity()}"
+    model = getattr(provider, 'model', '')
+    if not isinstance(model, str):
+        # DistilBertProvider.model is the loaded network, identify it by where it came from
+        model = getattr(provider, 'model_path', '')
+    identity = f"{type(provider).__name__}:{model}"
+    decoding = getattr(provider, 'decoding', 'free')
+    return identity if decoding == 'free' else f"{identity}:{decoding}"
+
+class CachedProvider:
+    def __init__(self, provider, db_path: str = "classification_cache.sqlite",
+                 max_entries: int = 100_000, max_age_days: float = 30):
+        self.provider = provider
+        self.identity = provider_identity(provider)
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 24 * 60 * 60
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+        # Shared between the async pipeline's threads and the watcher daemon's workers
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS completion_cache (
+            key TEXT PRIMARY KEY,
+            completion TEXT,
+            created_at REAL,
+            last_used_at REAL
+        )
+        ''')
+        self.conn.commit()
+
+    def _key(self, content: str, prompt: str) -> str:
+        normalized = re.sub(r'\s+', ' ', content).strip()
+        return hashlib.sha256("\0".join([self.identity, prompt, normalized]).encode('utf-8')).hexdigest()
+
+    def _lookup(self, key: str):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT completion, created_at FROM completion_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or time.time() - row[1] > self.max_age:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.conn.execute('UPDATE completion_cache SET last_used_at = ? WHERE key = ?', (time.time(), key))
+            self.conn.commit()
+            return row[0]
+
+    def _store(self, key: str, completion: str) -> None:
+        now = time.time()
+        with self.lock:
+            self.conn.execute('''
+            INSERT OR REPLACE INTO completion_cache (key, completion, created_at, last_used_at)
+            VALUES (?, ?, ?, ?)
+            ''', (key, completion, now, now))
+            self._writes += 1
+            # Evicting on every write would scan the table each time, so do it in batches
+            if self._writes % 1000 == 1:
+                self._evict(now)
+            self.conn.commit()
+
+    def _evict(self, now: float) -> None:
+        self.conn.execute('DELETE FROM completion_cache WHERE created_at < ?', (now - self.max_age,))
+        self.conn.execute('''
+        DELETE FROM completion_cache WHERE key IN (
+            SELECT key FROM completion_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+        )
+        ''', (self.max_entries,))
+
+    def get_completion(self, content: str, prompt: str) -> str:
+        key = self._key(content, prompt)
+        completion = self._lookup(key)
+        if completion is None:
+            completion = self.provider.get_completion(content, prompt)
+            if completion in LABELS:
+                self._store(key, completion)
+        return completion
+
+    async def aget_completion(self, content: str, prompt: str) -> str:
+        key = self._key(content, prompt)
+        completion = self._lookup(key)
+        if completion is None:
+            if hasattr(self.provider, 'aget_completion'):
+                completion = await self.provider.aget_completion(content, prompt)
+            else:
+                completion = await asyncio.to_thread(self.provider.get_completion, content, prompt)
+            # Answers that aren't a label get asked again rather than kept for a month
+            if completion in LABELS:
+                self._store(key, completion)
+        return completion
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        with self.lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM completion_cache').fetchone()[0]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0,
+            'entries': entries
+        }
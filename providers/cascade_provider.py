@@ -0,0 +1,221 @@
+"""
+Run the cheapest model first and only pass an email on to the next, more
+expensive one when the cheap one isn't sure. Each tier but the last needs a
+confidence for its answer: DistilBERT and the linear model report their
+softmax probability, OpenAI models the probability of the answer's tokens.
+An answer is kept if its confidence reaches the tier's threshold and it's a
+valid label; the last tier's answer is always kept.
+
+As an LLM_PROVIDER, the model is a list of tiers, cheapest first:
+
+    LLM_PROVIDER=cascade LLM_MODEL="linear:linear_model.npz@0.9,openai:gpt-4o-mini@0.8,openai:gpt-4o"
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from classify_email import PROMPT
+from .cached_provider import provider_identity
+from .labels import LABELS
+
+class Tier:
+    def __init__(self, name: str, provider, threshold: Optional[float] = None):
+        self.name = name
+        self.provider = provider
+        self.threshold = threshold
+        self.reset()
+
+    def reset(self) -> None:
+        self.emails = 0
+        self.kept = 0
+        self.calls = 0
+        self.seconds = 0.0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'threshold': self.threshold,
+            'emails': self.emails,
+            'kept': self.kept,
+            'escalated': self.emails - self.kept,
+            'calls': self.calls,
+            'mean_latency_ms': self.seconds / self.calls * 1000 if self.calls else None,
+            'prompt_tokens': self.prompt_tokens,
+            'cached_tokens': self.cached_tokens,
+            'completion_tokens': self.completion_tokens
+        }
+
+# A tier's answer: the label, its confidence (None from the last tier) and
+# the call's token usage (None for batch calls and local models)
+Answer = Tuple[str, Optional[float], Optional[Dict[str, int]]]
+
+def _has_confidence(provider) -> bool:
+    return hasattr(provider, 'get_completion_with_confidence') or hasattr(provider, 'classify_batch_with_confidence')
+
+class CascadeProvider:
+    """
+    tiers are (name, provider, threshold) tuples, cheapest first; the last
+    tier's threshold is ignored and may be left out. Names are model names,
+    so evals.py can price each tier. tier_stats() reports how many emails
+    each tier saw and kept, its latency and its token usage, in tier order.
+
+    With a first tier that labels batches (DistilBERT, linear), the cascade
+    does too, and the emails it escalates go to the next tier together, or
+    concurrently for tiers that take one email at a time.
+    """
+    def __init__(self, tiers: Sequence[Tuple], concurrency: int = 8):
+        if not tiers:
+            raise ValueError("A cascade needs at least one tier")
+        self.tiers = [Tier(*tier) for tier in tiers]
+        for tier in self.tiers[:-1]:
+            if tier.threshold is None:
+                raise ValueError(f"Cascade tier {tier.name} needs a threshold")
+            if not _has_confidence(tier.provider):
+                raise ValueError(f"Cascade tier {tier.name} can't report confidence, so it can only be the last tier")
+        self.concurrency = concurrency
+        self.lock = threading.Lock()
+        if hasattr(self.tiers[0].provider, 'classify_batch_with_confidence'):
+            self.classify_batch = self._classify_batch
+
+    def cache_identity(self) -> str:
+        """Every tier's provider and threshold, since changing either changes the answers."""
+        return ','.join(f"{provider_identity(tier.provider)}@{tier.threshold}" for tier in self.tiers)
+
+    def _record(self, tier: Tier, start: float, emails: int, kept: int,
+                usage: Optional[Dict[str, int]] = None) -> None:
+        # Usage comes back with each answer: the provider's last_usage is
+        # overwritten by whichever of the concurrent calls finished last
+        usage = usage or {}
+        with self.lock:
+            tier.calls += 1
+            tier.emails += emails
+            tier.kept += kept
+            tier.seconds += time.perf_counter() - start
+            tier.prompt_tokens += usage.get('prompt_tokens', 0)
+            tier.cached_tokens += usage.get('cached_tokens', 0)
+            tier.completion_tokens += usage.get('completion_tokens', 0)
+
+    def _keep(self, tier: Tier, label: str, confidence: Optional[float]) -> bool:
+        return tier is self.tiers[-1] or (label in LABELS and confidence >= tier.threshold)
+
+    def _ask(self, tier: Tier, content: str, prompt: str) -> Answer:
+        provider = tier.provider
+        if tier is self.tiers[-1]:
+            if hasattr(provider, 'get_completion_with_usage'):
+                label, usage = provider.get_completion_with_usage(content, prompt)
+                return label, None, usage
+            return provider.get_completion(content, prompt), None, None
+        if hasattr(provider, 'get_completion_with_confidence'):
+            return provider.get_completion_with_confidence(content, prompt)
+        return (*provider.classify_batch_with_confidence([content])[0], None)
+
+    async def _aask(self, tier: Tier, content: str, prompt: str) -> Answer:
+        provider = tier.provider
+        if tier is self.tiers[-1] and hasattr(provider, 'aget_completion_with_usage'):
+            label, usage = await provider.aget_completion_with_usage(content, prompt)
+            return label, None, usage
+        if tier is self.tiers[-1] and hasattr(provider, 'aget_completion'):
+            return await provider.aget_completion(content, prompt), None, None
+        if tier is not self.tiers[-1] and hasattr(provider, 'aget_completion_with_confidence'):
+            return await provider.aget_completion_with_confidence(content, prompt)
+        return await asyncio.to_thread(self._ask, tier, content, prompt)
+
+    def get_completion(self, content: str, prompt: str) -> str:
+        for tier in self.tiers:
+            start = time.perf_counter()
+            label, confidence, usage = self._ask(tier, content, prompt)
+            kept = self._keep(tier, label, confidence)
+            self._record(tier, start, 1, int(kept), usage)
+            if kept:
+                return label
+
+    async def aget_completion(self, content: str, prompt: str) -> str:
+        for tier in self.tiers:
+            start = time.perf_counter()
+            label, confidence, usage = await self._aask(tier, content, prompt)
+            kept = self._keep(tier, label, confidence)
+            self._record(tier, start, 1, int(kept), usage)
+            if kept:
+                return label
+
+    def _ask_many(self, tier: Tier, contents: List[str]) -> List[Answer]:
+        provider = tier.provider
+        last = tier is self.tiers[-1]
+        if last and hasattr(provider, 'classify_batch'):
+            return [(label, None, None) for label in provider.classify_batch(contents)]
+        if not last and hasattr(provider, 'classify_batch_with_confidence'):
+            return [(label, confidence, None) for label, confidence in provider.classify_batch_with_confidence(contents)]
+
+        # One email per call: run them concurrently, each recorded as its own call
+        def ask(content: str) -> Answer:
+            start = time.perf_counter()
+            answer = self._ask(tier, content, PROMPT)
+            self._record(tier, start, 0, 0, answer[2])
+            return answer
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            return list(pool.map(ask, contents))
+
+    def _classify_batch(self, contents: List[str]) -> List[str]:
+        labels = [None] * len(contents)
+        pending = list(range(len(contents)))
+        for tier in self.tiers:
+            if not pending:
+                break
+            start = time.perf_counter()
+            answers = self._ask_many(tier, [contents[i] for i in pending])
+            escalated = []
+            for i, (label, confidence, _) in zip(pending, answers):
+                if self._keep(tier, label, confidence):
+                    labels[i] = label
+                else:
+                    escalated.append(i)
+
+            # Batch calls count once; single-email calls were counted as they ran
+            batched = hasattr(tier.provider, 'classify_batch' if tier is self.tiers[-1] else 'classify_batch_with_confidence')
+            with self.lock:
+                if batched:
+                    tier.calls += 1
+                    tier.seconds += time.perf_counter() - start
+                tier.emails += len(pending)
+                tier.kept += len(pending) - len(escalated)
+            pending = escalated
+        return labels
+
+    def tier_stats(self) -> List[Dict[str, Any]]:
+        """One entry per tier, cheapest first, so tiers with the same name stay apart."""
+        with self.lock:
+            stats = [tier.as_dict() for tier in self.tiers]
+        first = stats[0]['emails']
+        for tier in stats:
+            tier['share_of_emails'] = tier['emails'] / first if first else None
+        return stats
+
+    def escalation_rate(self) -> Optional[float]:
+        """Share of emails the first tier passed on."""
+        first = self.tiers[0]
+        return (first.emails - first.kept) / first.emails if first.emails else None
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            for tier in self.tiers:
+                tier.reset()
+
+def parse_cascade(spec: str) -> List[Tuple[str, str, Optional[float]]]:
+    """
+    (provider type, model, threshold) for each tier in a spec like
+    "linear:linear_model.npz@0.9,openai:gpt-4o".
+    """
+    tiers = []
+    for part in spec.split(','):
+        provider_type, _, rest = part.strip().partition(':')
+        model, _, threshold = rest.rpartition('@') if '@' in rest else (rest, '', '')
+        if not provider_type or not model:
+            raise ValueError(f"Cascade tiers look like type:model@threshold, got {part!r}")
+        tiers.append((provider_type, model, float(threshold) if threshold else None))
+    return tiers
@@ -1,31 +1,105 @@
-from typing import Protocol
-from transformers import DistilBertForSequenceClassification, DistilBertTokenizer
-from torch.utils.data import Dataset, DataLoader
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from transformers import DistilBertForSequenceClassification, DistilBertTokenizerFast
+from torch.utils.data import IterableDataset, DataLoader
 import torch
+import os
+import random
 import sqlite3
 import re
-import pandas as pd
 
-class EmailDataset(Dataset):
-    def __init__(self, texts, labels, tokenizer, max_length=512):
-        self.encodings = tokenizer(texts, truncation=True, padding=True, max_length=max_length)
-        self.labels = labels
+from email_content import format_email_content
+from feature_store import FeatureStore, SQLITE_MAX_VARIABLES, source_hash
 
-    def __getitem__(self, idx):
-        item = {key: torch.tensor(val[idx]) for key, val in self.encodings.items()}
-        item['labels'] = torch.tensor(self.labels[idx])
-        return item
+# Bump when preprocess_text changes, so stored features are rebuilt
+PREPROCESS_VERSION = 1
+MAX_LENGTH = 512
 
-    def __len__(self):
-        return len(self.labels)
+class EmailStreamDataset(IterableDataset):
+    """
+    Streams the labeled_emails table as length-grouped batches. Each epoch the
+    row ids are shuffled and read chunk_size rows at a time; a chunk is
+    tokenized, sorted by length and cut into batches (in shuffled order), so
+    a batch holds emails of similar length and only one chunk is in memory.
+
+    token_ids turns (email id, text) pairs into token ids, e.g.
+    DistilBertProvider.token_ids, which reads them from its feature store.
+    """
+    def __init__(self, db_path: str, token_ids: Callable[[List[Tuple[str, str]]], List[List[int]]],
+                 label_map: Dict[str, int], batch_size: int = 16, chunk_size: int = 2048, seed: int = 0):
+        self.db_path = db_path
+        self.token_ids = token_ids
+        self.label_map = label_map
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.epoch = 0
+
+        conn = sqlite3.connect(db_path)
+        self.row_ids = [row[0] for row in conn.execute('SELECT rowid FROM labeled_emails ORDER BY rowid')]
+        conn.close()
+
+    def _read_chunk(self, conn, row_ids: List[int]) -> List[tuple]:
+        rows = []
+        for i in range(0, len(row_ids), SQLITE_MAX_VARIABLES):
+            part = row_ids[i:i + SQLITE_MAX_VARIABLES]
+            rows.extend(conn.execute(f'''
+            SELECT email_id, sender_name, sender_email, subject, body, label FROM labeled_emails
+            WHERE rowid IN ({','.join('?' * len(part))})
+            ''', part))
+        return rows
+
+    def __iter__(self) -> Iterator[List[Dict[str, object]]]:
+        rng = random.Random(self.seed + self.epoch)
+        self.epoch += 1
+        row_ids = list(self.row_ids)
+        rng.shuffle(row_ids)
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for start in range(0, len(row_ids), self.chunk_size):
+                rows = self._read_chunk(conn, row_ids[start:start + self.chunk_size])
+                input_ids = self.token_ids([
+                    (email_id, format_email_content(sender_name, sender_email, subject, body, max_body_chars=None))
+                    for email_id, sender_name, sender_email, subject, body, _ in rows
+                ])
+                examples = sorted(
+                    ({'input_ids': ids, 'labels': self.label_map[row[5].lower()]} for row, ids in zip(rows, input_ids)),
+                    key=lambda example: len(example['input_ids'])
+                )
+                batches = [examples[i:i + self.batch_size] for i in range(0, len(examples), self.batch_size)]
+                rng.shuffle(batches)
+                yield from batches
+        finally:
+            conn.close()
+
+class DynamicPaddingCollator:
+    """Pads each batch only to its own longest email."""
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def __call__(self, examples: List[Dict[str, object]]) -> Dict[str, torch.Tensor]:
+        batch = self.tokenizer.pad({'input_ids': [example['input_ids'] for example in examples]}, return_tensors='pt')
+        batch['labels'] = torch.tensor([example['labels'] for example in examples])
+        return batch
 
 class DistilBertProvider:
-    def __init__(self, model_path: str = "distilbert-base-uncased"):
-        self.tokenizer = DistilBertTokenizer.from_pretrained(model_path)
+    def __init__(self, model_path: str = "distilbert-base-uncased", quantize: bool = False,
+                 batch_size: int = 32, feature_store_path: Optional[str] = None):
+        self.model_path = model_path
+        self.batch_size = batch_size
+        # Stored token ids are only good for this preprocessing, tokenizer and truncation
+        self.feature_store = FeatureStore(
+            feature_store_path, version=f"{PREPROCESS_VERSION}:{model_path}:{MAX_LENGTH}"
+        ) if feature_store_path else None
+        self.tokenizer = DistilBertTokenizerFast.from_pretrained(model_path)
         self.model = DistilBertForSequenceClassification.from_pretrained(
             model_path,
             num_labels=3  # inbox, fyi, junk
         )
+        self.model.eval()
+        if quantize:
+            # int8 weights for the Linear layers: faster and smaller on CPU, but inference only
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
         self.label_map = {'inbox': 0, 'fyi': 1, 'junk': 2}
         self.reverse_label_map = {v: k for k, v in self.label_map.items()}
 
@@ -38,46 +112,93 @@ class DistilBertProvider:
         text = text.lower()
         return text
 
-    def get_completion(self, content: str, prompt: str) -> str:
-        content = self.preprocess_text(content)
-        inputs = self.tokenizer(content, return_tensors="pt", truncation=True, max_length=512)
-        outputs = self.model(**inputs)
-        predicted_label_id = torch.argmax(outputs.logits, dim=1).item()
-        return self.reverse_label_map[predicted_label_id]
-    
-    def fine_tune(self, db_path: str = "datasets/for-finetuning.sqlite", 
-                  epochs: int = 3, batch_size: int = 16, learning_rate: float = 2e-5):
-        conn = sqlite3.connect(db_path)
-        df = pd.read_sql_query("SELECT sender_name, sender_email, subject, body, label FROM labeled_emails", conn)
-        conn.close()
-        
-        # Combine subject and body for training
-        texts = [f"From: {row['sender_name']} <{row['sender_email']}>\nSubject: {row['subject']}\n\n{row['body']}" for _, row in df.iterrows()]
-        # Strip out HTML etc
+    def _build_features(self, texts: List[str]) -> Tuple[List[str], List[List[int]]]:
         texts = [self.preprocess_text(text) for text in texts]
-        
-        labels = [self.label_map[label.lower()] for label in df['label']]
-        
-        dataset = EmailDataset(texts, labels, self.tokenizer)
-        dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=True)
-        
+        return texts, self.tokenizer(texts, truncation=True, max_length=MAX_LENGTH)["input_ids"]
+
+    def token_ids(self, items: List[Tuple[str, str]]) -> List[List[int]]:
+        """Token ids for (key, text) pairs, from the feature store when there is one."""
+        if self.feature_store is None:
+            return self._build_features([text for _, text in items])[1]
+        return [ids for _, ids in self.feature_store.features(items, self._build_features)]
+
+    def get_completion(self, content: str, prompt: str) -> str:
+        return self.classify_batch([content])[0]
+
+    def classify_batch(self, contents: List[str]) -> List[str]:
+        return [label for label, _ in self.classify_batch_with_confidence(contents)]
+
+    def classify_batch_with_confidence(self, contents: List[str]) -> List[Tuple[str, float]]:
+        """
+        Label many emails at once, each with the softmax probability of its
+        label. Emails are sorted by token length and each batch is only padded
+        to its own longest email, so short emails don't pay for long ones.
+        """
+        # Keyed by content, since that's all a provider sees of an email
+        input_ids = self.token_ids([(source_hash(content), content) for content in contents])
+        order = sorted(range(len(contents)), key=lambda i: len(input_ids[i]))
+
+        results = [None] * len(contents)
+        self.model.eval()
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch_indexes = order[start:start + self.batch_size]
+                inputs = self.tokenizer.pad(
+                    {"input_ids": [input_ids[i] for i in batch_indexes]},
+                    return_tensors="pt"
+                )
+                confidences, predicted_label_ids = torch.softmax(self.model(**inputs).logits, dim=1).max(dim=1)
+                for i, label_id, confidence in zip(batch_indexes, predicted_label_ids.tolist(), confidences.tolist()):
+                    results[i] = (self.reverse_label_map[label_id], confidence)
+
+        return results
+
+    def fine_tune(self, db_path: str = "datasets/for-finetuning.sqlite",
+                  epochs: int = 3, batch_size: int = 16, learning_rate: float = 2e-5,
+                  gradient_accumulation_steps: int = 1, chunk_size: int = 2048,
+                  num_threads: Optional[int] = None):
+        """
+        Train on the labeled_emails table, streamed a chunk at a time (see
+        EmailStreamDataset) so memory doesn't grow with the table. Each
+        optimizer step covers batch_size * gradient_accumulation_steps emails.
+        With a feature store, token ids are only computed on the first run.
+        """
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        dataset = EmailStreamDataset(db_path, self.token_ids, self.label_map,
+                                     batch_size=batch_size, chunk_size=chunk_size)
+        # The dataset already yields whole batches, the collator just pads them
+        dataloader = DataLoader(dataset, batch_size=None, collate_fn=DynamicPaddingCollator(self.tokenizer))
+
         # Setup training
         optimizer = torch.optim.AdamW(self.model.parameters(), lr=learning_rate)
         self.model.train()
-        
+
         # Training loop
         for epoch in range(epochs):
             total_loss = 0
+            batches = 0
+            optimizer.zero_grad()
             for batch in dataloader:
-                optimizer.zero_grad()
                 outputs = self.model(**batch)
                 loss = outputs.loss
-                loss.backward()
-                optimizer.step()
+                (loss / gradient_accumulation_steps).backward()
                 total_loss += loss.item()
-            
-            print(f"Epoch {epoch + 1}/{epochs}, Loss: {total_loss / len(dataloader):.4f}")
-        
+                batches += 1
+                if batches % gradient_accumulation_steps == 0:
+                    optimizer.step()
+                    optimizer.zero_grad()
+            # Don't drop the gradients of a last, partial accumulation
+            if batches % gradient_accumulation_steps:
+                optimizer.step()
+                optimizer.zero_grad()
+
+            print(f"Epoch {epoch + 1}/{epochs}, Loss: {total_loss / max(batches, 1):.4f}")
+
+        # Back to inference mode so dropout is off for any classification that follows
+        self.model.eval()
+
         # Add these lines to save the model and tokenizer
         output_dir = "fine_tuned_model"
         self.model.save_pretrained(output_dir)
@@ -85,10 +206,12 @@ class DistilBertProvider:
         print(f"Model and tokenizer saved to {output_dir}/")
 
 if __name__ == "__main__":
-    provider = DistilBertProvider()
+    provider = DistilBertProvider(feature_store_path=os.getenv("FEATURE_STORE_PATH"))
     provider.fine_tune(
         db_path="datasets/for-finetuning.sqlite",
         epochs=3,
         batch_size=16,
-        learning_rate=2e-5
-    )
\ No newline at end of file
+        learning_rate=2e-5,
+        gradient_accumulation_steps=int(os.getenv("GRADIENT_ACCUMULATION_STEPS", "1")),
+        num_threads=int(os.getenv("TORCH_NUM_THREADS", "0")) or None
+    )
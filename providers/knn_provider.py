@@ -0,0 +1,261 @@
+"""
+Label an email like the labeled emails most similar to it. Every labeled
+email is embedded once (by a local sentence-embedding model or Ollama) into
+an on-disk vector index; a new email is embedded and compared with all of
+them in one matrix-vector product, and its k nearest neighbours vote.
+There's no training: labels added to the index count from the next email on.
+
+    python -m providers.knn_provider   # embeds datasets/for-finetuning.sqlite into knn_index.*
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import requests
+
+from email_content import format_email_content
+from feature_store import SQLITE_MAX_VARIABLES
+from .labels import LABELS
+
+class OllamaEmbedder:
+    def __init__(self, model: str = "nomic-embed-text", batch_size: int = 64, keep_alive: str = "30m",
+                 timeout: float = 300):
+        self.name = f"ollama:{model}"
+        self.model = model
+        self.url = "http://localhost:11434/api/embed"
+        self.batch_size = batch_size
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """One row per text, batch_size texts per request."""
+        rows = []
+        for start in range(0, len(texts), self.batch_size):
+            response = requests.post(self.url, timeout=self.timeout, json={
+                "model": self.model, "input": texts[start:start + self.batch_size], "keep_alive": self.keep_alive
+            })
+            response.raise_for_status()
+            rows += response.json()["embeddings"]
+        return np.array(rows, dtype=np.float32)
+
+class TransformersEmbedder:
+    """Mean-pooled embeddings from a local Hugging Face sentence-embedding model."""
+    def __init__(self, model: str = "sentence-transformers/all-MiniLM-L6-v2", batch_size: int = 32,
+                 max_length: int = 256):
+        # Only loaded when a local model is asked for
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.name = f"transformers:{model}"
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model)
+        self.model = AutoModel.from_pretrained(model).eval()
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        rows = []
+        with self.torch.inference_mode():
+            for start in range(0, len(texts), self.batch_size):
+                inputs = self.tokenizer(texts[start:start + self.batch_size], padding=True, truncation=True,
+                                        max_length=self.max_length, return_tensors='pt')
+                hidden = self.model(**inputs).last_hidden_state
+                mask = inputs['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+                rows.append(((hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)).numpy())
+        return np.concatenate(rows).astype(np.float32) if rows else np.zeros((0, 0), dtype=np.float32)
+
+EMBEDDERS = {'ollama': OllamaEmbedder, 'transformers': TransformersEmbedder}
+
+def make_embedder(spec: str):
+    """An embedder from a spec like "ollama:nomic-embed-text", the form the index records."""
+    kind, _, model = spec.partition(':')
+    if kind not in EMBEDDERS or not model:
+        raise ValueError(f"Embedders look like {' or '.join(f'{kind}:model' for kind in EMBEDDERS)}, got {spec!r}")
+    return EMBEDDERS[kind](model)
+
+class VectorIndex:
+    """
+    Unit-length embeddings in a float32 file (path + '.f32') that's read
+    through a memory map, one row per labeled email, with each row's email id
+    and label in a SQLite sidecar (path + '.sqlite'). New rows are appended
+    to the end of the file, so adding labels never rewrites the index.
+    """
+    def __init__(self, path: str = "knn_index", embedder: Optional[str] = None):
+        self.vectors_path = path + '.f32'
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path + '.sqlite', check_same_thread=False)
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS vectors (
+            row INTEGER PRIMARY KEY,
+            email_id TEXT UNIQUE,
+            label TEXT
+        )
+        ''')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS index_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        ''')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS indexed_datasets (
+            path TEXT PRIMARY KEY,
+            last_rowid INTEGER
+        )
+        ''')
+        self.conn.commit()
+
+        meta = dict(self.conn.execute('SELECT key, value FROM index_meta'))
+        if embedder and meta.get('embedder', embedder) != embedder:
+            raise ValueError(f"{path} was built with {meta['embedder']}, not {embedder}")
+        self.embedder = meta.get('embedder') or embedder
+        self.dim = int(meta['dim']) if 'dim' in meta else None
+        self.label_ids = np.array([LABELS.index(label) for (label,) in
+                                   self.conn.execute('SELECT label FROM vectors ORDER BY row')], dtype=np.int64)
+        self._matrix = None
+
+    def __len__(self) -> int:
+        return len(self.label_ids)
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self.conn.execute('INSERT OR REPLACE INTO index_meta (key, value) VALUES (?, ?)', (key, value))
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        """The embeddings and label ids as of now; rows added later don't change them."""
+        with self.lock:
+            if self._matrix is None or len(self._matrix) != len(self):
+                self._matrix = (np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(len(self), self.dim))
+                                if len(self) else np.zeros((0, self.dim or 0), dtype=np.float32))
+            return self._matrix, self.label_ids
+
+    def contains(self, email_ids: Sequence[str]) -> set:
+        """The ones of email_ids already in the index."""
+        found = set()
+        for start in range(0, len(email_ids), SQLITE_MAX_VARIABLES):
+            chunk = list(email_ids[start:start + SQLITE_MAX_VARIABLES])
+            found.update(email_id for (email_id,) in self.conn.execute(
+                f'SELECT email_id FROM vectors WHERE email_id IN ({",".join("?" * len(chunk))})', chunk
+            ))
+        return found
+
+    def add(self, email_ids: Sequence[str], vectors: np.ndarray, labels: Sequence[str]) -> int:
+        """Append embeddings for emails not in the index yet. Returns how many were added."""
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        with self.lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._set_meta('dim', str(self.dim))
+                self._set_meta('embedder', self.embedder or '')
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {vectors.shape[1]}")
+
+            existing = self.contains(email_ids)
+            keep, rows = [], []
+            for i, (email_id, label) in enumerate(zip(email_ids, labels)):
+                if email_id not in existing and label.lower() in LABELS:
+                    existing.add(email_id)
+                    keep.append(i)
+                    rows.append((len(self) + len(rows), email_id, label.lower()))
+            if not keep:
+                return 0
+
+            with open(self.vectors_path, 'ab') as f:
+                # Drop rows a crash left behind without their SQLite entries
+                f.truncate(len(self) * self.dim * 4)
+                f.write(np.ascontiguousarray(vectors[keep], dtype=np.float32).tobytes())
+            self.conn.executemany('INSERT INTO vectors (row, email_id, label) VALUES (?, ?, ?)', rows)
+            self.conn.commit()
+            self.label_ids = np.concatenate([self.label_ids, [LABELS.index(label) for _, _, label in rows]])
+            return len(rows)
+
+class KnnProvider:
+    """
+    Votes among the k labeled emails whose embeddings are closest (by cosine
+    similarity) to the email's, each weighted by its similarity. The share of
+    the vote the winning label got is its confidence, so it can be a cascade
+    tier. The index remembers which embedder built it; a new index uses
+    `embedder`, e.g. "transformers:sentence-transformers/all-MiniLM-L6-v2".
+    """
+    def __init__(self, index_path: str = "knn_index", embedder: Optional[str] = None, k: int = 10):
+        self.index_path = os.path.abspath(index_path)
+        self.index = VectorIndex(index_path, embedder)
+        self.embedder = make_embedder(self.index.embedder or "ollama:nomic-embed-text")
+        self.index.embedder = self.embedder.name
+        self.k = k
+
+    def cache_identity(self) -> str:
+        return f"{self.index_path}:{self.embedder.name}:k={self.k}"
+
+    def update_from_dataset(self, dataset_path: str, batch_size: int = 256) -> int:
+        """Embed labeled_emails rows added since the last update. Returns how many were new."""
+        path = os.path.abspath(dataset_path)
+        with self.index.lock:
+            row = self.index.conn.execute('SELECT last_rowid FROM indexed_datasets WHERE path = ?', (path,)).fetchone()
+        last_rowid = row[0] if row else 0
+
+        dataset = sqlite3.connect(dataset_path)
+        rows = dataset.execute('''
+        SELECT rowid, email_id, sender_name, sender_email, subject, body, label FROM labeled_emails
+        WHERE rowid > ? ORDER BY rowid
+        ''', (last_rowid,)).fetchall()
+        dataset.close()
+
+        added = 0
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            # The same text the watcher and evals classify
+            contents = [format_email_content(sender_name, sender_email, subject, body)
+                        for _, _, sender_name, sender_email, subject, body, _ in batch]
+            added += self.index.add([email_id for _, email_id, *_ in batch], self.embedder.embed(contents),
+                                    [label or '' for *_, label in batch])
+            with self.index.lock:
+                self.index.conn.execute('INSERT OR REPLACE INTO indexed_datasets (path, last_rowid) VALUES (?, ?)',
+                                        (path, batch[-1][0]))
+                self.index.conn.commit()
+        return added
+
+    def record(self, email_id: str, content: str, label: str) -> None:
+        """Add one confirmed label, e.g. from dataset_builder.py; the next email already sees it."""
+        self.index.add([email_id], self.embedder.embed([content]), [label])
+
+    def vote(self, embeddings: np.ndarray) -> List[Tuple[str, float]]:
+        """The winning label and its share of the vote, for each row of embeddings."""
+        matrix, label_ids = self.index.snapshot()
+        if not len(matrix):
+            raise ValueError("The kNN index is empty; build it with update_from_dataset first")
+        queries = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        # Cosine similarity with every labeled email: a matrix-vector product per email
+        scores = (matrix @ queries.T).T
+        k = min(self.k, len(matrix))
+        nearest = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        weights = np.maximum(np.take_along_axis(scores, nearest, axis=1), 0)
+        neighbour_labels = label_ids[nearest]
+        votes = np.stack([(weights * (neighbour_labels == i)).sum(axis=1) for i in range(len(LABELS))], axis=1)
+        best = votes.argmax(axis=1)
+        totals = votes.sum(axis=1)
+        return [(LABELS[i], float(votes[row, i] / totals[row]) if totals[row] else 0.0)
+                for row, i in enumerate(best)]
+
+    def get_completion(self, content: str, prompt: str) -> str:
+        return self.classify_batch([content])[0]
+
+    def classify_batch(self, contents: List[str]) -> List[str]:
+        return [label for label, _ in self.classify_batch_with_confidence(contents)]
+
+    def classify_batch_with_confidence(self, contents: List[str]) -> List[Tuple[str, float]]:
+        if not contents:
+            return []
+        return self.vote(self.embedder.embed(contents))
+
+if __name__ == "__main__":
+    db_path = os.getenv("FINETUNING_DB_PATH", "datasets/for-finetuning.sqlite")
+    index_path = os.getenv("KNN_INDEX_PATH", "knn_index")
+
+    provider = KnnProvider(index_path, embedder=os.getenv("KNN_EMBEDDER"))
+    start = time.perf_counter()
+    added = provider.update_from_dataset(db_path)
+    print(f"Embedded {added} new emails with {provider.embedder.name} in {time.perf_counter() - start:.2f}s, "
+          f"{len(provider.index)} in {index_path}.f32")
@@ -0,0 +1,71 @@
+import json
+import re
+import threading
+from typing import Any, Dict, Optional
+
+# The labels every provider answers with
+LABELS = ['inbox', 'fyi', 'junk']
+
+# Structured output for a single email's label, for constrained decoding
+LABEL_SCHEMA = {
+    "type": "object",
+    "properties": {"label": {"type": "string", "enum": LABELS}},
+    "required": ["label"],
+    "additionalProperties": False
+}
+
+LABEL_WORD = re.compile(r'\b(' + '|'.join(LABELS) + r')\b')
+
+def _answer(text: str, aliases: Optional[Dict[str, str]] = None) -> str:
+    # The answer itself: what an alias stands for, or the label field of a JSON answer
+    text = text.strip()
+    if aliases and text in aliases:
+        return aliases[text]
+    if text.startswith('{'):
+        try:
+            return str(json.loads(text).get('label', '')).strip()
+        except (ValueError, AttributeError):
+            pass
+    return text
+
+def normalize_label(text: str, aliases: Optional[Dict[str, str]] = None) -> Optional[str]:
+    """
+    The label a model's answer means, or None if it doesn't name exactly one.
+    Handles answers like "Inbox.", "label: fyi" and {"label": "junk"};
+    aliases maps raw answers (like a label's first token) to labels.
+    """
+    found = set(LABEL_WORD.findall(_answer(text, aliases).lower()))
+    return found.pop() if len(found) == 1 else None
+
+class LabelStats:
+    """How often a provider's raw answers were a label, needed normalizing, or were neither."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.exact = 0
+            self.normalized = 0
+            self.invalid = 0
+
+    def record(self, text: str, label: Optional[str], aliases: Optional[Dict[str, str]] = None) -> None:
+        """Count one answer and the label normalize_label made of it."""
+        with self.lock:
+            if label is None:
+                self.invalid += 1
+            elif _answer(text, aliases).lower() == label:
+                self.exact += 1
+            else:
+                self.normalized += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            answers = self.exact + self.normalized + self.invalid
+            return {
+                'answers': answers,
+                'exact': self.exact,
+                'normalized': self.normalized,
+                'invalid': self.invalid,
+                'invalid_rate': self.invalid / answers if answers else None
+            }
@@ -0,0 +1,198 @@
+"""
+A small CPU classifier: hashed word, word-pair and character n-gram features
+fed to a multinomial logistic regression, trained with SGD on the
+labeled_emails table. It needs only NumPy, loads in milliseconds from a
+compact .npz file, and labels thousands of emails per second, so it's a
+cheap baseline (or first stage) next to the LLMs.
+
+    python -m providers.linear_provider   # trains linear_model.npz from datasets/for-finetuning.sqlite
+"""
+import os
+import re
+import sqlite3
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from email_content import format_email_content
+from .labels import LABELS
+
+URL = re.compile(r'https?://\S+')
+WORD = re.compile(r"[a-z0-9][a-z0-9'_-]*")
+CHAR_NGRAMS = (3, 4, 5)
+# Polynomial hashing mod 2**64 (uint64 arithmetic wraps); PRIME is odd, so it has an inverse
+PRIME = 0x100000001B3
+PRIME_INVERSE = pow(PRIME, -1, 2 ** 64)
+MIX = np.uint64(0x9E3779B97F4A7C15)
+
+def _bucket(hashes: np.ndarray, salt: int, hash_bits: int) -> np.ndarray:
+    # Fibonacci hashing: the top hash_bits bits of the mixed hash
+    return (((hashes ^ np.uint64(salt)) * MIX) >> np.uint64(64 - hash_bits)).astype(np.int64)
+
+def _powers(base: int, count: int) -> np.ndarray:
+    powers = np.full(count, base, dtype=np.uint64)
+    powers[:1] = 1
+    return np.cumprod(powers, dtype=np.uint64)
+
+def featurize(texts: List[str], hash_bits: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sparse feature rows for many emails at once, as (indices, values, row of
+    each value) sorted by row. Values are log-scaled counts, L2-normalized
+    per email.
+
+    The emails are joined into one byte array (words split by spaces, emails
+    by NULs) and every word and character n-gram is hashed from its prefix
+    sums, so the whole batch takes a handful of array operations.
+    """
+    data = np.frombuffer('\0'.join(' '.join(WORD.findall(URL.sub(' url ', text.lower()))) for text in texts)
+                         .encode('utf-8'), dtype=np.uint8).astype(np.uint64)
+    # hash(data[start:end]) = PRIME ** (end - 1) * (sums[end] - sums[start])
+    powers = _powers(PRIME, len(data) + 1)
+    sums = np.concatenate([[np.uint64(0)], np.cumsum(data * _powers(PRIME_INVERSE, len(data)), dtype=np.uint64)])
+    emails = np.concatenate([[0], np.cumsum(data == 0)])
+
+    def substring_hashes(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        return powers[ends - 1] * (sums[ends] - sums[starts])
+
+    keys = []
+    # Words run between separators
+    separator = np.concatenate([[True], (data == 0) | (data == 32), [True]])
+    edges = np.flatnonzero(separator[1:] != separator[:-1])
+    starts, ends = edges[0::2], edges[1::2]
+    word_rows = emails[starts]
+    word_hashes = substring_hashes(starts, ends)
+    keys.append((word_rows, _bucket(word_hashes, 1, hash_bits)))
+
+    # Word pairs, except across the boundary between two emails
+    same_email = word_rows[1:] == word_rows[:-1]
+    keys.append((word_rows[1:][same_email],
+                 _bucket((word_hashes[:-1] * np.uint64(PRIME) + word_hashes[1:])[same_email], 2, hash_bits)))
+
+    # Character n-grams catch misspellings, word pieces and punctuation runs
+    for n in CHAR_NGRAMS:
+        starts = np.arange(max(len(data) - n + 1, 0))
+        inside = emails[starts + n] == emails[starts]
+        starts = starts[inside]
+        keys.append((emails[starts], _bucket(substring_hashes(starts, starts + n), 2 + n, hash_bits)))
+
+    rows = np.concatenate([rows for rows, _ in keys]).astype(np.int64)
+    buckets = np.concatenate([buckets for _, buckets in keys])
+    combined, counts = np.unique((rows << hash_bits) | buckets, return_counts=True)
+    rows = combined >> hash_bits
+    values = 1.0 + np.log(counts.astype(np.float32))
+    norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=len(texts)))
+    return combined & (2 ** hash_bits - 1), (values / norms[rows]).astype(np.float32), rows
+
+class LinearProvider:
+    def __init__(self, model_path: Optional[str] = "linear_model.npz", hash_bits: int = 18):
+        self.model_path = model_path
+        self.hash_bits = hash_bits
+        self.labels = list(LABELS)
+        self.weights = np.zeros((2 ** hash_bits, len(self.labels)), dtype=np.float32)
+        self.bias = np.zeros(len(self.labels), dtype=np.float32)
+        # Without a model path it starts untrained, for train()
+        if model_path:
+            self.load(model_path)
+
+    def load(self, path: str) -> None:
+        model = np.load(path)
+        self.hash_bits = int(model['hash_bits'])
+        self.labels = [str(label) for label in model['labels']]
+        self.weights = np.zeros((2 ** self.hash_bits, len(self.labels)), dtype=np.float32)
+        self.weights[model['rows']] = model['row_weights']
+        self.bias = model['bias']
+
+    def save(self, path: Optional[str] = None) -> None:
+        # Only rows some training email touched; the rest of the table is zeros
+        rows = np.flatnonzero(np.any(self.weights != 0, axis=1))
+        np.savez_compressed(path or self.model_path, hash_bits=self.hash_bits, labels=np.array(self.labels),
+                            rows=rows.astype(np.int32), row_weights=self.weights[rows], bias=self.bias)
+
+    def _scores(self, indices: np.ndarray, values: np.ndarray, rows: np.ndarray, count: int) -> np.ndarray:
+        contributions = self.weights[indices] * values[:, None]
+        scores = np.stack([np.bincount(rows, weights=contributions[:, i], minlength=count)
+                           for i in range(len(self.labels))], axis=1)
+        return scores + self.bias
+
+    def probabilities(self, contents: List[str]) -> np.ndarray:
+        """Label probabilities, one row per email and one column per label in self.labels."""
+        scores = self._scores(*featurize(contents, self.hash_bits), len(contents))
+        scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+        return scores / scores.sum(axis=1, keepdims=True)
+
+    def get_completion(self, content: str, prompt: str) -> str:
+        return self.classify_batch([content])[0]
+
+    def classify_batch(self, contents: List[str]) -> List[str]:
+        return [label for label, _ in self.classify_batch_with_confidence(contents)]
+
+    def classify_batch_with_confidence(self, contents: List[str]) -> List[Tuple[str, float]]:
+        """Each email's most likely label and its probability."""
+        if not contents:
+            return []
+        probabilities = self.probabilities(contents)
+        best = probabilities.argmax(axis=1)
+        return [(self.labels[i], float(probabilities[row, i])) for row, i in enumerate(best)]
+
+    def train(self, db_path: str = "datasets/for-finetuning.sqlite", epochs: int = 10, batch_size: int = 64,
+              learning_rate: float = 0.5, l2: float = 1e-5, seed: int = 0) -> None:
+        """
+        Fit on the labeled_emails table with mini-batch SGD on the softmax
+        loss. Features are computed once up front; weight decay is only
+        applied to the rows a batch touches.
+        """
+        conn = sqlite3.connect(db_path)
+        examples = conn.execute('SELECT sender_name, sender_email, subject, body, label FROM labeled_emails').fetchall()
+        conn.close()
+
+        label_ids = {label: i for i, label in enumerate(self.labels)}
+        targets = np.array([label_ids[label.lower()] for *_, label in examples])
+        # The same text the watcher and evals classify, featurized once and split per email
+        indices, values, rows = featurize([format_email_content(sender_name, sender_email, subject, body)
+                                           for sender_name, sender_email, subject, body, _ in examples], self.hash_bits)
+        bounds = np.searchsorted(rows, np.arange(len(examples) + 1))
+        features = [(indices[bounds[i]:bounds[i + 1]], values[bounds[i]:bounds[i + 1]]) for i in range(len(examples))]
+
+        rng = np.random.default_rng(seed)
+        self.weights[:] = 0
+        self.bias[:] = 0
+        for epoch in range(epochs):
+            rate = learning_rate / (1 + epoch)
+            order = rng.permutation(len(examples))
+            total_loss = 0.0
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                lengths = [len(features[i][0]) for i in batch]
+                indices = np.concatenate([features[i][0] for i in batch])
+                values = np.concatenate([features[i][1] for i in batch])
+                rows = np.repeat(np.arange(len(batch)), lengths)
+
+                scores = self._scores(indices, values, rows, len(batch))
+                probabilities = np.exp(scores - scores.max(axis=1, keepdims=True))
+                probabilities /= probabilities.sum(axis=1, keepdims=True)
+                total_loss -= np.log(probabilities[np.arange(len(batch)), targets[batch]] + 1e-12).sum()
+
+                gradient = probabilities
+                gradient[np.arange(len(batch)), targets[batch]] -= 1
+                gradient /= len(batch)
+                # Sum the gradient per touched row; much faster than np.add.at
+                touched, positions = np.unique(indices, return_inverse=True)
+                contributions = gradient[rows] * values[:, None]
+                row_gradient = np.stack([np.bincount(positions, weights=contributions[:, i], minlength=len(touched))
+                                         for i in range(len(self.labels))], axis=1)
+                self.weights[touched] = self.weights[touched] * (1 - rate * l2) - rate * row_gradient
+                self.bias -= rate * gradient.sum(axis=0)
+
+            print(f"Epoch {epoch + 1}/{epochs}, Loss: {total_loss / max(len(examples), 1):.4f}")
+
+if __name__ == "__main__":
+    db_path = os.getenv("FINETUNING_DB_PATH", "datasets/for-finetuning.sqlite")
+    model_path = os.getenv("LINEAR_MODEL_PATH", "linear_model.npz")
+
+    provider = LinearProvider(model_path=None)
+    start = time.perf_counter()
+    provider.train(db_path)
+    provider.save(model_path)
+    print(f"Trained in {time.perf_counter() - start:.2f}s, model saved to {model_path} "
+          f"({os.path.getsize(model_path) / 1024:.0f} KB)")
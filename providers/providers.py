@@ -1,34 +1,250 @@
-from typing import Protocol, Dict, Any
-from openai import OpenAI
+from typing import Dict, Any, Optional, Tuple
+import asyncio
+import math
+from openai import OpenAI, AsyncOpenAI
+import httpx
 import requests
 
-class LLMProvider(Protocol):
-    def get_completion(self, content: str, prompt: str) -> str:
-        pass
+from prompts import chat_messages
+from .base import LLMProvider, AsyncLLMProvider
+from .labels import LABELS, LABEL_SCHEMA, LabelStats, normalize_label
+
+# How answers are decoded: free text, JSON constrained to a label, or (OpenAI
+# only) a single token restricted to the labels' first tokens
+DECODING_MODES = ['free', 'schema', 'logit_bias']
+
+def label_tokens(model: str) -> Dict[int, Tuple[str, str]]:
+    """
+    The first token of each way of writing each label (inbox, Inbox, INBOX)
+    in the model's tokenizer, mapped to its text and its label. Tokens two
+    labels share are left out, so one token tells the labels apart.
+    """
+    # Only needed for logit_bias decoding
+    import tiktoken
+
+    # Fine-tuned models use their base model's tokenizer
+    base_model = model.split(':')[1] if model.startswith('ft:') else model
+    try:
+        encoding = tiktoken.encoding_for_model(base_model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("o200k_base")
+
+    tokens = {}
+    for label in LABELS:
+        for variant in (label, label.capitalize(), label.upper()):
+            tokens.setdefault(encoding.encode(variant)[0], set()).add(label)
+    aliases = {token: labels.pop() for token, labels in tokens.items() if len(labels) == 1}
+    missing = set(LABELS) - set(aliases.values())
+    if missing:
+        raise ValueError(f"{model}'s tokenizer can't tell {', '.join(sorted(missing))} apart by first token")
+    return {token: (encoding.decode([token]), label) for token, label in aliases.items()}
 
 class OpenAIProvider:
-    def __init__(self, api_key: str = None, model: str = "gpt-4o"):
+    """
+    decoding='schema' answers with JSON constrained to one of the labels (a
+    handful of tokens); 'logit_bias' restricts the answer to a single token
+    that starts one of the labels. 'free' takes the model's text as it comes.
+    Answers are normalized to a label either way, with counts in label_stats.
+    """
+    def __init__(self, api_key: str = None, model: str = "gpt-4o", decoding: str = "free"):
+        if decoding not in DECODING_MODES:
+            raise ValueError(f"Unknown decoding mode: {decoding}")
+        self.api_key = api_key
         self.client = OpenAI(api_key=api_key)
         self.model = model
-    
+        self.decoding = decoding
+        self._async_clients = {}
+        # Token counts from the most recent call, for benchmarking and cost
+        self.last_usage = None
+        self.label_stats = LabelStats()
+        self._aliases = None
+        self._logit_bias = None
+        if decoding == "logit_bias":
+            tokens = label_tokens(model)
+            self._aliases = {text: label for text, label in tokens.values()}
+            self._logit_bias = {str(token): 100 for token in tokens}
+
+    def request_args(self, content: str, prompt: str) -> Dict[str, Any]:
+        """The chat completion request for one email, sent live or as a line of a Batch API file."""
+        args = {
+            "model": self.model,
+            # The prompt is a static system message, so the provider can cache it across emails
+            "messages": chat_messages(prompt, content),
+            "temperature": 0,
+            "max_tokens": 10
+        }
+        if self.decoding == "schema":
+            args["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "label", "strict": True, "schema": LABEL_SCHEMA}
+            }
+        elif self.decoding == "logit_bias":
+            args["logit_bias"] = self._logit_bias
+            args["max_tokens"] = 1
+        return args
+
+    def _json_request_args(self, content: str, prompt: str, schema: Dict[str, Any], max_tokens: int) -> Dict[str, Any]:
+        args = {
+            **self.request_args(content, prompt),
+            "max_tokens": max_tokens,
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": "response", "strict": True, "schema": schema}
+            }
+        }
+        # The label-token bias would garble a JSON answer
+        args.pop("logit_bias", None)
+        return args
+
+    def _read_usage(self, response) -> Optional[Dict[str, int]]:
+        if not response.usage:
+            return None
+        details = getattr(response.usage, 'prompt_tokens_details', None)
+        return {
+            "prompt_tokens": response.usage.prompt_tokens,
+            # The part of the prompt answered from OpenAI's prompt cache, billed at a discount
+            "cached_tokens": getattr(details, 'cached_tokens', None) or 0,
+            "completion_tokens": response.usage.completion_tokens
+        }
+
+    def _read_response(self, response) -> str:
+        self.last_usage = self._read_usage(response) or self.last_usage
+        return response.choices[0].message.content.strip()
+
+    def label(self, text: str) -> str:
+        """The label an answer means; anything else comes back as is, for callers to reject."""
+        label = normalize_label(text, self._aliases)
+        self.label_stats.record(text, label, self._aliases)
+        return label or text.strip().lower()
+
+    def _async_client(self) -> AsyncOpenAI:
+        # Async clients hold connections bound to an event loop, so keep one per loop
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = AsyncOpenAI(api_key=self.api_key)
+            self._async_clients = {loop: client}
+        return client
+
     def get_completion(self, content:str, prompt: str) -> str:
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[{"role": "user", "content": prompt + "\n" + content}],
-            temperature=0,
-            max_tokens=10
+        return self.get_completion_with_usage(content, prompt)[0]
+
+    async def aget_completion(self, content: str, prompt: str) -> str:
+        return (await self.aget_completion_with_usage(content, prompt))[0]
+
+    def get_completion_with_usage(self, content: str, prompt: str) -> Tuple[str, Optional[Dict[str, int]]]:
+        """
+        The completion and this call's token usage. Unlike last_usage, which
+        concurrent calls overwrite, it's safe to read from many threads.
+        """
+        response = self.client.chat.completions.create(**self.request_args(content, prompt))
+        return self.label(self._read_response(response)), self._read_usage(response)
+
+    async def aget_completion_with_usage(self, content: str, prompt: str) -> Tuple[str, Optional[Dict[str, int]]]:
+        response = await self._async_client().chat.completions.create(**self.request_args(content, prompt))
+        return self.label(self._read_response(response)), self._read_usage(response)
+
+    def _read_confidence(self, response) -> float:
+        # The probability of the whole answer: the product of its tokens' probabilities
+        logprobs = response.choices[0].logprobs
+        if not logprobs or not logprobs.content:
+            return 0.0
+        return math.exp(sum(token.logprob for token in logprobs.content))
+
+    def get_completion_with_confidence(self, content: str, prompt: str) -> Tuple[str, float, Optional[Dict[str, int]]]:
+        """
+        The completion, the model's probability for it (from the answer's
+        token logprobs) and this call's token usage.
+        """
+        response = self.client.chat.completions.create(**self.request_args(content, prompt), logprobs=True)
+        return self.label(self._read_response(response)), self._read_confidence(response), self._read_usage(response)
+
+    async def aget_completion_with_confidence(self, content: str,
+                                              prompt: str) -> Tuple[str, float, Optional[Dict[str, int]]]:
+        response = await self._async_client().chat.completions.create(
+            **self.request_args(content, prompt), logprobs=True
+        )
+        return self.label(self._read_response(response)), self._read_confidence(response), self._read_usage(response)
+
+    def get_json_completion(self, content: str, prompt: str, schema: Dict[str, Any], max_tokens: int) -> str:
+        """A completion constrained to JSON matching `schema`, e.g. for several emails at once."""
+        response = self.client.chat.completions.create(**self._json_request_args(content, prompt, schema, max_tokens))
+        return self._read_response(response)
+
+    async def aget_json_completion(self, content: str, prompt: str, schema: Dict[str, Any], max_tokens: int) -> str:
+        response = await self._async_client().chat.completions.create(
+            **self._json_request_args(content, prompt, schema, max_tokens)
         )
-        return response.choices[0].message.content.strip().lower()
+        return self._read_response(response)
 
 class OllamaProvider:
-    def __init__(self, model: str = "llama3.1"):
+    """
+    Asks through Ollama's chat API with the prompt as a system message that's
+    the same for every email, so Ollama reuses its KV cache for it instead of
+    evaluating it again each call. keep_alive keeps the model loaded between
+    calls. decoding='schema' has Ollama answer with JSON constrained to one
+    of the labels.
+    """
+    def __init__(self, model: str = "llama3.1", max_connections: int = 16, decoding: str = "free",
+                 keep_alive: str = "30m"):
+        if decoding not in ('free', 'schema'):
+            raise ValueError(f"Unknown decoding mode for Ollama: {decoding}")
         self.model = model
-        self.base_url = "http://localhost:11434/api/generate"
-    
+        self.base_url = "http://localhost:11434/api/chat"
+        self.max_connections = max_connections
+        self.decoding = decoding
+        self.keep_alive = keep_alive
+        self._async_clients = {}
+        self.last_usage = None
+        self.label_stats = LabelStats()
+
+    def _request_json(self, content: str, prompt: str) -> Dict[str, Any]:
+        body = {"model": self.model, "messages": chat_messages(prompt, content), "stream": False,
+                "keep_alive": self.keep_alive}
+        if self.decoding == "schema":
+            body["format"] = LABEL_SCHEMA
+            body["options"] = {"temperature": 0, "num_predict": 20}
+        return body
+
+    def _read_usage(self, result: Dict[str, Any]) -> Dict[str, int]:
+        # prompt_eval_count leaves out the tokens Ollama had cached from the previous call
+        return {
+            "prompt_tokens": result.get("prompt_eval_count", 0),
+            "completion_tokens": result.get("eval_count", 0)
+        }
+
+    def _read_response(self, result: Dict[str, Any]) -> str:
+        self.last_usage = self._read_usage(result)
+        text = result["message"]["content"]
+        label = normalize_label(text)
+        self.label_stats.record(text, label)
+        return label or text.strip().lower()
+
     def get_completion(self, content: str, prompt: str) -> str:
-        response = requests.post(
-            self.base_url,
-            json={"model": self.model, "prompt": prompt + "\n" + content, "stream": False}
-        )
+        return self.get_completion_with_usage(content, prompt)[0]
+
+    async def aget_completion(self, content: str, prompt: str) -> str:
+        return (await self.aget_completion_with_usage(content, prompt))[0]
+
+    def get_completion_with_usage(self, content: str, prompt: str) -> Tuple[str, Dict[str, int]]:
+        """The completion and this call's token usage, safe to read from many threads."""
+        response = requests.post(self.base_url, json=self._request_json(content, prompt))
+        response.raise_for_status()
+        result = response.json()
+        return self._read_response(result), self._read_usage(result)
+
+    async def aget_completion_with_usage(self, content: str, prompt: str) -> Tuple[str, Dict[str, int]]:
+        # One pooled client per event loop, since its connections can't cross loops
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(120.0, connect=10.0),
+                limits=httpx.Limits(max_connections=self.max_connections)
+            )
+            self._async_clients = {loop: client}
+
+        response = await client.post(self.base_url, json=self._request_json(content, prompt))
         response.raise_for_status()
-        return response.json()["response"].strip().lower() 
\ No newline at end of file
+        result = response.json()
+        return self._read_response(result), self._read_usage(result)
@@ -0,0 +1,152 @@
+"""
+Record a provider's answers once and replay them later, so evals and
+benchmarks can run offline against the same responses. A fixture is a JSON
+file mapping a hash of prompt and content to the completion, its token usage
+and how long the call took.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+def fixture_key(content: str, prompt: str) -> str:
+    return hashlib.sha256(f"{prompt}\n{content}".encode('utf-8')).hexdigest()
+
+def load_fixture(path: str) -> Dict[str, Dict]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+class RecordingProvider:
+    """Passes calls through to the wrapped provider and keeps what it answered. Call save() when done."""
+    def __init__(self, provider, fixture_path: str):
+        self.provider = provider
+        self.fixture_path = fixture_path
+        self.responses = load_fixture(fixture_path)
+        self.lock = threading.Lock()
+        self.last_usage = None
+        if hasattr(provider, 'get_json_completion'):
+            self.get_json_completion = self._get_json_completion
+            self.aget_json_completion = self._aget_json_completion
+
+    def _record(self, content: str, prompt: str, completion: str, latency: float) -> str:
+        self.last_usage = getattr(self.provider, 'last_usage', None)
+        with self.lock:
+            self.responses[fixture_key(content, prompt)] = {
+                'completion': completion,
+                'usage': self.last_usage,
+                'latency': latency
+            }
+        return completion
+
+    def get_completion(self, content: str, prompt: str) -> str:
+        start = time.perf_counter()
+        completion = self.provider.get_completion(content, prompt)
+        return self._record(content, prompt, completion, time.perf_counter() - start)
+
+    async def aget_completion(self, content: str, prompt: str) -> str:
+        start = time.perf_counter()
+        if hasattr(self.provider, 'aget_completion'):
+            completion = await self.provider.aget_completion(content, prompt)
+        else:
+            completion = await asyncio.to_thread(self.provider.get_completion, content, prompt)
+        return self._record(content, prompt, completion, time.perf_counter() - start)
+
+    def _get_json_completion(self, content: str, prompt: str, schema: Dict, max_tokens: int) -> str:
+        start = time.perf_counter()
+        completion = self.provider.get_json_completion(content, prompt, schema, max_tokens)
+        return self._record(content, prompt, completion, time.perf_counter() - start)
+
+    async def _aget_json_completion(self, content: str, prompt: str, schema: Dict, max_tokens: int) -> str:
+        start = time.perf_counter()
+        if hasattr(self.provider, 'aget_json_completion'):
+            completion = await self.provider.aget_json_completion(content, prompt, schema, max_tokens)
+        else:
+            completion = await asyncio.to_thread(self.provider.get_json_completion, content, prompt, schema, max_tokens)
+        return self._record(content, prompt, completion, time.perf_counter() - start)
+
+    def save(self) -> None:
+        with self.lock:
+            with open(self.fixture_path, 'w', encoding='utf-8') as f:
+                json.dump(self.responses, f, indent=1)
+
+class InjectedError(Exception):
+    """A failure injected by ReplayProvider, carrying a status code like the real clients' errors."""
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        super().__init__(f"Injected error with status {status_code}")
+
+class ReplayProvider:
+    """
+    Answers from a fixture written by RecordingProvider. With
+    replay_latency=True each call waits as long as the recorded one took, so
+    latency and throughput under concurrency can be compared offline too.
+
+    For load testing, latency (seconds) overrides the recorded latency for
+    every call, error_rate is the share of calls that fail with error_status
+    (429 and 5xx are retried by pipeline.py), and default answers emails that
+    aren't in the fixture instead of raising KeyError.
+    """
+    def __init__(self, fixture_path: str, replay_latency: bool = False, latency: Optional[float] = None,
+                 error_rate: float = 0.0, error_status: int = 503, default: Optional[str] = None,
+                 seed: Optional[int] = None):
+        self.fixture_path = fixture_path
+        self.responses = load_fixture(fixture_path)
+        self.replay_latency = replay_latency
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.default = default
+        self.random = random.Random(seed)
+        self.errors_injected = 0
+        self.last_usage = None
+
+    def cache_identity(self) -> str:
+        return f"{os.path.abspath(self.fixture_path)}:{self.default}"
+
+    def _response(self, content: str, prompt: str) -> Dict:
+        response = self.responses.get(fixture_key(content, prompt))
+        if response is None:
+            if self.default is None:
+                raise KeyError(f"No recorded response in {self.fixture_path} for this email; record it first")
+            response = {'completion': self.default, 'usage': None, 'latency': 0.0}
+        return response
+
+    def _delay(self, response: Dict) -> float:
+        if self.latency is not None:
+            return self.latency
+        return response['latency'] if self.replay_latency else 0.0
+
+    def _answer(self, response: Dict) -> str:
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors_injected += 1
+            raise InjectedError(self.error_status)
+        self.last_usage = response['usage']
+        return response['completion']
+
+    def get_completion(self, content: str, prompt: str) -> str:
+        response = self._response(content, prompt)
+        delay = self._delay(response)
+        if delay:
+            time.sleep(delay)
+        return self._answer(response)
+
+    async def aget_completion(self, content: str, prompt: str) -> str:
+        response = self._response(content, prompt)
+        delay = self._delay(response)
+        if delay:
+            await asyncio.sleep(delay)
+        return self._answer(response)
+
+    # Batch answers are recorded like any other completion. The default label
+    # isn't valid JSON, so unrecorded batches fall back to single calls.
+    def get_json_completion(self, content: str, prompt: str, schema: Dict, max_tokens: int) -> str:
+        return self.get_completion(content, prompt)
+
+    async def aget_json_completion(self, content: str, prompt: str, schema: Dict, max_tokens: int) -> str:
+        return await self.aget_completion(content, prompt)
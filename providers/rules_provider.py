@@ -0,0 +1,128 @@
+"""
+Deterministic sender and subject rules checked before the model. The prompt
+in classify_email.py already states some of these outright ("All Substack
+newsletters go to junk"), so emails that match never need a provider call.
+"""
+import asyncio
+import re
+from typing import Dict, List, Optional
+
+from email_content import parse_email_content
+from .labels import LABELS
+
+class Rule:
+    def __init__(self, name: str, label: str, domains: List[str] = (), addresses: List[str] = (),
+                 subject: Optional[str] = None):
+        if label not in LABELS:
+            raise ValueError(f"Unknown label for rule {name}: {label}")
+        self.name = name
+        self.label = label
+        self.domains = [domain.lower() for domain in domains]
+        self.addresses = [address.lower() for address in addresses]
+        self.subject = subject
+
+# Taken from the rules spelled out in the classify_email prompt
+RULES = [
+    Rule('substack', 'junk', domains=['substack.com']),
+    Rule('buttondown', 'fyi', domains=['buttondown.email']),
+    Rule('money-stuff', 'fyi', subject=r'^Money Stuff\b'),
+    Rule('hacker-newsletter', 'fyi', domains=['hackernewsletter.com']),
+    Rule('readwise', 'fyi', domains=['readwise.io']),
+]
+
+class RulesEngine:
+    """
+    Rules are compiled into a dict of addresses, a dict of domains (looked up
+    for each suffix of the sender's domain, so mail.substack.com finds
+    substack.com) and one combined subject regex, so matching costs the same
+    however many rules there are.
+    """
+    def __init__(self, rules: List[Rule] = RULES):
+        self.rules = rules
+        self.addresses = {}
+        self.domains = {}
+        subject_patterns = []
+        for i, rule in enumerate(rules):
+            for address in rule.addresses:
+                self.addresses.setdefault(address, rule)
+            for domain in rule.domains:
+                self.domains.setdefault(domain, rule)
+            if rule.subject:
+                subject_patterns.append(f'(?P<rule{i}>{rule.subject})')
+        self.subject_regex = re.compile('|'.join(subject_patterns), re.IGNORECASE) if subject_patterns else None
+
+        self.hits = {rule.name: 0 for rule in rules}
+        self.misses = 0
+
+    def _match_domain(self, domain: str) -> Optional[Rule]:
+        labels = domain.lower().strip('.').split('.')
+        for i in range(len(labels) - 1):
+            rule = self.domains.get('.'.join(labels[i:]))
+            if rule:
+                return rule
+        return None
+
+    def _find_rule(self, sender_email: str, subject: str) -> Optional[Rule]:
+        sender_email = sender_email.lower()
+        rule = self.addresses.get(sender_email)
+        if rule:
+            return rule
+
+        if '@' in sender_email:
+            rule = self._match_domain(sender_email.rsplit('@', 1)[1])
+            if rule:
+                return rule
+
+        if subject and self.subject_regex:
+            match = self.subject_regex.search(subject)
+            if match:
+                return self.rules[int(match.lastgroup[len('rule'):])]
+        return None
+
+    def match(self, sender_email: str = '', subject: str = '') -> Optional[str]:
+        """Label from the first matching rule, or None if no rule applies."""
+        rule = self._find_rule(sender_email or '', subject or '')
+        if rule is None:
+            self.misses += 1
+            return None
+        self.hits[rule.name] += 1
+        return rule.label
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.hits, 'no_match': self.misses}
+
+class RulesProvider:
+    """
+    Answers from the rules when one matches the headers at the top of the
+    content (see email_content.py), otherwise asks the wrapped provider.
+    """
+    def __init__(self, provider, engine: Optional[RulesEngine] = None):
+        self.provider = provider
+        self.engine = engine or RulesEngine()
+        if hasattr(provider, 'classify_batch'):
+            self.classify_batch = self._classify_batch
+
+    def _match(self, content: str) -> Optional[str]:
+        return self.engine.match(**parse_email_content(content))
+
+    def get_completion(self, content: str, prompt: str) -> str:
+        return self._match(content) or self.provider.get_completion(content, prompt)
+
+    async def aget_completion(self, content: str, prompt: str) -> str:
+        label = self._match(content)
+        if label:
+            return label
+        if hasattr(self.provider, 'aget_completion'):
+            return await self.provider.aget_completion(content, prompt)
+        return await asyncio.to_thread(self.provider.get_completion, content, prompt)
+
+    def _classify_batch(self, contents: List[str]) -> List[str]:
+        labels = [self._match(content) for content in contents]
+        unmatched = [i for i, label in enumerate(labels) if label is None]
+        if unmatched:
+            for i, label in zip(unmatched, self.provider.classify_batch([contents[i] for i in unmatched])):
+                labels[i] = label
+        return labels
+
+    def stats(self) -> Dict[str, int]:
+        return self.engine.stats()
@@ -0,0 +1,176 @@
+"""
+Label repeat senders from how their earlier emails were labeled. Most mail
+comes from senders already in a labeled dataset, and they nearly always get
+the same label again, so a confident enough history can stand in for a
+provider call.
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import threading
+from typing import Dict, Optional, Tuple
+
+from email_content import parse_email_content
+
+# Mail providers whose addresses are shared by unrelated people, so a few
+# labeled friends at gmail.com say nothing about the next gmail.com sender
+SHARED_DOMAINS = frozenset({
+    'gmail.com', 'googlemail.com', 'outlook.com', 'hotmail.com', 'live.com', 'msn.com',
+    'yahoo.com', 'ymail.com', 'aol.com', 'icloud.com', 'me.com', 'mac.com',
+    'fastmail.com', 'fastmail.fm', 'proton.me', 'protonmail.com', 'gmx.com', 'zoho.com',
+})
+
+class SenderHistoryIndex:
+    """
+    Label counts per sender address and per sender domain (except shared
+    domains like gmail.com), kept in SQLite. It is built incrementally: each
+    labeled dataset remembers the last row it contributed, and labels the
+    watcher applies are recorded directly.
+    """
+    def __init__(self, db_path: str = "sender_history.sqlite"):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS sender_label_counts (
+            sender_key TEXT,
+            label TEXT,
+            count INTEGER,
+            PRIMARY KEY (sender_key, label)
+        )
+        ''')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS indexed_datasets (
+            path TEXT PRIMARY KEY,
+            last_rowid INTEGER
+        )
+        ''')
+        self.conn.commit()
+
+    @staticmethod
+    def _keys(sender_email: str):
+        sender_email = sender_email.strip().lower()
+        keys = [f"address:{sender_email}"]
+        domain = sender_email.rsplit('@', 1)[1] if '@' in sender_email else ''
+        if domain and domain not in SHARED_DOMAINS:
+            keys.append(f"domain:{domain}")
+        return keys
+
+    def _add(self, sender_email: str, label: str) -> None:
+        for key in self._keys(sender_email):
+            self.conn.execute('''
+            INSERT INTO sender_label_counts (sender_key, label, count) VALUES (?, ?, 1)
+            ON CONFLICT (sender_key, label) DO UPDATE SET count = count + 1
+            ''', (key, label.lower()))
+
+    def record(self, sender_email: str, label: str) -> None:
+        """Add one confirmed label, e.g. from dataset_builder.py or the watcher's LabelApplier."""
+        if not sender_email:
+            return
+        with self.lock:
+            self._add(sender_email, label)
+            self.conn.commit()
+
+    def update_from_dataset(self, dataset_path: str) -> int:
+        """Index labeled_emails rows added since the last update. Returns how many were new."""
+        path = os.path.abspath(dataset_path)
+        with self.lock:
+            row = self.conn.execute('SELECT last_rowid FROM indexed_datasets WHERE path = ?', (path,)).fetchone()
+            last_rowid = row[0] if row else 0
+
+            dataset = sqlite3.connect(dataset_path)
+            rows = dataset.execute(
+                'SELECT rowid, sender_email, label FROM labeled_emails WHERE rowid > ? ORDER BY rowid',
+                (last_rowid,)
+            ).fetchall()
+            dataset.close()
+
+            for rowid, sender_email, label in rows:
+                if sender_email and label:
+                    self._add(sender_email, label)
+                last_rowid = rowid
+            self.conn.execute('INSERT OR REPLACE INTO indexed_datasets (path, last_rowid) VALUES (?, ?)',
+                              (path, last_rowid))
+            self.conn.commit()
+        return len(rows)
+
+    def lookup(self, sender_email: str, min_count: int = 3) -> Optional[Tuple[str, float, int]]:
+        """
+        Most common label for the sender as (label, share of their emails, email
+        count), from the address if it has at least min_count labeled emails and
+        otherwise from the domain, unless it's a shared one. None when neither
+        has enough history.
+        """
+        if not sender_email:
+            return None
+        with self.lock:
+            for key in self._keys(sender_email):
+                counts = self.conn.execute(
+                    'SELECT label, count FROM sender_label_counts WHERE sender_key = ? ORDER BY count DESC',
+                    (key,)
+                ).fetchall()
+                total = sum(count for _, count in counts)
+                if total >= min_count:
+                    label, count = counts[0]
+                    return label, count / total, total
+        return None
+
+class SenderHistoryProvider:
+    """
+    Answers from the sender's history when its most common label covers at
+    least `threshold` of their labeled emails, otherwise asks the wrapped
+    provider. stats() reports how many provider calls were avoided.
+    """
+    def __init__(self, provider, index: SenderHistoryIndex, threshold: float = 0.9, min_count: int = 3):
+        self.provider = provider
+        self.index = index
+        self.threshold = threshold
+        self.min_count = min_count
+        self.answered = 0
+        self.passed_on = 0
+        if hasattr(provider, 'classify_batch'):
+            self.classify_batch = self._classify_batch
+
+    def _lookup(self, content: str) -> Optional[str]:
+        sender_email = parse_email_content(content)['sender_email']
+        found = self.index.lookup(sender_email, min_count=self.min_count)
+        if found and found[1] >= self.threshold:
+            self.answered += 1
+            return found[0]
+        self.passed_on += 1
+        return None
+
+    def get_completion(self, content: str, prompt: str) -> str:
+        return self._lookup(content) or self.provider.get_completion(content, prompt)
+
+    async def aget_completion(self, content: str, prompt: str) -> str:
+        label = self._lookup(content)
+        if label:
+            return label
+        if hasattr(self.provider, 'aget_completion'):
+            return await self.provider.aget_completion(content, prompt)
+        return await asyncio.to_thread(self.provider.get_completion, content, prompt)
+
+    def _classify_batch(self, contents):
+        labels = [self._lookup(content) for content in contents]
+        unknown = [i for i, label in enumerate(labels) if label is None]
+        if unknown:
+            for i, label in zip(unknown, self.provider.classify_batch([contents[i] for i in unknown])):
+                labels[i] = label
+        return labels
+
+    def stats(self) -> Dict[str, float]:
+        total = self.answered + self.passed_on
+        return {
+            'answered_from_history': self.answered,
+            'provider_calls': self.passed_on,
+            'calls_avoided': self.answered / total if total else 0
+        }
+
+if __name__ == "__main__":
+    index_path = os.getenv("SENDER_HISTORY_PATH", "sender_history.sqlite")
+    index = SenderHistoryIndex(index_path)
+    # Never the eval set: its labels would leak into the answers being graded
+    for dataset_path in sys.argv[1:] or ["datasets/for-finetuning.sqlite"]:
+        added = index.update_from_dataset(dataset_path)
+        print(f"Indexed {added} new labeled emails from {dataset_path} into {index_path}")
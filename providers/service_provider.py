@@ -0,0 +1,48 @@
+"""
+A client for classifier_service.py, which keeps a provider stack loaded in a
+long-running process. Only the standard library is imported here, so a CLI
+using it starts in milliseconds.
+"""
+import json
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+class ServiceError(Exception):
+    """The service failed a request, with the status code it (or its provider) answered."""
+    def __init__(self, status_code: int, message: str):
+        self.status_code = status_code
+        super().__init__(f"Classifier service error {status_code}: {message}")
+
+class ServiceProvider:
+    def __init__(self, url: str = "http://localhost:8767", timeout: float = 300):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def cache_identity(self) -> str:
+        return self.url
+
+    def _post(self, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        request = urllib.request.Request(self.url + path, data=json.dumps(body).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise ServiceError(e.code, e.read().decode('utf-8', 'replace')) from e
+        except urllib.error.URLError as e:
+            # Not running (yet); 503 so pipeline.py retries it like any other outage
+            raise ServiceError(503, f"can't reach {self.url} ({e.reason})") from e
+
+    def get_completion(self, content: str, prompt: str) -> str:
+        return self._post('/classify', {'contents': [content], 'prompt': prompt})['labels'][0]
+
+    def classify_batch(self, contents: List[str]) -> List[str]:
+        """Label many emails in one request; the service runs them through its own pipeline."""
+        if not contents:
+            return []
+        return self._post('/classify', {'contents': contents})['labels']
+
+    def health(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        with urllib.request.urlopen(self.url + '/health', timeout=timeout or self.timeout) as response:
+            return json.loads(response.read())
@@ -0,0 +1,42 @@
+"""
+Remember the JMAP state string for each account between runs, so the watcher
+can ask Fastmail for just the emails that changed since it last looked.
+"""
+import sqlite3
+import threading
+from typing import Optional
+
+class SyncStateStore:
+    def __init__(self, db_path: str = 'sync_state.sqlite'):
+        # Shared by the daemon's worker threads, one account per key
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            account_id TEXT,
+            data_type TEXT,
+            state TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (account_id, data_type)
+        )
+        ''')
+        self.conn.commit()
+
+    def get_state(self, account_id: str, data_type: str = 'Email') -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT state FROM sync_state WHERE account_id = ? AND data_type = ?',
+                (account_id, data_type)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, account_id: str, state: str, data_type: str = 'Email') -> None:
+        with self.lock:
+            self.conn.execute('''
+            INSERT OR REPLACE INTO sync_state (account_id, data_type, state, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (account_id, data_type, state))
+            self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,48 @@
+"""Fixtures running the stand-in servers on free ports."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jmap_standin import JMAPStandInServer, StandInMailbox
+from openai_standin import OpenAIStandInServer
+
+def make_emails(count: int):
+    """Plain-text emails for the JMAP stand-in, oldest first."""
+    return [{
+        'id': f'e{i}',
+        'subject': f'Subject {i}',
+        'from': [{'email': f'sender{i}@example.com', 'name': f'Sender {i}'}],
+        'receivedAt': f'2024-01-01T00:{i // 60:02d}:{i % 60:02d}Z',
+        'preview': 'hello',
+        'textBody': [{'partId': '1', 'type': 'text/plain'}],
+        'bodyValues': {'1': {'value': f'Hello from email {i}'}}
+    } for i in range(count)]
+
+@pytest.fixture
+def jmap_server():
+    """Starts a JMAP stand-in: jmap_server(emails, delivered=..., max_objects_in_get=...)."""
+    servers = []
+
+    def start(count: int, delivered=None, **kwargs):
+        server = JMAPStandInServer(StandInMailbox(make_emails(count), delivered), port=0, **kwargs)
+        server.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture
+def openai_server(monkeypatch):
+    """An OpenAI stand-in that OpenAIProvider talks to, answering default_label."""
+    server = OpenAIStandInServer(port=0, default_label='fyi')
+    monkeypatch.setenv('OPENAI_BASE_URL', server.start())
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from backfill_openai import Backfill
+from fastmail_watcher import FastmailWatcher
+from providers.providers import OpenAIProvider
+
+@pytest.fixture
+def make_backfill(jmap_server, openai_server, tmp_path):
+    """A backfill of a 10-email stand-in mailbox through the OpenAI stand-in, 4 emails per batch."""
+    openai_server.completion_delay = 0
+
+    def make(**kwargs):
+        watcher = FastmailWatcher('token', session_url=jmap_server(10).session_url)
+        return Backfill(watcher, OpenAIProvider(model='gpt-4o-mini'), db_path=str(tmp_path / 'backfill.sqlite'),
+                        batch_dir=str(tmp_path / 'batches'), max_requests=4, **kwargs)
+    return make
+
+def output_line(email_id, status_code=200, content=None, error=None):
+    body = ({'choices': [{'message': {'content': content}}], 'usage': {'prompt_tokens': 10, 'completion_tokens': 1}}
+            if content is not None else {'error': error})
+    return json.dumps({'custom_id': email_id, 'response': {'status_code': status_code, 'body': body}, 'error': None})
+
+def test_run_labels_every_email(make_backfill, openai_server):
+    backfill = make_backfill()
+    backfill.run(poll_interval=0)
+    stats = backfill.stats()
+    assert (stats['emails'], stats['labeled'], stats['errors']) == (10, 10, 0)
+    assert len(openai_server.batches) == 3
+
+def test_merge_keeps_errors_and_invalid_answers(make_backfill):
+    backfill = make_backfill()
+    backfill.fetch()
+    output = '\n'.join([output_line('e0', content='FYI'), output_line('e1', content='maybe?'),
+                        output_line('e2', status_code=500, error={'message': 'server error'})])
+    # Merging the same output twice changes nothing
+    backfill._merge(output)
+    backfill._merge(output)
+    results = {email_id: (label, error) for email_id, label, error in
+               backfill.conn.execute('SELECT email_id, label, error FROM backfill_results')}
+    assert results['e0'] == ('fyi', None)
+    assert results['e1'][0] is None and json.loads(results['e1'][1]) == {'invalid_label': 'maybe?'}
+    assert results['e2'][0] is None and 'server error' in results['e2'][1]
+
+    assert backfill.retry_errors() == 2
+    assert backfill.stats()['errors'] == 0
+    assert backfill.stats()['labeled'] == 1
+
+def test_submit_finds_a_job_created_before_a_crash(make_backfill, openai_server):
+    backfill = make_backfill()
+    backfill.fetch()
+    backfill.prepare()
+    # A run that crashed between creating the first job and saving its id
+    batch_id, file_path = backfill.conn.execute('SELECT batch_id, file_path FROM backfill_batches').fetchone()
+    with open(file_path, 'rb') as f:
+        file_id = backfill.client.files.create(file=f, purpose='batch').id
+    backfill.conn.execute('UPDATE backfill_batches SET openai_file_id = ? WHERE batch_id = ?', (file_id, batch_id))
+    job = backfill.client.batches.create(input_file_id=file_id, endpoint='/v1/chat/completions',
+                                         completion_window='24h', metadata={'backfill_batch': batch_id})
+
+    assert backfill.submit() == 3
+    assert len(openai_server.batches) == 3
+    assert backfill.conn.execute('SELECT openai_batch_id FROM backfill_batches WHERE batch_id = ?',
+                                 (batch_id,)).fetchone()[0] == job.id
+
+def test_failing_jobs_give_up_after_max_attempts(make_backfill, openai_server):
+    openai_server.batch_status = 'failed'
+    backfill = make_backfill(max_attempts=2)
+    backfill.run(poll_interval=0)
+    stats = backfill.stats()
+    assert (stats['labeled'], stats['errors'], stats['batches_running']) == (0, 10, 0)
+    # Each email was in two jobs
+    assert len(openai_server.batches) == 6
+
+    # Retrying gives them max_attempts more jobs
+    openai_server.batch_status = 'completed'
+    assert backfill.retry_errors() == 10
+    backfill.run(poll_interval=0)
+    assert backfill.stats()['labeled'] == 10
@@ -0,0 +1,57 @@
+from providers.cached_provider import CachedProvider, provider_identity
+from providers.cascade_provider import CascadeProvider
+from providers.knn_provider import KnnProvider
+from providers.replay_provider import ReplayProvider
+from providers.service_provider import ServiceProvider
+
+class FakeProvider:
+    def __init__(self, answers, model='fake', decoding='free'):
+        self.answers = list(answers)
+        self.model = model
+        self.decoding = decoding
+        self.calls = 0
+
+    def get_completion(self, content, prompt):
+        self.calls += 1
+        return self.answers.pop(0)
+
+class ConfidentProvider(FakeProvider):
+    def __init__(self):
+        super().__init__([], model='cheap')
+
+    def get_completion_with_confidence(self, content, prompt):
+        return 'inbox', 1.0, None
+
+def test_identity_includes_decoding():
+    assert provider_identity(FakeProvider([])) == 'FakeProvider:fake'
+    assert provider_identity(FakeProvider([], decoding='schema')) == 'FakeProvider:fake:schema'
+
+def test_identity_describes_providers_without_a_model():
+    assert provider_identity(ServiceProvider('http://a:1')) != provider_identity(ServiceProvider('http://b:1'))
+    assert provider_identity(ReplayProvider('a.json')) != provider_identity(ReplayProvider('b.json'))
+
+    def cascade(threshold, last='gpt-4o'):
+        return CascadeProvider([('cheap', ConfidentProvider(), threshold), (last, FakeProvider([], model=last))])
+    identities = {provider_identity(cascade(0.8)), provider_identity(cascade(0.9)),
+                  provider_identity(cascade(0.8, last='gpt-4.1'))}
+    assert len(identities) == 3
+
+def test_decoding_modes_dont_share_answers(tmp_path):
+    db_path = str(tmp_path / 'cache.sqlite')
+    assert CachedProvider(FakeProvider(['inbox']), db_path).get_completion('email', 'prompt') == 'inbox'
+    constrained = FakeProvider(['junk'], decoding='schema')
+    assert CachedProvider(constrained, db_path).get_completion('email', 'prompt') == 'junk'
+    assert constrained.calls == 1
+
+def test_non_label_answers_are_not_cached(tmp_path):
+    provider = FakeProvider(['maybe spam?', 'junk'])
+    cached = CachedProvider(provider, str(tmp_path / 'cache.sqlite'))
+    assert cached.get_completion('email', 'prompt') == 'maybe spam?'
+    assert cached.get_completion('email', 'prompt') == 'junk'
+    assert cached.get_completion('email', 'prompt') == 'junk'
+    assert provider.calls == 2
+
+def test_knn_identity_names_its_index(tmp_path):
+    def knn(name, k=10):
+        return KnnProvider(str(tmp_path / name), embedder='ollama:nomic-embed-text', k=k)
+    assert len({provider_identity(knn('a')), provider_identity(knn('b')), provider_identity(knn('a', k=5))}) == 3
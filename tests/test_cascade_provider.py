@@ -0,0 +1,52 @@
+import threading
+import time
+
+from providers.cascade_provider import CascadeProvider
+
+class BatchTier:
+    """A local model: labels batches, unsure about everything."""
+    def classify_batch_with_confidence(self, contents):
+        return [('inbox', 0.1) for _ in contents]
+
+class ApiTier:
+    """Answers one email per call; each call's usage is its email's length, and last_usage races."""
+    def __init__(self, label='fyi', confidence=0.1):
+        self.label = label
+        self.confidence = confidence
+        self.lock = threading.Lock()
+        self.last_usage = None
+
+    def _usage(self, content):
+        usage = {'prompt_tokens': len(content), 'cached_tokens': 0, 'completion_tokens': 1}
+        self.last_usage = usage
+        # Let the other threads overwrite last_usage before the caller could read it
+        time.sleep(0.01)
+        return usage
+
+    def get_completion_with_confidence(self, content, prompt):
+        return self.label, self.confidence, self._usage(content)
+
+    def get_completion_with_usage(self, content, prompt):
+        return self.label, self._usage(content)
+
+    def get_completion(self, content, prompt):
+        return self.get_completion_with_usage(content, prompt)[0]
+
+def test_concurrent_tiers_count_each_calls_usage():
+    contents = ['x' * n for n in range(1, 21)]
+    cascade = CascadeProvider([('local', BatchTier(), 0.9), ('gpt-4o-mini', ApiTier(), 0.9),
+                               ('gpt-4o', ApiTier(label='junk'))], concurrency=8)
+    assert cascade.classify_batch(contents) == ['junk'] * len(contents)
+    for tier in cascade.tier_stats()[1:]:
+        assert tier['calls'] == len(contents)
+        assert tier['prompt_tokens'] == sum(len(content) for content in contents)
+        assert tier['completion_tokens'] == len(contents)
+
+def test_tiers_with_the_same_name_keep_their_own_stats():
+    cascade = CascadeProvider([('gpt-4o-mini', ApiTier(confidence=0.5), 0.9),
+                               ('gpt-4o-mini', ApiTier(label='junk'))])
+    assert cascade.get_completion('email', 'prompt') == 'junk'
+    first, last = cascade.tier_stats()
+    assert first['name'] == last['name'] == 'gpt-4o-mini'
+    assert (first['emails'], first['kept'], first['escalated']) == (1, 0, 1)
+    assert (last['emails'], last['kept']) == (1, 1)
@@ -0,0 +1,61 @@
+import pytest
+
+from fastmail_watcher import FastmailWatcher
+
+def test_get_new_emails_respects_max_emails(jmap_server, tmp_path):
+    server = jmap_server(20, delivered=2, max_objects_in_get=4)
+    watcher = FastmailWatcher('token', session_url=server.session_url, state_path=str(tmp_path / 'state.sqlite'))
+    watcher.state_store.set_state(watcher.account_id, server.mailbox.state)
+    server.mailbox.deliver(18)
+
+    emails, state = watcher.get_new_emails(max_emails=5)
+    assert [email['id'] for email in emails] == ['e2', 'e3', 'e4', 'e5', 'e6']
+    # The saved state covers exactly the emails returned
+    assert state == '7'
+
+    watcher.state_store.set_state(watcher.account_id, state)
+    emails, state = watcher.get_new_emails(max_emails=100)
+    assert [email['id'] for email in emails] == [f'e{i}' for i in range(7, 20)]
+    assert state == '20'
+
+def test_first_sync_respects_max_emails(jmap_server, tmp_path):
+    server = jmap_server(20, max_objects_in_get=4)
+    watcher = FastmailWatcher('token', session_url=server.session_url, state_path=str(tmp_path / 'state.sqlite'))
+
+    emails, state = watcher.get_new_emails(initial_limit=10, max_emails=3)
+    assert len(emails) == 3
+    assert state == '20'
+
+class Unavailable(Exception):
+    status_code = 400
+
+class FailingProvider:
+    def __init__(self):
+        self.calls = 0
+
+    def get_completion(self, content, prompt):
+        self.calls += 1
+        raise Unavailable("model is down")
+
+class StopWatching(Exception):
+    pass
+
+def test_watch_push_backs_off_on_provider_errors(jmap_server, tmp_path, monkeypatch):
+    server = jmap_server(3)
+    provider = FailingProvider()
+    watcher = FastmailWatcher('token', session_url=server.session_url, state_path=str(tmp_path / 'state.sqlite'),
+                              provider=provider)
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 3:
+            raise StopWatching()
+    monkeypatch.setattr('fastmail_watcher.time.sleep', sleep)
+
+    with pytest.raises(StopWatching):
+        watcher.watch_push()
+    assert sleeps == [1, 2, 4]
+    assert provider.calls >= 3
+    # Nothing was labeled, so nothing was marked as synced
+    assert watcher.state_store.get_state(watcher.account_id) is None
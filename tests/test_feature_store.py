@@ -0,0 +1,15 @@
+from feature_store import FeatureStore
+
+def build(tag):
+    def build(sources):
+        return [f'{tag}:{source}' for source in sources], [[len(source)] for source in sources]
+    return build
+
+def test_versions_keep_their_own_entries(tmp_path):
+    db_path = str(tmp_path / 'features.sqlite')
+    v1, v2 = FeatureStore(db_path, version='1'), FeatureStore(db_path, version='2')
+    assert v1.features([('e1', 'hello')], build('v1')) == [('v1:hello', [5])]
+    assert v2.features([('e1', 'hello')], build('v2')) == [('v2:hello', [5])]
+    # Neither version's entry replaced the other's
+    assert v1.features([('e1', 'hello')], build('v1 again')) == [('v1:hello', [5])]
+    assert (v1.hits, v1.misses) == (1, 1)
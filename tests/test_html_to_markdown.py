@@ -0,0 +1,15 @@
+from pathlib import Path
+
+import pytest
+
+from html_to_markdown import html_to_markdown
+
+SAMPLES = sorted((Path(__file__).parent.parent / 'html_corpus').glob('*.html'))
+
+@pytest.mark.parametrize('sample', SAMPLES, ids=lambda sample: sample.stem)
+def test_matches_golden_output(sample):
+    html = sample.read_text(encoding='utf-8')
+    output = html_to_markdown(html)
+    assert output == sample.with_suffix('.md').read_text(encoding='utf-8')
+    # Stopping early gives the same text as cutting the full output
+    assert html_to_markdown(html, max_chars=1000) == output[:1000]
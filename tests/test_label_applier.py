@@ -0,0 +1,73 @@
+from fastmail_watcher import FastmailWatcher
+from label_applier import LabelApplier
+
+class JunkProvider:
+    def get_completion(self, content, prompt):
+        return 'junk'
+
+def email_set_calls(watcher):
+    """Count Email/set calls, and let tests change their responses."""
+    calls = []
+    jmap_call = watcher._jmap_call
+
+    def counting(method_calls):
+        calls.extend(call for call in method_calls if call[0] == 'Email/set')
+        responses = jmap_call(method_calls)
+        for rewrite in counting.rewrites:
+            rewrite(responses)
+        return responses
+    counting.rewrites = []
+    watcher._jmap_call = counting
+    return calls, counting.rewrites
+
+def test_updates_are_batched(jmap_server):
+    server = jmap_server(10, max_objects_in_set=2, max_calls_in_request=2)
+    watcher = FastmailWatcher('token', session_url=server.session_url)
+    applier = LabelApplier(watcher)
+    labels = ['fyi', 'junk', 'inbox', 'fyi', 'junk', 'fyi', 'junk', 'fyi', 'junk', 'fyi']
+    assert applier.apply([(f'e{i}', label) for i, label in enumerate(labels)]) == {}
+
+    # Nine moves in chunks of two, two chunks per request, after one Mailbox/get
+    assert (applier.applied, applier.requests) == (9, 1 + 3)
+    emails = server.mailbox.emails_by_id
+    assert emails['e0']['mailboxIds'] == {'mb-fyi': True}
+    assert emails['e1']['mailboxIds'] == {'mb-junk': True} and emails['e1']['keywords'] == {'$junk': True}
+    assert emails['e2']['mailboxIds'] == {'mb-inbox': True}
+
+def test_not_updated_emails_are_retried(jmap_server):
+    server = jmap_server(3)
+    watcher = FastmailWatcher('token', session_url=server.session_url)
+    calls, rewrites = email_set_calls(watcher)
+
+    def fail_e1_once(responses):
+        for name, result, _ in responses:
+            if name == 'Email/set' and 'e1' in (result.get('updated') or {}) and len(calls) == 1:
+                del result['updated']['e1']
+                result['notUpdated'] = {'e1': {'type': 'tooManyChanges'}}
+    rewrites.append(fail_e1_once)
+
+    applier = LabelApplier(watcher, retry_backoff=0)
+    assert applier.apply([('e0', 'fyi'), ('e1', 'fyi')]) == {}
+    assert len(calls) == 2
+    assert list(calls[1][1]['update']) == ['e1']
+
+def test_permanent_errors_are_not_retried(jmap_server):
+    server = jmap_server(3, delivered=2)
+    watcher = FastmailWatcher('token', session_url=server.session_url)
+    calls, _ = email_set_calls(watcher)
+    applier = LabelApplier(watcher, retry_backoff=0)
+    failed = applier.apply([('e0', 'junk'), ('e2', 'junk')])
+    assert failed == {'e2': {'type': 'notFound'}}
+    assert len(calls) == 1
+
+def test_only_inbox_emails_are_classified_and_moved(jmap_server, tmp_path):
+    server = jmap_server(3)
+    server.mailbox.emails_by_id['e1']['mailboxIds'] = {'mb-sent': True}
+    watcher = FastmailWatcher('token', session_url=server.session_url, state_path=str(tmp_path / 'state.sqlite'),
+                              provider=JunkProvider(), apply_labels=True)
+
+    results = watcher.sync_new_emails()
+    assert [email['id'] for email, _ in results] == ['e0', 'e2']
+    emails = server.mailbox.emails_by_id
+    assert emails['e1']['mailboxIds'] == {'mb-sent': True} and emails['e1']['keywords'] == {}
+    assert emails['e0']['mailboxIds'] == {'mb-junk': True}
@@ -0,0 +1,11 @@
+import pytest
+
+from providers.providers import OpenAIProvider
+
+def test_batch_requests_drop_the_label_token_bias():
+    pytest.importorskip('tiktoken')
+    provider = OpenAIProvider(api_key='test', model='gpt-4o-mini', decoding='logit_bias')
+    assert 'logit_bias' in provider.request_args('email', 'prompt')
+    args = provider._json_request_args('emails', 'prompt', {'type': 'object'}, 200)
+    assert 'logit_bias' not in args
+    assert args['max_tokens'] == 200 and args['response_format']['type'] == 'json_schema'
@@ -0,0 +1,27 @@
+import asyncio
+import threading
+
+from pipeline import classify_many
+
+class LoopRecordingProvider:
+    """Answers fyi, noting which event loop each call ran on."""
+    def __init__(self):
+        self.loops = set()
+
+    async def aget_completion(self, content, prompt):
+        self.loops.add(asyncio.get_running_loop())
+        return 'fyi'
+
+def test_calls_share_one_event_loop_across_threads():
+    provider = LoopRecordingProvider()
+
+    def classify():
+        assert classify_many(provider, ['one', 'two', 'three']) == ['fyi'] * 3
+
+    classify()
+    classify()
+    thread = threading.Thread(target=classify)
+    thread.start()
+    thread.join()
+    # So a provider's async client, kept per loop, is created once and reused
+    assert len(provider.loops) == 1
@@ -0,0 +1,38 @@
+import pytest
+
+from providers.replay_provider import InjectedError, RecordingProvider, ReplayProvider
+
+class LiveProvider:
+    def __init__(self):
+        self.last_usage = None
+
+    def get_completion(self, content, prompt):
+        self.last_usage = {'prompt_tokens': len(content), 'completion_tokens': 1}
+        return 'junk' if 'sale' in content else 'inbox'
+
+def test_replays_what_was_recorded(tmp_path):
+    fixture = str(tmp_path / 'fixture.json')
+    recorder = RecordingProvider(LiveProvider(), fixture)
+    assert recorder.get_completion('big sale', 'prompt') == 'junk'
+    assert recorder.get_completion('hi', 'prompt') == 'inbox'
+    recorder.save()
+
+    replay = ReplayProvider(fixture)
+    assert replay.get_completion('big sale', 'prompt') == 'junk'
+    assert replay.last_usage == {'prompt_tokens': 8, 'completion_tokens': 1}
+    assert replay.get_completion('hi', 'prompt') == 'inbox'
+    # The prompt is part of the key
+    with pytest.raises(KeyError):
+        replay.get_completion('hi', 'another prompt')
+    assert ReplayProvider(fixture, default='fyi').get_completion('hi', 'another prompt') == 'fyi'
+
+def test_injects_errors(tmp_path):
+    replay = ReplayProvider(str(tmp_path / 'missing.json'), default='fyi', error_rate=0.5, error_status=429, seed=1)
+    outcomes = []
+    for _ in range(100):
+        try:
+            outcomes.append(replay.get_completion('hi', 'prompt'))
+        except InjectedError as e:
+            assert e.status_code == 429
+    assert replay.errors_injected == 100 - len(outcomes)
+    assert 30 < replay.errors_injected < 70
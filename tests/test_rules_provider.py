@@ -0,0 +1,24 @@
+from email_content import format_email_content, parse_email_content
+from providers.rules_provider import RulesProvider
+
+class Model:
+    def __init__(self):
+        self.calls = 0
+
+    def get_completion(self, content, prompt):
+        self.calls += 1
+        return 'inbox'
+
+def test_headers_read_back_from_content():
+    content = format_email_content('Matt', 'Matt@Example.com', 'Money Stuff: Banks', 'body text')
+    assert content == 'From: Matt <Matt@Example.com>\nSubject: Money Stuff: Banks\n\nbody text'
+    assert parse_email_content(content) == {'sender_email': 'matt@example.com', 'subject': 'Money Stuff: Banks'}
+
+def test_rules_answer_before_the_model():
+    model = Model()
+    provider = RulesProvider(model)
+    assert provider.get_completion(format_email_content('A', 'a@mail.substack.com', 'Hi', ''), 'prompt') == 'junk'
+    assert provider.get_completion(format_email_content('B', 'b@x.com', 'Money Stuff: Banks', ''), 'prompt') == 'fyi'
+    assert provider.get_completion(format_email_content('C', 'c@x.com', 'Lunch?', ''), 'prompt') == 'inbox'
+    assert model.calls == 1
+    assert provider.engine.stats()['no_match'] == 1
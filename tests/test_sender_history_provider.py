@@ -0,0 +1,48 @@
+import sqlite3
+
+from fastmail_watcher import FastmailWatcher
+from providers.sender_history_provider import SenderHistoryIndex
+
+class JunkProvider:
+    def get_completion(self, content, prompt):
+        return 'junk'
+
+def test_shared_domains_only_answer_for_known_addresses(tmp_path):
+    index = SenderHistoryIndex(str(tmp_path / 'history.sqlite'))
+    for sender in ['ann@gmail.com', 'bob@gmail.com', 'cat@gmail.com', 'news@shop.com', 'deals@shop.com',
+                   'offers@shop.com']:
+        index.record(sender, 'fyi' if sender.endswith('gmail.com') else 'junk')
+    assert index.lookup('dan@gmail.com') is None
+    assert index.lookup('sales@shop.com') == ('junk', 1.0, 3)
+
+    for _ in range(2):
+        index.record('ann@gmail.com', 'inbox')
+    assert index.lookup('ann@gmail.com') == ('inbox', 2 / 3, 3)
+
+def test_update_from_dataset_only_reads_new_rows(tmp_path):
+    dataset_path = str(tmp_path / 'dataset.sqlite')
+    dataset = sqlite3.connect(dataset_path)
+    dataset.execute('CREATE TABLE labeled_emails (sender_email TEXT, label TEXT)')
+    dataset.executemany('INSERT INTO labeled_emails VALUES (?, ?)', [('a@shop.com', 'junk')] * 3)
+    dataset.commit()
+
+    index = SenderHistoryIndex(str(tmp_path / 'history.sqlite'))
+    assert index.update_from_dataset(dataset_path) == 3
+    dataset.execute("INSERT INTO labeled_emails VALUES ('a@shop.com', 'junk')")
+    dataset.commit()
+    assert index.update_from_dataset(dataset_path) == 1
+    assert index.lookup('a@shop.com') == ('junk', 1.0, 4)
+
+def test_applied_labels_are_recorded(jmap_server, tmp_path):
+    server = jmap_server(3, delivered=2)
+    history_path = str(tmp_path / 'history.sqlite')
+    watcher = FastmailWatcher('token', session_url=server.session_url, provider=JunkProvider(),
+                              sender_history_path=history_path, apply_labels=True)
+    watcher.label_applier.apply([('e0', 'junk'), ('e2', 'junk')], senders={'e0': 'a@shop.com', 'e2': 'b@other.org'})
+    watcher.sync_new_emails()
+
+    index = SenderHistoryIndex(history_path)
+    assert index.lookup('a@shop.com', min_count=1) == ('junk', 1.0, 1)
+    assert index.lookup('sender1@example.com', min_count=1) == ('junk', 1.0, 1)
+    # e2 was never delivered, so its label couldn't be applied
+    assert index.lookup('b@other.org', min_count=1) is None
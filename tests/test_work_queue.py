@@ -0,0 +1,56 @@
+import time
+
+from fastmail_watcher import FastmailWatcher
+from work_queue import WorkQueue, apply_from_queue, classify_from_queue, fetch_into_queue
+
+def drain(queue: WorkQueue) -> None:
+    for item in queue.lease('fetched', 'test', 100):
+        queue.complete_classification(item, 'inbox', 'test')
+    apply_from_queue(queue, lambda items: {}, 'test')
+
+def test_fetch_into_queue_under_backpressure(jmap_server, tmp_path):
+    server = jmap_server(42, delivered=2, max_objects_in_get=4)
+    watcher = FastmailWatcher('token', session_url=server.session_url, state_path=str(tmp_path / 'state.sqlite'))
+    watcher.state_store.set_state(watcher.account_id, server.mailbox.state)
+    server.mailbox.deliver(40)
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), max_pending=5)
+
+    assert fetch_into_queue(watcher, queue) == 5
+    assert watcher.state_store.get_state(watcher.account_id) == '7'
+    # Full: nothing is fetched and the state stays put
+    assert fetch_into_queue(watcher, queue) == 0
+    assert watcher.state_store.get_state(watcher.account_id) == '7'
+
+    total = 5
+    while total < 40:
+        drain(queue)
+        added = fetch_into_queue(watcher, queue)
+        assert 0 < added <= 5
+        total += added
+    assert watcher.state_store.get_state(watcher.account_id) == '42'
+    assert queue.pending() == 5
+
+def test_expired_leases_run_out_of_attempts(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), lease_seconds=0.01, max_attempts=2)
+    queue.enqueue('account', [('e0', 'content')])
+    # A worker that crashes every time it leases the email
+    for _ in range(2):
+        assert len(queue.lease('fetched', 'test')) == 1
+        time.sleep(0.02)
+    assert queue.lease('fetched', 'test') == []
+    assert queue.stats()['dead'] == 1
+
+class Provider:
+    def __init__(self, answers):
+        self.answers = answers
+
+    def get_completion(self, content, prompt):
+        return self.answers[content]
+
+def test_answers_that_arent_labels_are_retried(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), retry_backoff=0)
+    queue.enqueue('account', [('e0', 'good'), ('e1', 'bad')])
+    assert classify_from_queue(queue, Provider({'good': 'fyi', 'bad': 'no idea'}), 'test') == 2
+    assert queue.stats()['classified'] == 1
+    assert classify_from_queue(queue, Provider({'bad': 'junk'}), 'test') == 1
+    assert queue.stats()['classified'] == 2
@@ -0,0 +1,257 @@
+"""
+Watch many Fastmail accounts from one process. All accounts share one pooled
+HTTP session and one provider stack, and their syncs run on a bounded pool of
+worker threads:
+
+- Each account has at most one sync in flight, and a sync handles at most
+  max_emails_per_sync new emails before the account goes back in the queue,
+  so a big backlog in one mailbox can't hold workers away from the others.
+- Accounts are picked in order of when they're due, so every account gets
+  its turn however many there are.
+- A failing account is retried with exponential backoff, and every request
+  has a timeout, so a slow or broken account only ever ties up its own sync.
+
+Accounts are listed in a JSON file:
+
+    [{"name": "work", "api_token_env": "WORK_FASTMAIL_TOKEN"},
+     {"name": "home", "api_token": "...", "session_url": "http://localhost:8765/jmap/session"}]
+
+Run with ACCOUNTS_PATH pointing at it; the other settings are read from the
+same environment variables as fastmail_watcher.py.
+"""
+import asyncio
+import heapq
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from fastmail_watcher import FastmailWatcher, FASTMAIL_SESSION_URL, build_provider
+from sync_state import SyncStateStore
+
+class SharedProvider:
+    """
+    One provider stack shared by every account, with at most max_in_flight
+    calls running at once across all of them.
+    """
+    def __init__(self, provider, max_in_flight: int = 16):
+        self.provider = provider
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        if hasattr(provider, 'classify_batch'):
+            self.classify_batch = self._classify_batch
+
+    def get_completion(self, content: str, prompt: str) -> str:
+        with self.slots:
+            return self.provider.get_completion(content, prompt)
+
+    async def aget_completion(self, content: str, prompt: str) -> str:
+        # Wait for a slot off the event loop, so other calls on it keep going
+        await asyncio.to_thread(self.slots.acquire)
+        try:
+            if hasattr(self.provider, 'aget_completion'):
+                return await self.provider.aget_completion(content, prompt)
+            return await asyncio.to_thread(self.provider.get_completion, content, prompt)
+        finally:
+            self.slots.release()
+
+    def _classify_batch(self, contents: List[str]) -> List[str]:
+        with self.slots:
+            return self.provider.classify_batch(contents)
+
+class AccountStats:
+    def __init__(self):
+        self.syncs = 0
+        self.emails = 0
+        self.labels = {}
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_sync_at = None
+        self.sync_seconds = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'syncs': self.syncs,
+            'emails': self.emails,
+            'labels': dict(self.labels),
+            'failures': self.failures,
+            'consecutive_failures': self.consecutive_failures,
+            'last_error': self.last_error,
+            'last_sync_at': self.last_sync_at,
+            'mean_sync_seconds': self.sync_seconds / self.syncs if self.syncs else None,
+            'emails_per_second': self.emails / self.sync_seconds if self.sync_seconds else None
+        }
+
+class Account:
+    def __init__(self, name: str, api_token: str, session_url: str = FASTMAIL_SESSION_URL):
+        self.name = name
+        self.api_token = api_token
+        self.session_url = session_url
+        self.watcher = None
+        self.stats = AccountStats()
+
+def load_accounts(path: str) -> List[Account]:
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+
+    accounts = []
+    for entry in entries:
+        api_token = entry.get('api_token') or os.getenv(entry.get('api_token_env', ''))
+        if not api_token:
+            raise ValueError(f"No API token for account {entry['name']}")
+        accounts.append(Account(entry['name'], api_token, entry.get('session_url', FASTMAIL_SESSION_URL)))
+    return accounts
+
+class WatcherDaemon:
+    """
+    Polls every account each `interval` seconds on `workers` threads. stats()
+    reports per-account counters, which are also printed (and written to
+    status_path as JSON, if set) every report_interval seconds.
+    """
+    def __init__(self, accounts: List[Account], provider, workers: int = 4, interval: int = 60,
+                 max_emails_per_sync: int = 50, max_backoff: int = 900, concurrency: int = 4,
+                 state_path: str = 'sync_state.sqlite', report_interval: int = 300,
+                 status_path: Optional[str] = None, apply_labels: bool = False,
+                 sender_history_path: Optional[str] = None):
+        self.accounts = {account.name: account for account in accounts}
+        self.provider = provider
+        self.workers = workers
+        self.interval = interval
+        self.max_emails_per_sync = max_emails_per_sync
+        self.max_backoff = max_backoff
+        self.concurrency = concurrency
+        self.report_interval = report_interval
+        self.status_path = status_path
+        self.apply_labels = apply_labels
+        self.sender_history_path = sender_history_path
+        self.state_store = SyncStateStore(state_path)
+
+        # Enough pooled connections for every worker to have one open per host
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(len(accounts), 1), pool_maxsize=workers)
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        # (due time, tie breaker, account name); accounts with a sync in flight aren't in here
+        self.due = []
+        self.sequence = 0
+        self.started_at = None
+
+    def _schedule(self, name: str, delay: float) -> None:
+        with self.lock:
+            self.sequence += 1
+            heapq.heappush(self.due, (time.monotonic() + delay, self.sequence, name))
+        self.wakeup.set()
+
+    def _watcher(self, account: Account) -> FastmailWatcher:
+        if account.watcher is None:
+            account.watcher = FastmailWatcher(
+                account.api_token,
+                session_url=account.session_url,
+                http=self.http,
+                provider=self.provider,
+                state_store=self.state_store,
+                concurrency=self.concurrency,
+                apply_labels=self.apply_labels,
+                sender_history_path=self.sender_history_path
+            )
+        return account.watcher
+
+    def _sync(self, account: Account) -> None:
+        stats = account.stats
+        start = time.monotonic()
+        try:
+            results = self._watcher(account).sync_new_emails(max_emails=self.max_emails_per_sync)
+        except Exception as e:
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            stats.last_error = f"{type(e).__name__}: {e}"
+            backoff = min(self.interval * 2 ** (stats.consecutive_failures - 1), self.max_backoff)
+            print(f"[{account.name}] sync failed ({stats.last_error}), retrying in {backoff}s")
+            self._schedule(account.name, backoff)
+            return
+
+        stats.syncs += 1
+        stats.sync_seconds += time.monotonic() - start
+        stats.consecutive_failures = 0
+        stats.last_error = None
+        stats.last_sync_at = time.time()
+        stats.emails += len(results)
+        counts = {}
+        for _, label in results:
+            counts[label] = counts.get(label, 0) + 1
+            stats.labels[label] = stats.labels.get(label, 0) + 1
+        if results:
+            print(f"[{account.name}] {len(results)} new: " + ", ".join(f"{label} {n}" for label, n in counts.items()))
+
+        # A full batch means there's probably more waiting, so come back as soon
+        # as the accounts that are already due have had their turn
+        self._schedule(account.name, 0 if len(results) >= self.max_emails_per_sync else self.interval)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: account.stats.as_dict() for name, account in self.accounts.items()}
+
+    def _report(self) -> None:
+        stats = self.stats()
+        total = sum(account['emails'] for account in stats.values())
+        failing = [name for name, account in stats.items() if account['consecutive_failures']]
+        elapsed = time.monotonic() - self.started_at
+        print(f"{len(stats)} accounts, {total} emails labeled ({total / elapsed:.2f}/s)"
+              + (f", failing: {', '.join(failing)}" if failing else ""))
+        if self.status_path:
+            with open(self.status_path, 'w', encoding='utf-8') as f:
+                json.dump(stats, f, indent=2)
+
+    def run(self) -> None:
+        self.started_at = time.monotonic()
+        next_report = self.started_at + self.report_interval
+        for name in self.accounts:
+            self._schedule(name, 0)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sync') as pool:
+            while True:
+                self.wakeup.clear()
+                now = time.monotonic()
+                with self.lock:
+                    ready = []
+                    while self.due and self.due[0][0] <= now:
+                        ready.append(heapq.heappop(self.due)[2])
+                    next_due = self.due[0][0] if self.due else now + self.interval
+                for name in ready:
+                    pool.submit(self._sync, self.accounts[name])
+
+                if now >= next_report:
+                    self._report()
+                    next_report = now + self.report_interval
+                self.wakeup.wait(timeout=max(0.0, min(next_due, next_report) - now))
+
+if __name__ == "__main__":
+    accounts = load_accounts(os.getenv("ACCOUNTS_PATH", "accounts.json"))
+    workers = int(os.getenv("WATCHER_WORKERS", "4"))
+
+    provider = build_provider(
+        os.getenv("LLM_PROVIDER", "openai"),
+        os.getenv("LLM_MODEL", "gpt-4o"),
+        cache_path=os.getenv("CLASSIFICATION_CACHE_PATH", "classification_cache.sqlite"),
+        sender_history_path=os.getenv("SENDER_HISTORY_PATH", "sender_history.sqlite"),
+        decoding=os.getenv("LLM_DECODING")
+    )
+
+    daemon = WatcherDaemon(
+        accounts,
+        SharedProvider(provider, max_in_flight=int(os.getenv("PROVIDER_CONCURRENCY", "16"))),
+        workers=workers,
+        interval=int(os.getenv("WATCH_INTERVAL", "60")),
+        state_path=os.getenv("SYNC_STATE_PATH", "sync_state.sqlite"),
+        status_path=os.getenv("WATCHER_STATUS_PATH"),
+        apply_labels=os.getenv("APPLY_LABELS", "") == "1",
+        sender_history_path=os.getenv("SENDER_HISTORY_PATH", "sender_history.sqlite")
+    )
+    daemon.run()
@@ -0,0 +1,342 @@
+"""
+A durable queue between the watcher's stages, so fetching, classifying and
+applying labels can each run (and crash) on their own:
+
+    fetched -> classified -> applied
+
+Every email is one row in SQLite (in WAL mode, so stages in other processes
+can read while one writes), keyed by account and email id. Workers lease a
+batch of rows in a stage, and moving a row to the next stage only succeeds
+while they still hold the lease, so each step is committed once even if a
+worker dies and its lease runs out and is taken over. Rows that keep failing
+are retried with backoff and then moved to `dead` for a look by hand.
+
+Run each stage as its own process, as many classify workers as you like:
+
+    python work_queue.py fetch      # poll Fastmail into the queue
+    python work_queue.py classify   # label fetched emails
+    python work_queue.py apply      # move the emails in Fastmail (or `print` to just show them)
+    python work_queue.py stats
+    python work_queue.py retry-dead
+"""
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from email_content import parse_email_content
+
+STAGES = ['fetched', 'classified', 'applied', 'dead']
+
+class QueueFull(Exception):
+    """Raised by enqueue when too many emails are still waiting to be processed."""
+
+class WorkQueue:
+    """
+    max_pending is the backpressure limit: fetching stops adding emails while
+    that many are waiting to be classified or applied. A lease lasts
+    lease_seconds, and a row is dead after max_attempts failed leases.
+    """
+    def __init__(self, db_path: str = "work_queue.sqlite", max_pending: int = 10_000,
+                 lease_seconds: float = 300, max_attempts: int = 5, retry_backoff: float = 30):
+        self.max_pending = max_pending
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+
+        self.lock = threading.Lock()
+        # Transactions are managed by hand so leases can be taken with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS work_items (
+            account_id TEXT,
+            email_id TEXT,
+            stage TEXT,
+            content TEXT,
+            label TEXT,
+            attempts INTEGER DEFAULT 0,
+            available_at REAL,
+            lease_owner TEXT,
+            lease_expires_at REAL,
+            last_error TEXT,
+            updated_at REAL,
+            PRIMARY KEY (account_id, email_id)
+        )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS work_items_stage ON work_items (stage, available_at)')
+
+    def pending(self) -> int:
+        """Emails fetched but not yet applied."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM work_items WHERE stage IN ('fetched', 'classified')"
+            ).fetchone()[0]
+
+    def room(self) -> int:
+        """How many more emails can be enqueued before hitting max_pending."""
+        return max(0, self.max_pending - self.pending())
+
+    def enqueue(self, account_id: str, items: List[Tuple[str, str]]) -> int:
+        """
+        Add (email_id, content) pairs as fetched. Emails already in the queue are
+        left alone, so re-fetching after a crash is harmless. Returns how many
+        were new; raises QueueFull if there's no room for them.
+        """
+        if len(items) > self.room():
+            raise QueueFull(f"{self.pending()} emails pending, limit is {self.max_pending}")
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                before = self.conn.total_changes
+                self.conn.executemany('''
+                INSERT OR IGNORE INTO work_items (account_id, email_id, stage, content, available_at, updated_at)
+                VALUES (?, ?, 'fetched', ?, ?, ?)
+                ''', [(account_id, email_id, content, now, now) for email_id, content in items])
+                added = self.conn.total_changes - before
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+        return added
+
+    def lease(self, stage: str, worker_id: str, limit: int = 32) -> List[Dict[str, Any]]:
+        """
+        Claim up to `limit` rows in `stage` that are due and not leased (or whose
+        lease ran out). Each claim counts as an attempt, so a row whose worker
+        keeps dying before it can fail() it is dead after max_attempts leases.
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.execute('''
+                UPDATE work_items
+                SET stage = 'dead', lease_owner = NULL, lease_expires_at = NULL, updated_at = ?,
+                    last_error = 'Lease expired on the last attempt'
+                WHERE stage = ? AND lease_expires_at < ? AND attempts >= ?
+                ''', (now, stage, now, self.max_attempts))
+                rows = self.conn.execute('''
+                SELECT rowid, account_id, email_id, content, label, attempts FROM work_items
+                WHERE stage = ? AND available_at <= ? AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                ORDER BY available_at, rowid
+                LIMIT ?
+                ''', (stage, now, now, limit)).fetchall()
+                self.conn.executemany('''
+                UPDATE work_items SET lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1
+                WHERE rowid = ?
+                ''', [(worker_id, now + self.lease_seconds, row[0]) for row in rows])
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+
+        return [{'account_id': account_id, 'email_id': email_id, 'content': content, 'label': label,
+                 'attempts': attempts + 1}
+                for _, account_id, email_id, content, label, attempts in rows]
+
+    def _advance(self, item: Dict[str, Any], worker_id: str, from_stage: str, to_stage: str,
+                 label: Optional[str] = None) -> bool:
+        with self.lock:
+            cursor = self.conn.execute('''
+            UPDATE work_items
+            SET stage = ?, label = COALESCE(?, label), attempts = 0, lease_owner = NULL,
+                lease_expires_at = NULL, last_error = NULL, available_at = ?, updated_at = ?
+            WHERE account_id = ? AND email_id = ? AND stage = ? AND lease_owner = ?
+            ''', (to_stage, label, time.time(), time.time(), item['account_id'], item['email_id'],
+                  from_stage, worker_id))
+        return cursor.rowcount == 1
+
+    def complete_classification(self, item: Dict[str, Any], label: str, worker_id: str) -> bool:
+        """Record the label. False if the lease was lost and someone else will do it."""
+        return self._advance(item, worker_id, 'fetched', 'classified', label)
+
+    def complete_application(self, item: Dict[str, Any], worker_id: str) -> bool:
+        return self._advance(item, worker_id, 'classified', 'applied')
+
+    def fail(self, item: Dict[str, Any], error: str, worker_id: str) -> None:
+        """Release the lease; the row is retried after a backoff, or goes to dead once out of attempts."""
+        dead = item['attempts'] >= self.max_attempts
+        retry_at = time.time() + self.retry_backoff * 2 ** (item['attempts'] - 1)
+        with self.lock:
+            self.conn.execute('''
+            UPDATE work_items
+            SET stage = CASE WHEN ? THEN 'dead' ELSE stage END, available_at = ?, lease_owner = NULL,
+                lease_expires_at = NULL, last_error = ?, updated_at = ?
+            WHERE account_id = ? AND email_id = ? AND lease_owner = ?
+            ''', (dead, retry_at, error, time.time(), item['account_id'], item['email_id'], worker_id))
+
+    def retry_dead(self) -> int:
+        """Give dead rows another full set of attempts, from the stage they can resume at."""
+        with self.lock:
+            cursor = self.conn.execute('''
+            UPDATE work_items
+            SET stage = CASE WHEN label IS NULL THEN 'fetched' ELSE 'classified' END,
+                attempts = 0, available_at = ?, updated_at = ?
+            WHERE stage = 'dead'
+            ''', (time.time(), time.time()))
+        return cursor.rowcount
+
+    def purge_applied(self, older_than_days: float = 7) -> int:
+        with self.lock:
+            cursor = self.conn.execute("DELETE FROM work_items WHERE stage = 'applied' AND updated_at < ?",
+                                       (time.time() - older_than_days * 24 * 60 * 60,))
+        return cursor.rowcount
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            counts = dict(self.conn.execute('SELECT stage, COUNT(*) FROM work_items GROUP BY stage').fetchall())
+        return {stage: counts.get(stage, 0) for stage in STAGES}
+
+    def close(self) -> None:
+        self.conn.close()
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+def fetch_into_queue(watcher, queue: WorkQueue) -> int:
+    """
+    One fetch step: new emails go into the queue, then the sync state moves
+    past them. Fetches nothing while the queue is full. Returns how many were added.
+    """
+    room = queue.room()
+    if room == 0:
+        return 0
+    emails, new_state = watcher.get_new_emails(max_emails=room)
+    try:
+        added = queue.enqueue(watcher.account_id, [(email['id'], watcher.email_content(email)) for email in emails])
+    except QueueFull:
+        # Only another fetcher filling it first can make the fetch overflow;
+        # anything else would re-fetch the same emails forever
+        if len(emails) <= room:
+            return 0
+        raise
+    # After the emails are safely queued; a crash before this re-fetches them, and enqueue skips duplicates
+    watcher.state_store.set_state(watcher.account_id, new_state)
+    return added
+
+def classify_from_queue(queue: WorkQueue, provider, worker_id: str, batch_size: int = 32,
+                        concurrency: int = 8) -> int:
+    """One classify step over a leased batch. Returns how many were leased."""
+    from pipeline import classify_emails
+    from providers import LABELS
+
+    items = queue.lease('fetched', worker_id, batch_size)
+    if not items:
+        return 0
+    try:
+        labels = classify_emails(provider, [item['content'] for item in items], concurrency=concurrency)
+    except Exception as e:
+        # The pipeline already retried rate limits and server errors
+        for item in items:
+            queue.fail(item, f"{type(e).__name__}: {e}", worker_id)
+        return len(items)
+
+    for item, label in zip(items, labels):
+        if label in LABELS:
+            queue.complete_classification(item, label, worker_id)
+        else:
+            queue.fail(item, f"Not a label: {label!r}", worker_id)
+    return len(items)
+
+def apply_from_queue(queue: WorkQueue, apply: Callable[[List[Dict[str, Any]]], Any], worker_id: str,
+                     batch_size: int = 100) -> int:
+    """
+    One apply step: apply(items) acts on a leased batch of classified emails
+    and must be safe to repeat. It may return {email_id: error} for emails it
+    couldn't apply, which are retried on their own. Returns how many were leased.
+    """
+    items = queue.lease('classified', worker_id, batch_size)
+    if not items:
+        return 0
+    try:
+        failed = apply(items) or {}
+    except Exception as e:
+        for item in items:
+            queue.fail(item, f"{type(e).__name__}: {e}", worker_id)
+        return len(items)
+
+    for item in items:
+        if item['email_id'] in failed:
+            queue.fail(item, str(failed[item['email_id']]), worker_id)
+        else:
+            queue.complete_application(item, worker_id)
+    return len(items)
+
+def label_applier_stage(applier) -> Callable[[List[Dict[str, Any]]], Dict[str, Any]]:
+    """An apply function for apply_from_queue that writes labels to Fastmail with a LabelApplier."""
+    def apply(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        account_id = applier.watcher.account_id
+        failed = {item['email_id']: {'type': 'unknownAccount'}
+                  for item in items if item['account_id'] != account_id}
+        mine = [item for item in items if item['account_id'] == account_id]
+        failed.update(applier.apply([(item['email_id'], item['label']) for item in mine],
+                                    senders={item['email_id']: parse_email_content(item['content'])['sender_email']
+                                             for item in mine}))
+        return failed
+    return apply
+
+def print_labels(items: List[Dict[str, Any]]) -> None:
+    """The watcher's stand-in for applying labels: show them."""
+    for item in items:
+        headers = item['content'].split('\n\n', 1)[0]
+        print(f"{headers}\nClassifer tags this as: {item['label']}")
+        print('-' * 80)
+
+def run_stage(step: Callable[[], int], idle_sleep: float = 5) -> None:
+    """Repeat a stage step forever, sleeping while there's nothing to do."""
+    while True:
+        if not step():
+            time.sleep(idle_sleep)
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    queue = WorkQueue(os.getenv("WORK_QUEUE_PATH", "work_queue.sqlite"))
+    worker_id = default_worker_id()
+
+    if command == 'fetch':
+        from fastmail_watcher import FastmailWatcher, FASTMAIL_SESSION_URL
+
+        api_token = os.getenv("FASTMAIL_API_TOKEN")
+        if not api_token:
+            raise ValueError("Please set FASTMAIL_API_TOKEN environment variable")
+        watcher = FastmailWatcher(api_token, session_url=os.getenv("FASTMAIL_SESSION_URL", FASTMAIL_SESSION_URL),
+                                  state_path=os.getenv("SYNC_STATE_PATH", "sync_state.sqlite"))
+        run_stage(lambda: fetch_into_queue(watcher, queue), idle_sleep=int(os.getenv("WATCH_INTERVAL", "60")))
+    elif command == 'classify':
+        from fastmail_watcher import build_provider
+
+        provider = build_provider(
+            os.getenv("LLM_PROVIDER", "openai"),
+            os.getenv("LLM_MODEL", "gpt-4o"),
+            cache_path=os.getenv("CLASSIFICATION_CACHE_PATH", "classification_cache.sqlite"),
+            sender_history_path=os.getenv("SENDER_HISTORY_PATH", "sender_history.sqlite"),
+            decoding=os.getenv("LLM_DECODING")
+        )
+        run_stage(lambda: classify_from_queue(queue, provider, worker_id))
+    elif command == 'apply':
+        from fastmail_watcher import FastmailWatcher, FASTMAIL_SESSION_URL
+        from label_applier import LabelApplier
+        from providers import SenderHistoryIndex
+
+        api_token = os.getenv("FASTMAIL_API_TOKEN")
+        if not api_token:
+            raise ValueError("Please set FASTMAIL_API_TOKEN environment variable")
+        watcher = FastmailWatcher(api_token, session_url=os.getenv("FASTMAIL_SESSION_URL", FASTMAIL_SESSION_URL))
+        # One applier for the whole run, so the mailboxes are only looked up once
+        apply = label_applier_stage(LabelApplier(
+            watcher, sender_history=SenderHistoryIndex(os.getenv("SENDER_HISTORY_PATH", "sender_history.sqlite"))))
+        run_stage(lambda: apply_from_queue(queue, apply, worker_id))
+    elif command == 'print':
+        run_stage(lambda: apply_from_queue(queue, print_labels, worker_id))
+    elif command == 'retry-dead':
+        print(f"Requeued {queue.retry_dead()} dead emails")
+    elif command == 'stats':
+        print(queue.stats())
+    else:
+        raise ValueError(f"Unknown command: {command}")